@@ -18,7 +18,27 @@ import secrets
 from modules.auth import auth_bp
 from modules.user_management import user_bp
 from modules.email_service import init_mail
-from modules.aimodelapp import aimodelapp_bp
+from modules.migrations import init_migrations, migration_health
+from modules.auth_middleware import init_auth_middleware
+from modules.user_cache import init_user_cache
+from modules.password_hash import init_password_hash
+from modules.aimodelapp import aimodelapp_bp, load_ai_config
+from modules.ai_client import init_ai_client
+from modules.ai_config import init_ai_config
+from modules.ai_jobs import init_ai_jobs
+from modules.ai_cache import init_ai_cache
+from modules.translation_memory import init_translation_memory
+from modules.markdown_chunks import init_markdown_chunks
+from modules.ai_singleflight import init_ai_singleflight
+from modules.ai_router import init_ai_router
+from modules.context_budget import init_context_budget
+from modules.chat_sessions import init_chat_sessions
+from modules.coins import init_coins
+from modules.ai_usage import init_ai_usage
+from modules.ai_admission import init_ai_admission
+from modules.rate_limit import init_rate_limiter
+from modules.ai_metrics import init_ai_metrics
+from modules.deadline import init_deadline
 
 from config import Config
 
@@ -37,9 +57,69 @@ def create_app():
     mongo = PyMongo(app)
     app.mongo = mongo
     
+    # 初始化数据库迁移（启动时同步建索引）
+    init_migrations(app)
+    
     # 初始化邮件服务
     init_mail(app)
     
+    # 初始化统一认证（before_request中验证JWT）
+    init_auth_middleware(app)
+    
+    # 初始化用户文档缓存
+    init_user_cache(app)
+    
+    # 初始化密码哈希进程池配置
+    init_password_hash(app)
+    
+    # 初始化AI配置缓存
+    init_ai_config(app)
+    
+    # 初始化AI异步任务线程池配置
+    init_ai_jobs(app)
+    
+    # 初始化AI响应缓存
+    init_ai_cache(app)
+    
+    # 初始化翻译记忆
+    init_translation_memory(app)
+    
+    # 初始化长文排版分块
+    init_markdown_chunks(app)
+    
+    # 初始化AI请求合并
+    init_ai_singleflight(app)
+    
+    # 初始化AI提供商路由（熔断与对冲）
+    init_ai_router(app)
+    
+    # 初始化AI对话上下文预算
+    init_context_budget(app)
+    
+    # 初始化AI对话会话
+    init_chat_sessions(app)
+    
+    # 初始化萌芽币预扣
+    init_coins(app)
+    
+    # 初始化AI使用记录
+    init_ai_usage(app)
+    
+    # 初始化AI准入控制
+    init_ai_admission(app)
+    
+    # 初始化AI服务商限额
+    init_rate_limiter(app)
+    
+    # 初始化AI调用指标
+    init_ai_metrics(app)
+    
+    # 初始化AI请求截止时间
+    init_deadline(app)
+    
+    # 初始化AI服务连接池（gunicorn在fork后的worker中创建应用，预热发生在各worker内）
+    init_ai_client(app, load_ai_config())
+    
     # 注册蓝图
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(user_bp, url_prefix='/api/user')
@@ -77,6 +157,7 @@ def create_app():
         return jsonify({
             'status': 'running',
             'database': db_status,
+            'migrations': migration_health(),
             'timestamp': datetime.now().isoformat()
         })
     
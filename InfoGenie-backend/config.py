@@ -18,9 +18,30 @@ class Config:
     
     # 基础配置
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'infogenie-secret-key-2025'
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # 管理接口令牌（X-Admin-Token），未设置时管理接口关闭
     
     # MongoDB 配置
     MONGO_URI = os.environ.get('MONGO_URI') or 'mongodb://localhost:27017/InfoGenie'
+    MIGRATIONS_ON_STARTUP = os.environ.get('MIGRATIONS_ON_STARTUP', 'true').lower() == 'true'  # 启动时同步执行未完成的数据库迁移（建索引）
+    MIGRATIONS_CONNECT_TIMEOUT = float(os.environ.get('MIGRATIONS_CONNECT_TIMEOUT', 5))  # 启动迁移前等待数据库可用的最长时间（秒）
+    MIGRATIONS_REQUIRED = os.environ.get('MIGRATIONS_REQUIRED', 'false').lower() == 'true'  # 启动迁移失败时终止启动（否则记录错误并在/api/health中显示）
+    
+    # 统一认证配置（before_request中验证JWT，验证结果按token摘要缓存到exp）
+    AUTH_TOKEN_CACHE_ENABLED = os.environ.get('AUTH_TOKEN_CACHE_ENABLED', 'true').lower() == 'true'
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000))  # 每个worker缓存的已验证token数
+    AUTH_REVOCATION_SYNC_INTERVAL = float(os.environ.get('AUTH_REVOCATION_SYNC_INTERVAL', 5))  # 从revoked_tokens集合同步注销列表的间隔（秒）
+    
+    # 用户文档缓存配置（每个worker的用户快照，按version字段复核）
+    USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', 'true').lower() == 'true'
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))  # 每个worker缓存的用户数
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 2))  # 快照免复核直接使用的时间（秒）
+    USER_CACHE_MAX_AGE = float(os.environ.get('USER_CACHE_MAX_AGE', 300))  # 快照最长保留时间（秒），期间按版本复核
+    
+    # 密码哈希配置（每个worker的有界进程池，登录时按当前参数透明升级旧哈希）
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')  # werkzeug哈希算法及成本，如scrypt:32768:8:1
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))  # 每个worker各自启动的哈希进程数（整机为worker数×该值），0表示在请求线程中计算
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 4))  # 每个worker进程排队的哈希上限，超出返回503（同步worker每次只有一个请求）
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))  # 单次哈希的最长等待时间（秒）
     
     # hwt 配置
     HWT_LIFETIME = timedelta(days=7)  # hwt持续7天
@@ -43,6 +64,115 @@ class Config:
     # API 配置
     API_RATE_LIMIT = '100 per hour'  # API调用频率限制
     
+    # AI服务连接池配置（每个gunicorn worker、每个提供商各一个连接池）
+    AI_POOL_CONNECTIONS = int(os.environ.get('AI_POOL_CONNECTIONS', 4))  # 缓存的主机连接池数量
+    AI_POOL_MAXSIZE = int(os.environ.get('AI_POOL_MAXSIZE', 10))  # 每个主机保持的最大keep-alive连接数
+    AI_POOL_WARMUP = os.environ.get('AI_POOL_WARMUP', 'false').lower() == 'true'  # worker启动后预热连接（只在supervisord的gunicorn中开启，测试和命令行脚本不预热）
+    
+    # AI配置文件（进程内缓存，mtime变化、SIGHUP或管理员接口触发重新加载）
+    AI_CONFIG_PATH = os.environ.get('AI_CONFIG_PATH')  # 为空时使用后端根目录下的ai_config.json
+    AI_CONFIG_CHECK_INTERVAL = float(os.environ.get('AI_CONFIG_CHECK_INTERVAL', 2))  # mtime检查间隔（秒）
+    
+    # AI异步任务配置（每个worker一个有界线程池，任务持久化到ai_jobs集合）
+    AI_JOB_WORKERS = int(os.environ.get('AI_JOB_WORKERS', 4))  # 后台执行线程数
+    AI_JOB_MAX_PENDING = int(os.environ.get('AI_JOB_MAX_PENDING', 16))  # 排队+执行中的任务上限
+    AI_JOB_RESULT_TTL = int(os.environ.get('AI_JOB_RESULT_TTL', 86400))  # 任务结果保留时间（秒）
+    AI_JOB_TIMEOUT = int(os.environ.get('AI_JOB_TIMEOUT', 600))  # 超过该时间未完成视为失败（秒）
+    AI_BACKGROUND_WORKERS = int(os.environ.get('AI_BACKGROUND_WORKERS', 2))  # 内部维护任务（预扣清理、对话摘要）的线程数，与用户任务分开
+    
+    # AI响应缓存配置（进程内LRU + MongoDB ai_response_cache集合）
+    AI_CACHE_ENABLED = os.environ.get('AI_CACHE_ENABLED', 'true').lower() == 'true'
+    AI_CACHE_MEMORY_SIZE = int(os.environ.get('AI_CACHE_MEMORY_SIZE', 1024))  # 每个worker内存缓存条目数
+    AI_CACHE_TTLS = {  # 各接口缓存时间（秒），设为0即关闭该接口的缓存
+        'kinship-calculator': 30 * 86400,
+        'name-analysis': 30 * 86400,
+        'linux-command': 7 * 86400,
+        'variable-naming': 7 * 86400,
+        'classical_conversion': 7 * 86400
+    }
+    
+    # 长文排版分块配置（按标题和段落切块，在每个worker的线程池中并发排版）
+    MARKDOWN_CHUNK_TOKENS = int(os.environ.get('MARKDOWN_CHUNK_TOKENS', 1500))  # 单个分块的原文token预算
+    MARKDOWN_MAX_TOKENS = int(os.environ.get('MARKDOWN_MAX_TOKENS', 4096))  # 单次排版的输出上限
+    MARKDOWN_CHUNK_PARALLELISM = int(os.environ.get('MARKDOWN_CHUNK_PARALLELISM', 4))  # 单个请求同时排版的分块数
+    MARKDOWN_CHUNK_WORKERS = int(os.environ.get('MARKDOWN_CHUNK_WORKERS', 8))  # 每个worker的排版线程数
+    MARKDOWN_MAX_SPLITS = int(os.environ.get('MARKDOWN_MAX_SPLITS', 2))  # 输出被截断时最多再拆分的层数
+    
+    # 翻译记忆配置（句段级，进程内LRU + MongoDB translation_memory集合）
+    TRANSLATION_MEMORY_ENABLED = os.environ.get('TRANSLATION_MEMORY_ENABLED', 'true').lower() == 'true'
+    TRANSLATION_MEMORY_SIZE = int(os.environ.get('TRANSLATION_MEMORY_SIZE', 4096))  # 每个worker内存缓存句段数
+    TRANSLATION_MEMORY_TTL_DAYS = int(os.environ.get('TRANSLATION_MEMORY_TTL_DAYS', 90))  # 句段译文保留天数
+    TRANSLATION_MEMORY_MIN_SEGMENTS = int(os.environ.get('TRANSLATION_MEMORY_MIN_SEGMENTS', 2))  # 原文至少切出该数量的句段才按句段翻译
+    
+    # AI请求合并配置（相同输入的并发请求共享一次上游调用，跨worker通过ai_inflight集合协调）
+    AI_SINGLEFLIGHT_ENABLED = os.environ.get('AI_SINGLEFLIGHT_ENABLED', 'true').lower() == 'true'
+    AI_SINGLEFLIGHT_LEASE = int(os.environ.get('AI_SINGLEFLIGHT_LEASE', 300))  # 执行者租约时长（秒），超时后可被接管
+    AI_SINGLEFLIGHT_WAIT = int(os.environ.get('AI_SINGLEFLIGHT_WAIT', 300))  # 等待者最长等待时间（秒），超时后自行调用
+    AI_SINGLEFLIGHT_RESULT_TTL = int(os.environ.get('AI_SINGLEFLIGHT_RESULT_TTL', 30))  # 结果在租约文档中保留时间（秒）
+    
+    # AI提供商路由配置（按滚动错误率熔断，主提供商超过p95延迟未返回时向备用提供商发起对冲请求）
+    AI_BREAKER_FAILURE_RATE = float(os.environ.get('AI_BREAKER_FAILURE_RATE', 0.5))  # 窗口内错误率达到该值时熔断
+    AI_BREAKER_MIN_SAMPLES = int(os.environ.get('AI_BREAKER_MIN_SAMPLES', 5))  # 判断熔断所需的最少样本数
+    AI_BREAKER_COOLDOWN = int(os.environ.get('AI_BREAKER_COOLDOWN', 30))  # 熔断后多久放行探测请求（秒）
+    AI_HEDGE_ENABLED = os.environ.get('AI_HEDGE_ENABLED', 'true').lower() == 'true'
+    AI_HEDGE_MIN_DELAY = float(os.environ.get('AI_HEDGE_MIN_DELAY', 2))  # 对冲等待时间下限（秒）
+    AI_HEDGE_MAX_DELAY = float(os.environ.get('AI_HEDGE_MAX_DELAY', 30))  # 对冲等待时间上限（秒）
+    AI_HEDGE_WORKERS = int(os.environ.get('AI_HEDGE_WORKERS', 8))  # 每个worker的对冲线程数，占满时不再对冲
+    AI_HEDGE_PRIMARY_RETRIES = int(os.environ.get('AI_HEDGE_PRIMARY_RETRIES', 1))  # 有备用提供商时主提供商的尝试次数（默认1，失败即切换不重试）
+    
+    # AI对话上下文预算（/chat按模型裁剪对话历史，估算token数，不含回复部分）
+    AI_CONTEXT_DEFAULT_BUDGET = int(os.environ.get('AI_CONTEXT_DEFAULT_BUDGET', 16000))  # 未单独配置的模型使用的预算
+    AI_CONTEXT_BUDGETS = {  # 各模型预算
+        'deepseek-chat': 32000,
+        'deepseek-reasoner': 32000,
+        'kimi-k2-0905-preview': 32000,
+        'kimi-k2-0711-preview': 32000
+    }
+    
+    # AI对话会话配置（chat_sessions集合，未摘要消息过多时后台生成滚动摘要）
+    AI_CHAT_SESSION_TTL = int(os.environ.get('AI_CHAT_SESSION_TTL', 30 * 86400))  # 会话无活动后保留时间（秒）
+    AI_CHAT_SESSION_MAX_MESSAGES = int(os.environ.get('AI_CHAT_SESSION_MAX_MESSAGES', 200))  # 每个会话保存的历史消息上限
+    AI_CHAT_SUMMARY_ENABLED = os.environ.get('AI_CHAT_SUMMARY_ENABLED', 'true').lower() == 'true'
+    AI_CHAT_SUMMARY_TRIGGER = int(os.environ.get('AI_CHAT_SUMMARY_TRIGGER', 24))  # 未摘要消息达到该数量时生成摘要
+    AI_CHAT_SUMMARY_KEEP = int(os.environ.get('AI_CHAT_SUMMARY_KEEP', 8))  # 生成摘要时保留原文的最近消息数
+    
+    # 萌芽币预扣配置（AI调用前预扣，成功确认、失败退回，超时未结算的预扣由后台清理退回）
+    AI_COIN_RESERVATION_TIMEOUT = int(os.environ.get('AI_COIN_RESERVATION_TIMEOUT', 900))  # 预扣超过该时间未结算即退回（秒）
+    AI_COIN_SWEEP_INTERVAL = int(os.environ.get('AI_COIN_SWEEP_INTERVAL', 60))  # 每个worker清理超时预扣的间隔（秒）
+    
+    # AI使用记录配置（写入ai_usage集合，每个worker缓冲后批量插入）
+    AI_USAGE_BATCH_SIZE = int(os.environ.get('AI_USAGE_BATCH_SIZE', 50))  # 缓冲达到该条数时立即写入
+    AI_USAGE_FLUSH_INTERVAL = float(os.environ.get('AI_USAGE_FLUSH_INTERVAL', 1.0))  # 最长缓冲时间（秒）
+    
+    # AI准入控制配置（并发计数通过ai_admission集合在worker间共享，名额不足时返回429）
+    AI_ADMISSION_ENABLED = os.environ.get('AI_ADMISSION_ENABLED', 'true').lower() == 'true'
+    AI_ADMISSION_PER_USER = int(os.environ.get('AI_ADMISSION_PER_USER', 2))  # 每个用户同时进行的AI调用上限
+    AI_ADMISSION_GLOBAL = int(os.environ.get('AI_ADMISSION_GLOBAL', 16))  # 全站同时进行的AI调用上限
+    AI_ADMISSION_LEASE = int(os.environ.get('AI_ADMISSION_LEASE', 600))  # 名额占用租约（秒），worker退出后过期释放
+    AI_ADMISSION_MAX_WAIT = float(os.environ.get('AI_ADMISSION_MAX_WAIT', 3))  # 名额不足时最长排队时间（秒）
+    AI_ADMISSION_QUEUE_SIZE = int(os.environ.get('AI_ADMISSION_QUEUE_SIZE', 8))  # 每个worker同时排队的请求上限
+    
+    # AI服务商限额配置（按提供商/模型的RPM、TPM令牌桶，mongo存储时各worker共享）
+    AI_RATE_LIMIT_ENABLED = os.environ.get('AI_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    AI_RATE_LIMIT_STORE = os.environ.get('AI_RATE_LIMIT_STORE', 'mongo')  # mongo或memory
+    AI_RATE_LIMIT_MAX_WAIT = float(os.environ.get('AI_RATE_LIMIT_MAX_WAIT', 2))  # 令牌不足时最长等待时间（秒），超过则切换提供商
+    AI_RATE_LIMITS = {  # 键为"提供商"或"提供商/模型"，按账号实际额度调整
+        'deepseek': {'rpm': 300, 'tpm': 1000000},
+        'kimi': {'rpm': 200, 'tpm': 128000}
+    }
+    
+    # AI调用指标配置（各worker定期把直方图$inc到ai_metrics集合，按小时聚合）
+    AI_METRICS_ENABLED = os.environ.get('AI_METRICS_ENABLED', 'true').lower() == 'true'
+    AI_METRICS_FLUSH_INTERVAL = float(os.environ.get('AI_METRICS_FLUSH_INTERVAL', 5))  # 每个worker写入指标的间隔（秒）
+    AI_METRICS_RETENTION_DAYS = int(os.environ.get('AI_METRICS_RETENTION_DAYS', 7))  # 指标保留天数
+    
+    # AI请求截止时间配置（请求头X-Request-Timeout/X-Request-Deadline优先，否则按接口近期p99推算）
+    AI_DEADLINE_DEFAULT = float(os.environ.get('AI_DEADLINE_DEFAULT', 120))  # 样本不足时的默认截止时间（秒）
+    AI_DEADLINE_MAX = float(os.environ.get('AI_DEADLINE_MAX', 280))  # 截止时间上限，需小于nginx/gunicorn的300秒超时
+    AI_DEADLINE_MIN = float(os.environ.get('AI_DEADLINE_MIN', 10))  # 按p99推算时的下限（秒）
+    AI_DEADLINE_P99_MULTIPLIER = float(os.environ.get('AI_DEADLINE_P99_MULTIPLIER', 2.0))  # 默认截止时间为p99的倍数
+    AI_DEADLINE_MIN_ATTEMPT = float(os.environ.get('AI_DEADLINE_MIN_ATTEMPT', 3))  # 剩余时间少于该值时不再发起新的尝试（秒）
+    
     # 外部API配置
     EXTERNAL_APIS = {
         '60s': [
@@ -75,6 +205,7 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     MONGO_URI = 'mongodb://localhost:27017/InfoGenie_Test'
+    AI_POOL_WARMUP = False
 
 # 配置字典
 config = {
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI请求准入控制模块
+限制每个用户和全站同时进行的AI调用数，计数通过MongoDB ai_admission集合在worker间共享：
+每个计数文档的holders数组记录占用者，数组长度即并发数，占用者带过期时间防止worker退出后泄漏。
+名额不足时短暂排队等待，仍无名额则快速拒绝并给出预计的重试等待时间
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import math
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+GLOBAL_KEY = 'global'
+
+
+class AdmissionController:
+    """基于MongoDB共享计数的并发准入控制"""
+
+    def __init__(self):
+        self.enabled = True
+        self.per_user = 2
+        self.global_limit = 16
+        self.lease_seconds = 600
+        self.max_wait = 3.0
+        self.queue_size = 8
+        self.poll_interval = 0.2
+        self.avg_hold = 10.0  # 每个worker观测到的平均占用时长（秒），用于估算Retry-After
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=True, per_user=2, global_limit=16, lease_seconds=600,
+                  max_wait=3.0, queue_size=8):
+        """更新并发上限、占用租约、最长排队时间和每个worker的排队上限"""
+        self.enabled = enabled
+        self.per_user = per_user
+        self.global_limit = global_limit
+        self.lease_seconds = lease_seconds
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+
+    def _try_take(self, db, key, limit, token):
+        """数组第limit个位置不存在（并发数未满）时追加占用者"""
+        now = datetime.utcnow()
+        holder = {
+            'token': token,
+            'started_at': now,
+            'expires_at': now + timedelta(seconds=self.lease_seconds)
+        }
+        try:
+            result = db.ai_admission.update_one(
+                {'_id': key, f'holders.{limit - 1}': {'$exists': False}},
+                {'$push': {'holders': holder}},
+                upsert=True
+            )
+            return result.modified_count > 0 or result.upserted_id is not None
+        except DuplicateKeyError:
+            # 文档已存在且已满，upsert插入冲突
+            return False
+
+    def _take(self, db, key, limit, token):
+        """占用名额；已满时先清理过期占用者再试一次"""
+        if self._try_take(db, key, limit, token):
+            return True
+        pruned = db.ai_admission.update_one(
+            {'_id': key},
+            {'$pull': {'holders': {'expires_at': {'$lt': datetime.utcnow()}}}}
+        )
+        return pruned.modified_count > 0 and self._try_take(db, key, limit, token)
+
+    def _take_both(self, db, user_key, token):
+        """
+        依次占用用户名额和全站名额
+
+        Returns:
+            str: 已满的计数键，全部占用成功时为None
+        """
+        if not self._take(db, user_key, self.per_user, token):
+            return user_key
+        if not self._take(db, GLOBAL_KEY, self.global_limit, token):
+            db.ai_admission.update_one({'_id': user_key}, {'$pull': {'holders': {'token': token}}})
+            return GLOBAL_KEY
+        return None
+
+    def retry_after(self, db, key, limit):
+        """按最早占用者的开始时间和平均占用时长估算多久后会有空余名额（秒）"""
+        doc = db.ai_admission.find_one({'_id': key}, {'holders.started_at': 1})
+        starts = sorted(h['started_at'] for h in (doc or {}).get('holders', []))
+        if len(starts) < limit:
+            return 1
+        elapsed = (datetime.utcnow() - starts[len(starts) - limit]).total_seconds()
+        return max(1, math.ceil(self.avg_hold - elapsed))
+
+    def acquire(self, db, user_id):
+        """
+        为一次AI调用申请准入名额，必要时在max_wait内排队等待
+
+        Returns:
+            tuple: (ticket, retry_after)，被拒绝时ticket为None，retry_after为建议的重试秒数
+        """
+        if not self.enabled:
+            return {'token': None}, None
+
+        token = uuid.uuid4().hex
+        user_key = f'user:{user_id}'
+        full = self._take_both(db, user_key, token)
+        if full is None:
+            return self._ticket(token, user_key), None
+
+        # 排队等待：每个worker的排队人数有上限，排满时立即拒绝
+        with self._lock:
+            queued = self._waiting < self.queue_size
+            if queued:
+                self._waiting += 1
+        if queued:
+            try:
+                deadline = time.monotonic() + self.max_wait
+                interval = self.poll_interval
+                while time.monotonic() < deadline:
+                    time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+                    interval = min(interval * 1.5, 1.0)
+                    full = self._take_both(db, user_key, token)
+                    if full is None:
+                        return self._ticket(token, user_key), None
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+        limit = self.per_user if full == user_key else self.global_limit
+        return None, self.retry_after(db, full, limit)
+
+    def _ticket(self, token, user_key):
+        return {'token': token, 'user_key': user_key, 'acquired_at': time.monotonic()}
+
+    def release(self, db, ticket):
+        """一次更新同时释放用户名额和全站名额，并更新平均占用时长"""
+        if not ticket or not ticket.get('token'):
+            return
+        held = time.monotonic() - ticket['acquired_at']
+        with self._lock:
+            self.avg_hold = self.avg_hold * 0.8 + held * 0.2
+        try:
+            db.ai_admission.update_many(
+                {'_id': {'$in': [ticket['user_key'], GLOBAL_KEY]}},
+                {'$pull': {'holders': {'token': ticket['token']}}}
+            )
+        except Exception as e:
+            print(f"释放AI准入名额失败: {str(e)}")
+
+
+# 全局准入控制实例
+ai_admission = AdmissionController()
+
+
+#初始化AI准入控制
+def init_ai_admission(app):
+    """读取并发上限和排队配置"""
+    ai_admission.configure(
+        enabled=app.config.get('AI_ADMISSION_ENABLED', True),
+        per_user=app.config.get('AI_ADMISSION_PER_USER', 2),
+        global_limit=app.config.get('AI_ADMISSION_GLOBAL', 16),
+        lease_seconds=app.config.get('AI_ADMISSION_LEASE', 600),
+        max_wait=app.config.get('AI_ADMISSION_MAX_WAIT', 3.0),
+        queue_size=app.config.get('AI_ADMISSION_QUEUE_SIZE', 8)
+    )
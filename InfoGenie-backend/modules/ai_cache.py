@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI响应缓存模块
+两级缓存：进程内LRU（带TTL）+ MongoDB共享集合（TTL索引），用于输入高度重复的确定性AI接口
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+class LRUTTLCache:
+    """线程安全的进程内LRU缓存，条目按各自TTL过期"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """读取未过期的条目，命中时移到队尾"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """写入条目，超出容量时淘汰最久未使用的条目"""
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+
+#规范化缓存输入
+def normalize_input(value):
+    """去除首尾空白并合并连续空白，字典按键排序，保证等价输入得到相同的键"""
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value.strip())
+    if isinstance(value, dict):
+        return {k: normalize_input(value[k]) for k in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(v) for v in value]
+    return value
+
+
+class ResponseCache:
+    """AI接口响应的两级缓存"""
+
+    def __init__(self):
+        self.enabled = True
+        self.ttls = {}  # 各接口缓存时间只在Config.AI_CACHE_TTLS中配置，初始化前不缓存
+        self.memory = LRUTTLCache()
+        self._indexes_ready = False
+
+    def configure(self, enabled=True, memory_size=1024, ttls=None):
+        """更新缓存开关、内存容量和各接口TTL"""
+        self.enabled = enabled
+        self.memory = LRUTTLCache(memory_size)
+        if ttls is not None:
+            self.ttls = dict(ttls)
+
+    def ttl_for(self, endpoint):
+        """接口的缓存时间，未配置或关闭时为0"""
+        if not self.enabled:
+            return 0
+        return self.ttls.get(endpoint, 0)
+
+    def make_key(self, endpoint, cache_input, model, prompt_version):
+        """由接口名、规范化输入、模型和提示词版本生成缓存键"""
+        raw = json.dumps(
+            [endpoint, normalize_input(cache_input), model, prompt_version],
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def lookup(self, db, key):
+        """
+        依次查询内存和MongoDB
+
+        Returns:
+            tuple: (content, tier)，未命中时为(None, None)
+        """
+        content = self.memory.get(key)
+        if content is not None:
+            return content, 'memory'
+
+        try:
+            doc = db.ai_response_cache.find_one({'_id': key}, {'content': 1, 'expires_at': 1})
+        except Exception as e:
+            print(f"读取AI响应缓存失败: {str(e)}")
+            return None, None
+
+        if not doc:
+            return None, None
+        remaining = (doc['expires_at'] - datetime.utcnow()).total_seconds()
+        if remaining <= 0:
+            return None, None
+        self.memory.set(key, doc['content'], remaining)
+        return doc['content'], 'mongo'
+
+    def store(self, db, key, endpoint, content):
+        """写入两级缓存（MongoDB写入失败不影响本次响应）"""
+        ttl = self.ttl_for(endpoint)
+        if ttl <= 0:
+            return
+        self.memory.set(key, content, ttl)
+        try:
+            self._ensure_indexes(db)
+            db.ai_response_cache.replace_one({'_id': key}, {
+                '_id': key,
+                'endpoint': endpoint,
+                'content': content,
+                'created_at': datetime.now().isoformat(),
+                'expires_at': datetime.utcnow() + timedelta(seconds=ttl)
+            }, upsert=True)
+        except Exception as e:
+            print(f"写入AI响应缓存失败: {str(e)}")
+
+    def _ensure_indexes(self, db):
+        """首次写入时创建过期TTL索引"""
+        if self._indexes_ready:
+            return
+        db.ai_response_cache.create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+
+# 全局响应缓存实例
+ai_response_cache = ResponseCache()
+
+
+#初始化AI响应缓存
+def init_ai_cache(app):
+    """读取缓存开关、容量和各接口TTL配置"""
+    ai_response_cache.configure(
+        enabled=app.config.get('AI_CACHE_ENABLED', True),
+        memory_size=app.config.get('AI_CACHE_MEMORY_SIZE', 1024),
+        ttls=app.config.get('AI_CACHE_TTLS')
+    )
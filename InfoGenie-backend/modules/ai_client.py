@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI服务提供商客户端模块
+为DeepSeek、Kimi等OpenAI兼容接口维护按进程隔离的长连接池
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+import requests
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from .rate_limit import rate_limiter, RATE_LIMIT_ERROR
+from .context_budget import estimate_message_tokens
+from .ai_metrics import ai_metrics
+from .deadline import current_deadline, attempt_timeout, mark_upstream, DEADLINE_ERROR
+
+# 各提供商的对话补全接口路径
+PROVIDER_CHAT_PATHS = {
+    'deepseek': '/chat/completions',
+    'kimi': '/v1/chat/completions'
+}
+
+# 支持response_format={"type": "json_object"}的提供商（提示词中需出现“JSON”字样）
+JSON_MODE_PROVIDERS = {'deepseek', 'kimi'}
+
+# 各提供商单次请求的默认超时时间（秒）
+PROVIDER_TIMEOUTS = {
+    'deepseek': 90,
+    'kimi': 30
+}
+
+# 连接池配置（init_ai_client时由Flask配置覆盖）
+_client_settings = {
+    'pool_connections': 4,
+    'pool_maxsize': 10
+}
+
+# 每个进程独立的会话表：gunicorn fork出的worker不能复用父进程的socket
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+# 当前线程最近一次新建连接的耗时（复用连接时为0），供指标记录使用
+_connect_timing = threading.local()
+
+# 当前线程正在进行的可中断上游请求
+_inflight = threading.local()
+
+
+class _InflightRequest:
+    """一次上游请求使用的连接；被取消时关闭其socket，使阻塞中的读取立即结束"""
+
+    def __init__(self):
+        self.conn = None
+        self.aborted = False
+        self.lock = threading.Lock()
+
+    def attach(self, conn):
+        """发送请求前记下所用连接，已被取消时不再发送"""
+        with self.lock:
+            self.conn = conn
+            aborted = self.aborted
+        if aborted:
+            raise ConnectionAbortedError('请求已取消')
+
+    def check(self):
+        """新建连接完成后检查是否已被取消（连接建立期间无法中断）"""
+        if self.aborted:
+            raise ConnectionAbortedError('请求已取消')
+
+    def detach(self):
+        with self.lock:
+            self.conn = None
+
+    def abort(self):
+        """由置位取消事件的线程调用"""
+        with self.lock:
+            self.aborted = True
+            conn = self.conn
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _TimedConnectionMixin:
+    """记录新建连接耗时，并把连接登记到当前线程的可中断请求上"""
+
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        _connect_timing.seconds = time.monotonic() - started
+        request = getattr(_inflight, 'request', None)
+        if request is not None:
+            request.check()
+
+    def request(self, *args, **kwargs):
+        request = getattr(_inflight, 'request', None)
+        if request is not None:
+            request.attach(self)
+        return super().request(*args, **kwargs)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """记录新建连接（DNS、TCP和TLS握手）耗时的连接池适配器"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+
+#初始化AI客户端
+def init_ai_client(app, providers_config=None):
+    """读取连接池配置；开启AI_POOL_WARMUP且不在测试中时，在当前进程中预热各提供商连接"""
+    _client_settings['pool_connections'] = app.config.get('AI_POOL_CONNECTIONS', 4)
+    _client_settings['pool_maxsize'] = app.config.get('AI_POOL_MAXSIZE', 10)
+
+    if providers_config and app.config.get('AI_POOL_WARMUP', False) and not app.testing:
+        warmup_sessions(providers_config)
+
+#获取提供商会话
+def get_session(provider):
+    """获取当前进程中指定提供商的keep-alive会话（fork后自动重建）"""
+    global _sessions_pid
+    pid = os.getpid()
+    with _sessions_lock:
+        if _sessions_pid != pid:
+            # 父进程的连接不能跨进程共享，直接丢弃而不是关闭
+            _sessions.clear()
+            _sessions_pid = pid
+
+        session = _sessions.get(provider)
+        if session is None:
+            session = requests.Session()
+            adapter = _TimedAdapter(
+                pool_connections=_client_settings['pool_connections'],
+                pool_maxsize=_client_settings['pool_maxsize'],
+                max_retries=0
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[provider] = session
+        return session
+
+#预热提供商连接
+def warmup_sessions(providers_config):
+    """在后台线程中提前完成DNS解析和TCP/TLS握手，返回预热线程"""
+    def _warmup():
+        for provider, provider_config in providers_config.items():
+            api_base = provider_config.get('api_base')
+            if not api_base:
+                continue
+            try:
+                get_session(provider).head(api_base, timeout=5)
+            except Exception as e:
+                print(f"预热{provider}连接失败: {str(e)}")
+
+    thread = threading.Thread(target=_warmup, name='ai-client-warmup', daemon=True)
+    thread.start()
+    return thread
+
+@contextmanager
+def _abort_on_cancel(cancel_event):
+    """
+    请求期间cancel_event置位时立即中断连接，而不是等到单次超时
+    （cancel_event需支持add_callback，如deadline.CancelEvent，普通Event只在两次尝试之间检查）
+    """
+    add_callback = getattr(cancel_event, 'add_callback', None)
+    if add_callback is None:
+        yield
+        return
+    request = _InflightRequest()
+    _inflight.request = request
+    remove = add_callback(request.abort)
+    try:
+        yield
+    finally:
+        remove()
+        request.detach()
+        _inflight.request = None
+
+def _rate_limited_wait(provider, model, response):
+    """
+    处理429响应：按限额响应头校准令牌桶
+
+    Returns:
+        float: 可以在限额等待时间内恢复时返回需等待的秒数，否则返回None（交给路由切换提供商）
+    """
+    reset = rate_limiter.resync(provider, model, response.headers)
+    if reset is None:
+        rate_limiter.mark_exhausted(provider, model)
+        return None
+    return reset if reset <= rate_limiter.max_wait else None
+
+def _begin_attempt(queue_started):
+    """开始一次尝试的计时，queue_started之后的时间计为限额等待"""
+    now = time.monotonic()
+    _connect_timing.seconds = 0.0
+    return {'queue_wait': now - queue_started, 'started': now, 'connect': 0.0, 'ttfb': None}
+
+def _mark_response(timing, response=None):
+    """收到响应头（或请求失败）时记下连接耗时和首字节时间"""
+    timing['connect'] = getattr(_connect_timing, 'seconds', 0.0)
+    if response is not None:
+        timing['ttfb'] = response.elapsed.total_seconds()
+
+def _observe_attempt(timing, provider, model, attempt, status, usage=None, ttft=None, stream=False):
+    """把一次尝试的耗时和用量写入调用指标"""
+    ai_metrics.observe_call(
+        provider, model, attempt + 1, status,
+        queue_wait=timing['queue_wait'],
+        connect=timing['connect'],
+        ttfb=timing['ttfb'],
+        ttft=ttft,
+        total=time.monotonic() - timing['started'],
+        usage=usage,
+        stream=stream
+    )
+
+def _sleep_backoff(attempt, cancel_event=None, delay=None):
+    """指数退避等待（或等待指定秒数）；等待期间请求被取消时返回False"""
+    delay = 2 ** attempt if delay is None else delay
+    if cancel_event is None:
+        time.sleep(delay)
+        return True
+    return not cancel_event.wait(delay)
+
+def _retry_fits(attempt, max_retries, delay, expected_latency=None):
+    """还有重试次数，且等待delay秒后请求剩余时间仍够完成一次尝试"""
+    if attempt >= max_retries - 1:
+        return False
+    deadline = current_deadline()
+    return deadline is None or deadline.can_start(expected_latency, delay)
+
+#调用对话补全接口，带重试机制
+def chat_completion(provider, provider_config, messages, model, max_retries=3,
+                    timeout=None, temperature=0.7, max_tokens=2000, cancel_event=None,
+                    expected_latency=None, json_mode=False):
+    """
+    调用OpenAI兼容的对话补全接口，带重试和指数退避
+
+    cancel_event被置位后不再发起新的尝试（用于对冲请求中取消落后的一方）；
+    每次尝试前从限额令牌桶取令牌，额度不足时返回RATE_LIMIT_ERROR；
+    有请求截止时间时单次超时不超过剩余时间，剩余时间不够完成一次
+    （预计耗时expected_latency秒的）尝试时不再重试；
+    json_mode为True时对支持的提供商请求JSON输出格式
+
+    Returns:
+        tuple: (result, error)，result包含content、finish_reason、usage、model
+    """
+    headers = {
+        'Authorization': f'Bearer {provider_config["api_key"]}',
+        'Content-Type': 'application/json'
+    }
+
+    data = {
+        'model': model,
+        'messages': messages,
+        'temperature': temperature,
+        'max_tokens': max_tokens
+    }
+    if json_mode and provider in JSON_MODE_PROVIDERS:
+        data['response_format'] = {'type': 'json_object'}
+
+    url = f"{provider_config['api_base']}{PROVIDER_CHAT_PATHS.get(provider, '/chat/completions')}"
+    timeout = timeout or PROVIDER_TIMEOUTS.get(provider, 90)
+    session = get_session(provider)
+    estimated_tokens = sum(estimate_message_tokens(m) for m in messages)
+    deadline = current_deadline()
+    if cancel_event is None and deadline is not None:
+        cancel_event = deadline.cancelled
+
+    for attempt in range(max_retries):
+        if cancel_event is not None and cancel_event.is_set():
+            return None, "请求已取消"
+        if deadline is not None and deadline.expired():
+            return None, DEADLINE_ERROR
+        queue_started = time.monotonic()
+        acquired = rate_limiter.acquire(provider, model, estimated_tokens, cancel_event)
+        timing = _begin_attempt(queue_started)
+        if not acquired:
+            if cancel_event is not None and cancel_event.is_set():
+                return None, "请求已取消"
+            _observe_attempt(timing, provider, model, attempt, 'rate_limited')
+            return None, RATE_LIMIT_ERROR
+        try:
+            mark_upstream()
+            with _abort_on_cancel(cancel_event):
+                response = session.post(url, headers=headers, json=data, timeout=attempt_timeout(timeout))
+            _mark_response(timing, response)
+            if cancel_event is not None and cancel_event.is_set():
+                # 等待响应期间请求已被取消（如客户端断开），丢弃结果
+                _observe_attempt(timing, provider, model, attempt, 'cancelled')
+                return None, "请求已取消"
+
+            if response.status_code == 200:
+                rate_limiter.resync(provider, model, response.headers)
+                body = response.json()
+                choice = body['choices'][0]
+                usage = body.get('usage', {})
+                rate_limiter.record_usage(provider, model, estimated_tokens, usage)
+                _observe_attempt(timing, provider, model, attempt, 200, usage=usage)
+                return {
+                    'content': choice['message']['content'],
+                    'finish_reason': choice.get('finish_reason'),
+                    'usage': usage,
+                    'model': body.get('model', model)
+                }, None
+            _observe_attempt(timing, provider, model, attempt, response.status_code)
+            if response.status_code == 429:
+                # 触发提供商限额：不盲目退避，短时间可恢复则等待，否则交给路由切换提供商
+                wait = _rate_limited_wait(provider, model, response)
+                if wait is None or not _retry_fits(attempt, max_retries, wait, expected_latency):
+                    return None, RATE_LIMIT_ERROR
+                print(f"{provider}触发限额，{wait:.1f}秒后重试")
+                if not _sleep_backoff(attempt, cancel_event, wait):
+                    return None, "请求已取消"
+                continue
+            else:
+                error_msg = f"API调用失败: {response.status_code} - {response.text}"
+                if _retry_fits(attempt, max_retries, 2 ** attempt, expected_latency):
+                    print(f"{provider}第{attempt + 1}次尝试失败，等待重试: {error_msg}")
+                    if not _sleep_backoff(attempt, cancel_event):  # 指数退避
+                        return None, "请求已取消"
+                    continue
+                return None, error_msg
+
+        except requests.exceptions.Timeout:
+            _mark_response(timing)
+            if cancel_event is not None and cancel_event.is_set():
+                _observe_attempt(timing, provider, model, attempt, 'cancelled')
+                return None, "请求已取消"
+            _observe_attempt(timing, provider, model, attempt, 'timeout')
+            error_msg = "API请求超时"
+            if _retry_fits(attempt, max_retries, 2 ** attempt, expected_latency):
+                print(f"{provider}第{attempt + 1}次尝试超时，等待重试")
+                if not _sleep_backoff(attempt, cancel_event):  # 指数退避
+                    return None, "请求已取消"
+                continue
+            if deadline is not None and deadline.expired():
+                return None, DEADLINE_ERROR
+            return None, f"{error_msg}（已尝试{attempt + 1}次）"
+
+        except Exception as e:
+            _mark_response(timing)
+            if cancel_event is not None and cancel_event.is_set():
+                # 被取消时连接已被中断，不计为上游故障
+                _observe_attempt(timing, provider, model, attempt, 'cancelled')
+                return None, "请求已取消"
+            _observe_attempt(timing, provider, model, attempt, 'error')
+            error_msg = f"API调用异常: {str(e)}"
+            if _retry_fits(attempt, max_retries, 2 ** attempt, expected_latency):
+                print(f"{provider}第{attempt + 1}次尝试异常，等待重试: {error_msg}")
+                if not _sleep_backoff(attempt, cancel_event):  # 指数退避
+                    return None, "请求已取消"
+                continue
+            return None, f"{error_msg}（已尝试{attempt + 1}次）"
+
+class ChatStream:
+    """流式对话补全响应，逐个产出增量文本；close()会中断上游连接"""
+
+    def __init__(self, response, on_finish=None, started=None):
+        self.response = response
+        self.finish_reason = None
+        self.usage = {}
+        self.ttft = None
+        self.completed = False
+        self.on_finish = on_finish
+        self._started = started or time.monotonic()
+
+    def __iter__(self):
+        try:
+            yield from self._deltas()
+            self.completed = True
+        finally:
+            self._finish()
+
+    def _finish(self):
+        """读完或被中途关闭时回调一次on_finish"""
+        on_finish, self.on_finish = self.on_finish, None
+        if on_finish:
+            on_finish(self)
+
+    def _deltas(self):
+        for line in self.response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                break
+            try:
+                chunk = json.loads(payload)
+            except ValueError:
+                continue
+            if chunk.get('usage'):
+                self.usage = chunk['usage']
+            choices = chunk.get('choices') or []
+            if not choices:
+                continue
+            if choices[0].get('finish_reason'):
+                self.finish_reason = choices[0]['finish_reason']
+            content = (choices[0].get('delta') or {}).get('content')
+            if content:
+                if self.ttft is None:
+                    self.ttft = time.monotonic() - self._started
+                yield content
+
+    def close(self):
+        """关闭上游响应，释放连接"""
+        self.response.close()
+        self._finish()
+
+#打开流式对话补全
+def open_chat_stream(provider, provider_config, messages, model, max_retries=3,
+                     timeout=None, temperature=0.7, max_tokens=2000, json_mode=False):
+    """
+    以stream=True调用对话补全接口，仅在建立连接阶段重试（连接超时和重试同样受请求截止时间约束）
+
+    Returns:
+        tuple: (ChatStream, error)
+    """
+    headers = {
+        'Authorization': f'Bearer {provider_config["api_key"]}',
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream'
+    }
+
+    data = {
+        'model': model,
+        'messages': messages,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'stream': True
+    }
+    if json_mode and provider in JSON_MODE_PROVIDERS:
+        data['response_format'] = {'type': 'json_object'}
+
+    url = f"{provider_config['api_base']}{PROVIDER_CHAT_PATHS.get(provider, '/chat/completions')}"
+    timeout = timeout or PROVIDER_TIMEOUTS.get(provider, 90)
+    session = get_session(provider)
+    estimated_tokens = sum(estimate_message_tokens(m) for m in messages)
+    deadline = current_deadline()
+
+    error_msg = None
+    for attempt in range(max_retries):
+        if deadline is not None and deadline.expired():
+            return None, "请求已取消" if deadline.cancelled.is_set() else DEADLINE_ERROR
+        queue_started = time.monotonic()
+        acquired = rate_limiter.acquire(provider, model, estimated_tokens)
+        timing = _begin_attempt(queue_started)
+        if not acquired:
+            _observe_attempt(timing, provider, model, attempt, 'rate_limited', stream=True)
+            return None, RATE_LIMIT_ERROR
+        try:
+            mark_upstream()
+            response = session.post(url, headers=headers, json=data, timeout=attempt_timeout(timeout), stream=True)
+            _mark_response(timing, response)
+            if response.status_code == 200:
+                rate_limiter.resync(provider, model, response.headers)
+                response.encoding = 'utf-8'
+
+                def on_finish(stream, timing=timing, attempt=attempt):
+                    rate_limiter.record_usage(provider, model, estimated_tokens, stream.usage)
+                    status = 200 if stream.completed else 'aborted'
+                    _observe_attempt(timing, provider, model, attempt, status,
+                                     usage=stream.usage, ttft=stream.ttft, stream=True)
+
+                return ChatStream(response, on_finish=on_finish, started=timing['started']), None
+            _observe_attempt(timing, provider, model, attempt, response.status_code, stream=True)
+            if response.status_code == 429:
+                wait = _rate_limited_wait(provider, model, response)
+                response.close()
+                if wait is None or not _retry_fits(attempt, max_retries, wait):
+                    return None, RATE_LIMIT_ERROR
+                _sleep_backoff(attempt, delay=wait)
+                continue
+            error_msg = f"API调用失败: {response.status_code} - {response.text}"
+            response.close()
+        except requests.exceptions.Timeout:
+            _mark_response(timing)
+            _observe_attempt(timing, provider, model, attempt, 'timeout', stream=True)
+            error_msg = "API请求超时"
+        except Exception as e:
+            _mark_response(timing)
+            _observe_attempt(timing, provider, model, attempt, 'error', stream=True)
+            error_msg = f"API调用异常: {str(e)}"
+
+        if not _retry_fits(attempt, max_retries, 2 ** attempt):
+            return None, f"{error_msg}（已尝试{attempt + 1}次）"
+        print(f"{provider}流式请求第{attempt + 1}次尝试失败，等待重试: {error_msg}")
+        _sleep_backoff(attempt)  # 指数退避
+
+    return None, f"{error_msg}（已尝试{max_retries}次）"
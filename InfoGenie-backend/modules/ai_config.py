@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI配置缓存模块
+进程内缓存ai_config.json，仅在文件修改、收到SIGHUP或管理员触发时重新加载
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import json
+import time
+import signal
+import hashlib
+import threading
+
+# 默认配置文件路径（后端根目录下的ai_config.json）
+DEFAULT_AI_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ai_config.json')
+
+# /models接口的默认提供商和模型
+DEFAULT_PROVIDER = 'deepseek'
+DEFAULT_MODEL = 'deepseek-chat'
+
+
+#校验AI配置结构
+def validate_ai_config(config):
+    """校验提供商配置结构，返回错误信息列表（为空表示通过）"""
+    errors = []
+    if not isinstance(config, dict) or not config:
+        return ['配置文件顶层必须是非空对象']
+
+    for provider, provider_config in config.items():
+        if not isinstance(provider_config, dict):
+            errors.append(f'{provider}: 配置必须是对象')
+            continue
+        for field in ('api_key', 'api_base'):
+            value = provider_config.get(field)
+            if not isinstance(value, str) or not value.strip():
+                errors.append(f'{provider}: 缺少{field}')
+        models = provider_config.get('model')
+        if models is not None:
+            if isinstance(models, str):
+                models = [models]
+            if not isinstance(models, list) or not all(isinstance(m, str) and m for m in models):
+                errors.append(f'{provider}: model必须是字符串或字符串列表')
+    return errors
+
+
+class AIConfigCache:
+    """ai_config.json的进程内缓存"""
+
+    def __init__(self, path=DEFAULT_AI_CONFIG_PATH, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._config = None
+        self._mtime = None
+        self._failed_mtime = None  # 解析或校验失败的文件mtime，文件未再修改时不重复解析和告警
+        self._last_check = 0.0
+        self._reload_requested = False
+        self._models_payload = None
+        self._models_etag = None
+
+    def configure(self, path=None, check_interval=None):
+        """更新配置文件路径和mtime检查间隔"""
+        with self._lock:
+            if path and path != self.path:
+                self.path = path
+                self._mtime = None
+                self._failed_mtime = None
+                self._last_check = 0.0
+            if check_interval is not None:
+                self.check_interval = check_interval
+
+    def request_reload(self):
+        """标记下次访问时强制重新加载（可在信号处理函数中安全调用）"""
+        self._reload_requested = True
+
+    def get(self):
+        """获取当前配置；文件mtime变化时自动重新加载"""
+        now = time.monotonic()
+        if not self._reload_requested and self._config is not None and now - self._last_check < self.check_interval:
+            return self._config
+
+        with self._lock:
+            self._last_check = now
+            force = self._reload_requested
+            self._reload_requested = False
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                if self._config is None:
+                    print(f"加载AI配置失败: {e}")
+                return self._config
+
+            if force or (mtime != self._mtime and mtime != self._failed_mtime):
+                self._load(mtime)
+            return self._config
+
+    def reload(self):
+        """立即重新加载配置文件，返回(是否成功, 错误信息)"""
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                return False, f'配置文件不可读: {str(e)}'
+            self._last_check = time.monotonic()
+            return self._load(mtime)
+
+    def models_response(self):
+        """返回预先计算好的/models响应体和对应的ETag"""
+        self.get()
+        return self._models_payload, self._models_etag
+
+    def _load(self, mtime):
+        """读取并校验配置文件，校验失败时保留上一份有效配置"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except Exception as e:
+            self._failed_mtime = mtime
+            print(f"加载AI配置失败: {e}")
+            return False, f'配置文件解析失败: {str(e)}'
+
+        errors = validate_ai_config(config)
+        if errors:
+            self._failed_mtime = mtime
+            print(f"AI配置校验失败，继续使用旧配置: {'; '.join(errors)}")
+            return False, '; '.join(errors)
+
+        models = {}
+        for provider, provider_config in config.items():
+            if 'model' in provider_config:
+                models[provider] = provider_config['model']
+        payload = {
+            'success': True,
+            'models': models,
+            'default_provider': DEFAULT_PROVIDER,
+            'default_model': DEFAULT_MODEL
+        }
+        body = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+
+        self._config = config
+        self._mtime = mtime
+        self._failed_mtime = None
+        self._models_payload = payload
+        self._models_etag = hashlib.sha1(body).hexdigest()
+        return True, None
+
+
+# 全局配置缓存实例
+ai_config_cache = AIConfigCache()
+
+
+#初始化AI配置缓存
+def init_ai_config(app):
+    """读取配置路径并注册SIGHUP热加载"""
+    ai_config_cache.configure(
+        path=app.config.get('AI_CONFIG_PATH') or DEFAULT_AI_CONFIG_PATH,
+        check_interval=app.config.get('AI_CONFIG_CHECK_INTERVAL', 2.0)
+    )
+
+    # 仅主线程能注册信号处理函数；Windows下没有SIGHUP
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: ai_config_cache.request_reload())
+        except ValueError:
+            pass
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI异步任务模块
+提交后立即返回任务ID，由有界后台线程池执行AI调用，任务状态和结果持久化到MongoDB
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import time
+import uuid
+import threading
+import contextvars
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+from .ai_metrics import ai_metrics
+from .deadline import start_deadline, end_deadline
+
+# 任务执行配置（init_ai_jobs时由Flask配置覆盖）
+_job_settings = {
+    'workers': 4,
+    'max_pending': 16,
+    'result_ttl': 86400,
+    'timeout': 600,
+    'background_workers': 2
+}
+
+# 每个进程独立的线程池和排队名额
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+
+# 内部维护任务的线程池，与用户任务分开，用户任务占满线程时维护任务不受影响
+_background_executor = None
+_background_pid = None
+_indexes_ready = False
+
+
+#初始化异步任务配置
+def init_ai_jobs(app):
+    """读取异步任务线程池配置"""
+    _job_settings['workers'] = app.config.get('AI_JOB_WORKERS', 4)
+    _job_settings['max_pending'] = app.config.get('AI_JOB_MAX_PENDING', 16)
+    _job_settings['result_ttl'] = app.config.get('AI_JOB_RESULT_TTL', 86400)
+    _job_settings['timeout'] = app.config.get('AI_JOB_TIMEOUT', 600)
+    _job_settings['background_workers'] = app.config.get('AI_BACKGROUND_WORKERS', 2)
+
+#判断是否请求异步模式
+def wants_async(data):
+    """客户端通过请求体async=true、查询参数或 Prefer: respond-async 请求头开启异步模式"""
+    value = data.get('async') if isinstance(data, dict) else None
+    if value is None:
+        value = request.args.get('async')
+    if value is True or str(value).lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+def _get_executor():
+    """获取当前进程的后台线程池（fork后重建）"""
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(
+                max_workers=_job_settings['workers'],
+                thread_name_prefix='ai-job'
+            )
+            _slots = threading.BoundedSemaphore(_job_settings['max_pending'])
+            _executor_pid = pid
+        return _executor
+
+#占用任务名额
+def try_acquire_slot():
+    """占用一个排队名额，队列已满时返回False（在扣费前调用）"""
+    _get_executor()
+    return _slots.acquire(blocking=False)
+
+#释放任务名额
+def release_slot():
+    """释放排队名额"""
+    _slots.release()
+
+def _get_background_executor():
+    """获取当前进程的内部维护任务线程池（fork后重建）"""
+    global _background_executor, _background_pid
+    pid = os.getpid()
+    with _executor_lock:
+        if _background_executor is None or _background_pid != pid:
+            _background_executor = ThreadPoolExecutor(
+                max_workers=_job_settings['background_workers'],
+                thread_name_prefix='ai-background'
+            )
+            _background_pid = pid
+        return _background_executor
+
+#提交后台维护任务
+def run_in_background(fn, *args):
+    """在内部线程池中执行维护任务（如预扣清理、对话摘要），不占用用户任务的线程和名额，异常只记录日志"""
+    def runner():
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"后台任务执行失败: {str(e)}")
+    return _get_background_executor().submit(runner)
+
+def _ensure_indexes(db):
+    """首次使用时创建任务过期TTL索引"""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    try:
+        db.ai_jobs.create_index('expires_at', expireAfterSeconds=0)
+        db.ai_jobs.create_index([('user_id', 1), ('created_at', -1)])
+        _indexes_ready = True
+    except Exception as e:
+        print(f"创建ai_jobs索引失败: {str(e)}")
+
+#提交异步任务
+def submit_job(app, view_func, view_kwargs, current_user, json_data, on_complete=None):
+    """
+    记录任务并交给后台线程池执行（调用前必须已通过try_acquire_slot占用名额）
+
+    on_complete(http_status)在任务结束后调用，用于结算萌芽币预扣
+
+    Returns:
+        str: 任务ID
+    """
+    db = app.mongo.db
+    _ensure_indexes(db)
+
+    job_id = uuid.uuid4().hex
+    now = datetime.now()
+    db.ai_jobs.insert_one({
+        '_id': job_id,
+        'user_id': current_user['user_id'],
+        'endpoint': request.path.split('/')[-1],
+        'status': 'queued',
+        'http_status': None,
+        'result': None,
+        'created_at': now.isoformat(),
+        'updated_at': now.isoformat(),
+        'expires_at': datetime.utcnow() + timedelta(seconds=_job_settings['result_ttl'])
+    })
+
+    # 后台执行时去掉模式参数，避免再次进入异步或流式分支
+    payload = {k: v for k, v in (json_data or {}).items() if k not in ('async', 'stream')}
+    # 复制当前上下文，使后台执行的AI调用指标仍归属于该接口
+    _get_executor().submit(
+        contextvars.copy_context().run, _run_job, app, job_id, view_func, view_kwargs,
+        request.path, payload, current_user, on_complete, time.monotonic()
+    )
+    return job_id
+
+def _run_job(app, job_id, view_func, view_kwargs, path, payload, current_user, on_complete=None,
+             submitted_at=None):
+    """在后台线程中重放请求上下文并执行接口函数，保存结果"""
+    jobs = app.mongo.db.ai_jobs
+    http_status = 500
+    if submitted_at is not None:
+        ai_metrics.add_queue_wait(time.monotonic() - submitted_at)
+    # 后台任务没有等待响应的客户端，截止时间为任务执行超时而不是原请求的截止时间
+    deadline = start_deadline(_job_settings['timeout'], capped=False)
+    try:
+        jobs.update_one({'_id': job_id}, {'$set': {
+            'status': 'running',
+            'updated_at': datetime.now().isoformat()
+        }})
+
+        with app.test_request_context(path, method='POST', json=payload):
+            request.current_user = current_user
+            response = app.make_response(view_func(**view_kwargs))
+            http_status = response.status_code
+            result = response.get_json(silent=True)
+
+        jobs.update_one({'_id': job_id}, {'$set': {
+            'status': 'succeeded' if http_status < 400 else 'failed',
+            'http_status': http_status,
+            'result': result,
+            'updated_at': datetime.now().isoformat()
+        }})
+    except Exception as e:
+        print(f"异步任务{job_id}执行失败: {str(e)}")
+        try:
+            jobs.update_one({'_id': job_id}, {'$set': {
+                'status': 'failed',
+                'http_status': 500,
+                'result': {'error': f'任务执行失败: {str(e)}'},
+                'updated_at': datetime.now().isoformat()
+            }})
+        except Exception:
+            pass
+    finally:
+        end_deadline(deadline)
+        release_slot()
+        if on_complete:
+            on_complete(http_status)
+
+#查询异步任务
+def get_job(db, job_id, user_id):
+    """查询属于该用户的任务；执行超时（如worker重启）的任务标记为失败"""
+    job = db.ai_jobs.find_one({'_id': job_id, 'user_id': user_id})
+    if not job or job['status'] not in ('queued', 'running'):
+        return job
+
+    updated_at = datetime.fromisoformat(job['updated_at'])
+    if datetime.now() - updated_at > timedelta(seconds=_job_settings['timeout']):
+        db.ai_jobs.update_one({'_id': job_id, 'status': job['status']}, {'$set': {
+            'status': 'failed',
+            'http_status': 504,
+            'result': {'error': '任务执行超时'},
+            'updated_at': datetime.now().isoformat()
+        }})
+        job = db.ai_jobs.find_one({'_id': job_id})
+    return job
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI调用指标模块
+记录每次调用AI服务商的接口、提供商、模型、尝试次数、状态、排队时间、连接耗时、
+首字节时间、首个token时间、总耗时和token用量，按小时聚合成直方图。
+每个worker先在内存中累加，再定期用$inc批量写入MongoDB ai_metrics集合，
+各worker的数据在同一文档中相加，查询时即为全局统计
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import time
+import atexit
+import bisect
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from flask import request, has_request_context
+from pymongo import UpdateOne
+
+# 耗时直方图的桶上界（秒），最后还有一个+Inf桶
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# 生成速度直方图的桶上界（completion token/秒）
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    'queue_wait': LATENCY_BUCKETS,  # 准入排队、异步任务排队和限额等待
+    'connect': LATENCY_BUCKETS,  # 新建TCP/TLS连接耗时（复用连接为0）
+    'ttfb': LATENCY_BUCKETS,  # 发出请求到收到响应头
+    'ttft': LATENCY_BUCKETS,  # 发出请求到收到第一个token（仅流式）
+    'total': LATENCY_BUCKETS,  # 单次尝试总耗时
+    'tokens_per_second': THROUGHPUT_BUCKETS
+}
+
+LABELS = ('endpoint', 'provider', 'model', 'attempt', 'status', 'stream')
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 当前请求的指标上下文（接口名和尚未计入的排队时间），通过contextvars传递到路由线程
+_request_context = ContextVar('ai_metrics_request', default=None)
+
+
+#按直方图估算分位数
+def histogram_quantile(q, bounds, counts):
+    """在命中的桶内线性插值，落在+Inf桶时返回最大的有限上界"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if seen + count >= rank and count:
+            if index >= len(bounds):
+                return bounds[-1]
+            lower = bounds[index - 1] if index > 0 else 0
+            return round(lower + (bounds[index] - lower) * (rank - seen) / count, 4)
+        seen += count
+    return bounds[-1]
+
+
+class MetricsRecorder:
+    """AI调用指标的进程内累加与批量写入"""
+
+    def __init__(self):
+        self.enabled = True
+        self.flush_interval = 5.0
+        self.retention_days = 7
+        self._app = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        self._indexes_ready = False
+
+    def configure(self, app=None, enabled=True, flush_interval=5.0, retention_days=7):
+        """更新开关、写入间隔和保留天数"""
+        self._app = app
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+
+    def begin_request(self, endpoint, queue_wait=0.0):
+        """开始一次AI请求，记录接口名和准入排队时间"""
+        _request_context.set({'endpoint': endpoint, 'queue_wait': queue_wait})
+
+    def add_queue_wait(self, seconds):
+        """累加当前请求的排队时间（如异步任务在线程池中的等待）"""
+        context = _request_context.get()
+        if context is not None:
+            context['queue_wait'] += seconds
+
+    def _take_request_context(self):
+        """取当前请求的接口名和排队时间；排队时间只计入该请求的第一次调用"""
+        context = _request_context.get()
+        if context is None:
+            endpoint = request.endpoint if has_request_context() else None
+            return endpoint or 'internal', 0.0
+        queue_wait, context['queue_wait'] = context['queue_wait'], 0.0
+        return context['endpoint'], queue_wait
+
+    def observe_call(self, provider, model, attempt, status, queue_wait=0.0, connect=None,
+                     ttfb=None, ttft=None, total=None, usage=None, stream=False):
+        """记录一次对服务商的调用尝试"""
+        if not self.enabled:
+            return
+        endpoint, request_wait = self._take_request_context()
+        labels = {
+            'endpoint': endpoint,
+            'provider': provider,
+            'model': model,
+            'attempt': attempt,
+            'status': str(status),
+            'stream': bool(stream)
+        }
+        usage = usage or {}
+        completion_tokens = usage.get('completion_tokens') or 0
+        values = {
+            'queue_wait': queue_wait + request_wait,
+            'connect': connect,
+            'ttfb': ttfb,
+            'ttft': ttft,
+            'total': total,
+            'tokens_per_second': completion_tokens / total if completion_tokens and total else None
+        }
+
+        incs = {
+            'calls': 1,
+            'prompt_tokens': usage.get('prompt_tokens') or 0,
+            'completion_tokens': completion_tokens
+        }
+        for name, value in values.items():
+            if value is None:
+                continue
+            index = bisect.bisect_left(HISTOGRAMS[name], value)
+            incs[f'h.{name}.b.{index}'] = 1
+            incs[f'h.{name}.sum'] = value
+            incs[f'h.{name}.count'] = 1
+
+        hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        key = (hour,) + tuple(labels[name] for name in LABELS)
+        with self._lock:
+            self._ensure_flusher()
+            entry = self._pending.setdefault(key, {'labels': labels, 'hour': hour, 'incs': {}})
+            for field, value in incs.items():
+                entry['incs'][field] = entry['incs'].get(field, 0) + value
+
+    def _ensure_flusher(self):
+        """启动当前进程的后台写入线程（fork后重建）"""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        self._flusher_pid = pid
+        self._pending = {}
+        threading.Thread(target=self._flush_loop, name='ai-metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _ensure_indexes(self, db):
+        """首次写入时创建小时索引和过期TTL索引"""
+        if self._indexes_ready:
+            return
+        db.ai_metrics.create_index('hour')
+        db.ai_metrics.create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    def flush(self):
+        """把累加的指标批量$inc到ai_metrics集合，失败时放回等待下次写入"""
+        if self._app is None:
+            return 0
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        operations = []
+        for key, entry in pending.items():
+            doc_id = '|'.join(str(part) for part in (entry['hour'].strftime('%Y%m%d%H'),) + key[1:])
+            operations.append(UpdateOne(
+                {'_id': doc_id},
+                {
+                    '$setOnInsert': {
+                        'labels': entry['labels'],
+                        'hour': entry['hour'],
+                        'expires_at': entry['hour'] + timedelta(days=self.retention_days)
+                    },
+                    '$inc': entry['incs']
+                },
+                upsert=True
+            ))
+        try:
+            db = self._app.mongo.db
+            self._ensure_indexes(db)
+            db.ai_metrics.bulk_write(operations, ordered=False)
+            return len(operations)
+        except Exception as e:
+            print(f"写入AI调用指标失败: {str(e)}")
+            with self._lock:
+                for key, entry in pending.items():
+                    current = self._pending.setdefault(key, {
+                        'labels': entry['labels'], 'hour': entry['hour'], 'incs': {}
+                    })
+                    for field, value in entry['incs'].items():
+                        current['incs'][field] = current['incs'].get(field, 0) + value
+            return 0
+
+    def summary(self, db, hours=24, group_by=('endpoint', 'provider', 'model'), filters=None):
+        """
+        汇总最近hours小时的指标，按group_by中的标签分组合并直方图
+
+        Returns:
+            list: 每组的调用次数、token用量和各直方图的次数、平均值与分位数
+        """
+        query = {'hour': {'$gte': datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+                          - timedelta(hours=hours - 1)}}
+        for name, value in (filters or {}).items():
+            query[f'labels.{name}'] = value
+
+        groups = {}
+        for doc in db.ai_metrics.find(query, {'_id': 0, 'expires_at': 0}):
+            labels = doc.get('labels', {})
+            key = tuple(labels.get(name) for name in group_by)
+            group = groups.setdefault(key, {
+                'labels': dict(zip(group_by, key)),
+                'calls': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'h': {}
+            })
+            for field in ('calls', 'prompt_tokens', 'completion_tokens'):
+                group[field] += doc.get(field, 0)
+            for name, data in doc.get('h', {}).items():
+                merged = group['h'].setdefault(name, {'counts': [0] * (len(HISTOGRAMS[name]) + 1), 'sum': 0, 'count': 0})
+                for index, count in data.get('b', {}).items():
+                    merged['counts'][int(index)] += count
+                merged['sum'] += data.get('sum', 0)
+                merged['count'] += data.get('count', 0)
+
+        series = []
+        for group in groups.values():
+            histograms = {}
+            for name, merged in group.pop('h').items():
+                if not merged['count']:
+                    continue
+                histograms[name] = {
+                    'count': merged['count'],
+                    'avg': round(merged['sum'] / merged['count'], 4),
+                    **{f'p{int(q * 100)}': histogram_quantile(q, HISTOGRAMS[name], merged['counts']) for q in QUANTILES}
+                }
+            group['histograms'] = histograms
+            series.append(group)
+        series.sort(key=lambda item: item['calls'], reverse=True)
+        return series
+
+
+# 全局指标实例
+ai_metrics = MetricsRecorder()
+atexit.register(ai_metrics.flush)
+
+
+#初始化AI调用指标
+def init_ai_metrics(app):
+    """读取指标开关、写入间隔和保留天数"""
+    ai_metrics.configure(
+        app=app,
+        enabled=app.config.get('AI_METRICS_ENABLED', True),
+        flush_interval=app.config.get('AI_METRICS_FLUSH_INTERVAL', 5.0),
+        retention_days=app.config.get('AI_METRICS_RETENTION_DAYS', 7)
+    )
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI服务提供商路由模块
+按提供商统计滚动延迟和错误率，故障时熔断并切换到其他提供商；
+主提供商在p95延迟内未返回时向备用提供商发起对冲请求，先成功者胜出
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .ai_client import chat_completion, open_chat_stream
+from .rate_limit import RATE_LIMIT_ERROR
+from .deadline import current_deadline, CancelEvent, DEADLINE_ERROR
+
+# 提供商优先顺序（首选不可用时按此顺序选择备用）
+PROVIDER_ORDER = ['deepseek', 'kimi']
+
+
+class ProviderHealth:
+    """单个提供商的滚动统计与熔断状态"""
+
+    def __init__(self, window_seconds=60, max_samples=200):
+        self.window_seconds = window_seconds
+        self.samples = deque(maxlen=max_samples)
+        self.state = 'closed'  # closed / open / half_open
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def _prune(self, now):
+        while self.samples and now - self.samples[0][0] > self.window_seconds:
+            self.samples.popleft()
+
+    def record(self, latency, ok, failure_rate, min_samples):
+        """记录一次调用结果并更新熔断状态（latency为None时不参与延迟统计）"""
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, latency, ok))
+            self._prune(now)
+            if self.state == 'half_open':
+                self.probe_in_flight = False
+                if ok:
+                    self.state = 'closed'
+                    self.samples.clear()
+                else:
+                    self.state = 'open'
+                    self.opened_at = now
+                return
+            if self.state == 'closed' and len(self.samples) >= min_samples:
+                failures = sum(1 for _, _, success in self.samples if not success)
+                if failures / len(self.samples) >= failure_rate:
+                    self.state = 'open'
+                    self.opened_at = now
+
+    def abort(self):
+        """半开探测请求未得出结果（被取消、因限额未发出或超过截止时间）：结束探测并重新进入熔断冷却"""
+        with self.lock:
+            if self.state == 'half_open':
+                self.probe_in_flight = False
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def available(self, cooldown):
+        """熔断关闭，或冷却结束且没有探测请求在进行时可用"""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                return time.monotonic() - self.opened_at >= cooldown
+            return not self.probe_in_flight
+
+    def begin(self, cooldown):
+        """即将发起调用：冷却结束后的第一个调用作为半开探测请求"""
+        with self.lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= cooldown:
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                self.probe_in_flight = True
+
+    def p95(self):
+        """窗口内成功调用的p95延迟（秒），样本不足时返回None"""
+        with self.lock:
+            self._prune(time.monotonic())
+            latencies = sorted(
+                latency for _, latency, ok in self.samples if ok and latency is not None
+            )
+        if len(latencies) < 5:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def snapshot(self):
+        """当前统计快照"""
+        with self.lock:
+            self._prune(time.monotonic())
+            total = len(self.samples)
+            failures = sum(1 for _, _, ok in self.samples if not ok)
+            state = self.state
+        return {
+            'state': state,
+            'samples': total,
+            'error_rate': round(failures / total, 3) if total else 0.0,
+            'p95_latency': self.p95()
+        }
+
+
+class ProviderRouter:
+    """带熔断和对冲请求的提供商路由"""
+
+    def __init__(self):
+        self.settings = {
+            'failure_rate': 0.5,
+            'min_samples': 5,
+            'cooldown': 30,
+            'hedge_enabled': True,
+            'hedge_min_delay': 2.0,
+            'hedge_max_delay': 30.0,
+            'hedge_workers': 8,
+            'hedge_primary_retries': 1
+        }
+        self.health = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._executor_pid = None
+
+    def configure(self, **settings):
+        """更新熔断和对冲参数"""
+        self.settings.update({k: v for k, v in settings.items() if v is not None})
+
+    def get_health(self, provider):
+        """获取提供商的统计对象"""
+        with self._lock:
+            if provider not in self.health:
+                self.health[provider] = ProviderHealth()
+            return self.health[provider]
+
+    def _get_executor(self):
+        """获取当前进程的对冲线程池及其空闲名额（fork后重建）"""
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.settings['hedge_workers'],
+                    thread_name_prefix='ai-hedge'
+                )
+                self._slots = threading.BoundedSemaphore(self.settings['hedge_workers'])
+                self._executor_pid = pid
+            return self._executor, self._slots
+
+    def _submit(self, *args, **kwargs):
+        """在对冲线程池中调用提供商；线程已全部占用时返回None，不排队等待"""
+        executor, slots = self._get_executor()
+        if not slots.acquire(blocking=False):
+            return None
+        future = executor.submit(contextvars.copy_context().run, self._call, *args, **kwargs)
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def pick_providers(self, config, preferred):
+        """按优先级返回熔断器放行的提供商列表（全部熔断时仍返回首选）"""
+        order = [preferred] + [p for p in PROVIDER_ORDER if p != preferred]
+        order += [p for p in config if p not in order]
+        candidates = [p for p in order if p in config]
+        allowed = [p for p in candidates if self.get_health(p).available(self.settings['cooldown'])]
+        if not allowed and preferred in config:
+            allowed = [preferred]
+        return allowed
+
+    def hedge_delay(self, provider):
+        """
+        发起对冲请求前的等待时间：主提供商的p95延迟，限制在配置的上下限之间；
+        窗口内样本不足、还没有可信的p95时返回None（不对冲，只在失败时切换）
+        """
+        p95 = self.get_health(provider).p95()
+        if p95 is None:
+            return None
+        return min(max(p95, self.settings['hedge_min_delay']), self.settings['hedge_max_delay'])
+
+    def _model_for(self, config, provider, preferred, model):
+        """首选提供商使用请求的模型，切换后使用目标提供商配置的第一个模型"""
+        if provider == preferred and model:
+            return model
+        models = config[provider].get('model') or []
+        return models if isinstance(models, str) else (models[0] if models else model)
+
+    def _call(self, provider, config, messages, model, max_retries, cancel_event, **kwargs):
+        """调用单个提供商并记录延迟与成败（被取消、因限额未发出或超过请求截止时间的调用不计入统计）"""
+        health = self.get_health(provider)
+        if cancel_event.is_set():
+            return provider, model, None, "请求已取消"
+        health.begin(self.settings['cooldown'])
+        start = time.monotonic()
+        recorded = False
+        try:
+            # 以该提供商的p95延迟作为重试能否在截止时间前完成的估计
+            result, error = chat_completion(
+                provider, config[provider], messages, model,
+                max_retries=max_retries, cancel_event=cancel_event, expected_latency=health.p95(), **kwargs
+            )
+            if error not in ("请求已取消", RATE_LIMIT_ERROR, DEADLINE_ERROR):
+                health.record(
+                    time.monotonic() - start, error is None,
+                    self.settings['failure_rate'], self.settings['min_samples']
+                )
+                recorded = True
+        finally:
+            # 未记录结果时结束半开探测，否则熔断器会一直停在半开状态
+            if not recorded:
+                health.abort()
+        return provider, model, result, error
+
+    def chat(self, config, messages, preferred='deepseek', model=None, max_retries=3, **kwargs):
+        """
+        路由一次对话补全调用
+
+        Returns:
+            tuple: (result, error, provider, model)，provider和model为实际应答的提供商和模型
+        """
+        providers = self.pick_providers(config, preferred)
+        if not providers:
+            return None, "AI配置加载失败", preferred, model
+
+        def model_for(provider):
+            return self._model_for(config, provider, preferred, model)
+
+        primary = providers[0]
+        secondary = providers[1] if len(providers) > 1 else None
+        # 请求被取消（客户端断开）时一并取消各提供商的调用；置位时中断进行中的HTTP请求
+        deadline = current_deadline()
+        cancels = {provider: CancelEvent() for provider in providers[:2]}
+        if deadline is not None:
+            for event in cancels.values():
+                deadline.link(event)
+        if secondary is None:
+            _, used_model, result, error = self._call(
+                primary, config, messages, model_for(primary), max_retries, cancels[primary], **kwargs
+            )
+            return result, error, primary, used_model
+
+        # 有备用提供商时主提供商只尝试hedge_primary_retries次（默认1次，不重试），
+        # 失败或超过对冲延迟即转向备用提供商
+        primary_future = self._submit(
+            primary, config, messages, model_for(primary),
+            self.settings['hedge_primary_retries'], cancels[primary], **kwargs
+        )
+        if primary_future is None:
+            # 对冲线程已全部占用：不做对冲，在当前线程按普通方式调用（保留重试），失败后再切换
+            print(f"对冲线程已占满，{primary}按普通方式调用")
+            _, used_model, result, error = self._call(
+                primary, config, messages, model_for(primary), max_retries, cancels[primary], **kwargs
+            )
+            if not error or (deadline is not None and not deadline.can_start(self.get_health(secondary).p95())):
+                return result, error, primary, used_model
+            print(f"{primary}调用失败，切换到{secondary}: {error}")
+            _, used_model, result, error = self._call(
+                secondary, config, messages, model_for(secondary), max(1, max_retries - 1), cancels[secondary],
+                **kwargs
+            )
+            return result, error, secondary, used_model
+
+        pending = {primary_future}
+        delay = self.hedge_delay(primary) if self.settings['hedge_enabled'] else None
+        hedging = delay is not None
+        if deadline is not None:
+            delay = deadline.remaining() if delay is None else min(delay, deadline.remaining())
+        done, pending = wait(pending, timeout=delay)
+        primary_failed = bool(done)
+        if done:
+            provider, used_model, result, error = done.pop().result()
+            if not error:
+                return result, None, provider, used_model
+            print(f"{provider}调用失败，切换到{secondary}: {error}")
+
+        last = (None, "AI服务暂不可用", primary, model_for(primary))
+        # 不对冲（已关闭或主提供商还没有p95）且主提供商仍在进行时，继续等待它直到截止时间
+        if primary_failed or hedging:
+            if deadline is None or deadline.can_start(self.get_health(secondary).p95()):
+                secondary_args = (
+                    secondary, config, messages, model_for(secondary), max(1, max_retries - 1), cancels[secondary]
+                )
+                hedge = self._submit(*secondary_args, **kwargs)
+                if hedge is not None:
+                    if not primary_failed:
+                        print(f"{primary}在{delay:.1f}秒内未响应，向{secondary}发起对冲请求")
+                    pending.add(hedge)
+                elif primary_failed:
+                    # 对冲线程已全部占用，在当前线程调用备用提供商
+                    _, used_model, result, error = self._call(*secondary_args, **kwargs)
+                    return result, error, secondary, used_model
+                else:
+                    print(f"对冲线程已占满，继续等待{primary}")
+            elif primary_failed:
+                # 剩余时间不够备用提供商完成一次调用，直接返回主提供商的错误
+                return None, error, provider, used_model
+        while pending:
+            done, pending = wait(
+                pending, timeout=deadline.remaining() if deadline is not None else None,
+                return_when=FIRST_COMPLETED
+            )
+            if not done:
+                # 截止时间已到仍无结果：取消所有调用（进行中的HTTP请求随即中断）
+                for event in cancels.values():
+                    event.set()
+                return None, DEADLINE_ERROR, primary, model_for(primary)
+            for future in done:
+                provider, used_model, result, error = future.result()
+                if not error:
+                    # 先成功者胜出，取消落后的一方（中断其进行中的HTTP请求，结果被丢弃）
+                    for other, event in cancels.items():
+                        if other != provider:
+                            event.set()
+                    return result, None, provider, used_model
+                last = (None, error, provider, used_model)
+        return last
+
+    def open_stream(self, config, messages, preferred='deepseek', model=None, **kwargs):
+        """
+        按路由顺序建立流式连接，连接失败时切换到下一个提供商（流式输出不做对冲）
+
+        Returns:
+            tuple: (ChatStream, error, provider, model)
+        """
+        providers = self.pick_providers(config, preferred)
+        if not providers:
+            return None, "AI配置加载失败", preferred, model
+        error = None
+        deadline = current_deadline()
+        for index, provider in enumerate(providers):
+            # 第一个提供商只要未超时即可尝试，切换到后续提供商时需留出一次尝试的时间
+            if deadline is not None and (deadline.expired() if index == 0 else not deadline.can_start()):
+                return None, error or DEADLINE_ERROR, provider, model
+            used_model = self._model_for(config, provider, preferred, model)
+            health = self.get_health(provider)
+            health.begin(self.settings['cooldown'])
+            recorded = False
+            try:
+                stream, error = open_chat_stream(provider, config[provider], messages, used_model, **kwargs)
+                # 只记录连接成败，首包时间不代表完整响应延迟
+                if error not in ("请求已取消", RATE_LIMIT_ERROR, DEADLINE_ERROR):
+                    health.record(None, error is None, self.settings['failure_rate'], self.settings['min_samples'])
+                    recorded = True
+            finally:
+                if not recorded:
+                    health.abort()
+            if not error:
+                return stream, None, provider, used_model
+            print(f"{provider}流式连接失败: {error}")
+        return None, error, providers[-1], model
+
+    def snapshot(self):
+        """所有提供商的健康状态"""
+        with self._lock:
+            providers = list(self.health)
+        return {provider: self.get_health(provider).snapshot() for provider in providers}
+
+
+# 全局路由实例
+ai_router = ProviderRouter()
+
+
+#初始化提供商路由
+def init_ai_router(app):
+    """读取熔断和对冲配置"""
+    ai_router.configure(
+        failure_rate=app.config.get('AI_BREAKER_FAILURE_RATE'),
+        min_samples=app.config.get('AI_BREAKER_MIN_SAMPLES'),
+        cooldown=app.config.get('AI_BREAKER_COOLDOWN'),
+        hedge_enabled=app.config.get('AI_HEDGE_ENABLED'),
+        hedge_min_delay=app.config.get('AI_HEDGE_MIN_DELAY'),
+        hedge_max_delay=app.config.get('AI_HEDGE_MAX_DELAY'),
+        hedge_workers=app.config.get('AI_HEDGE_WORKERS'),
+        hedge_primary_retries=app.config.get('AI_HEDGE_PRIMARY_RETRIES')
+    )
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI请求合并模块（single-flight）
+相同输入的并发请求只发起一次上游调用：同一worker内通过线程事件等待，
+跨worker通过MongoDB中的短期租约文档（ai_inflight集合）协调并共享结果
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+
+class _Call:
+    """同一worker内正在进行的一次调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+def _succeeded(content, error):
+    """只有成功结果可以共享给其他请求"""
+    return error is None and content is not None
+
+
+class SingleFlight:
+    """按键合并并发的相同调用"""
+
+    def __init__(self):
+        self.enabled = True
+        self.lease_seconds = 300
+        self.wait_seconds = 300
+        self.result_ttl = 30
+        self.poll_interval = 0.2
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+
+    def configure(self, enabled=True, lease_seconds=300, wait_seconds=300, result_ttl=30):
+        """更新开关、租约时长、跟随者最长等待时间和结果保留时间"""
+        self.enabled = enabled
+        self.lease_seconds = lease_seconds
+        self.wait_seconds = wait_seconds
+        self.result_ttl = result_ttl
+
+    def do(self, db, key, fn):
+        """
+        执行fn()并返回其结果；相同key的并发调用共享同一次执行结果
+
+        fn需返回可JSON序列化的(content, error)元组
+        """
+        if not self.enabled:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # 同一worker内已有相同请求在执行，等待其结果；执行者失败时与跨worker一样不共享错误，
+            # 等待者经租约重新合并调用（只有一个接管执行）
+            if not call.event.wait(self.wait_seconds):
+                return fn()
+            if call.result is not None and _succeeded(*call.result):
+                return call.result
+            return self._do_shared(db, key, fn)
+
+        try:
+            call.result = self._do_shared(db, key, fn)
+            return call.result
+        finally:
+            call.event.set()
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def _do_shared(self, db, key, fn):
+        """跨worker合并：抢到租约的worker执行调用，其余worker轮询租约文档取结果"""
+        token = uuid.uuid4().hex
+        try:
+            self._ensure_indexes(db)
+            leader = self._try_acquire(db, key, token)
+        except Exception as e:
+            print(f"获取请求合并租约失败: {str(e)}")
+            return fn()
+
+        deadline = time.monotonic() + self.wait_seconds
+        interval = self.poll_interval
+        while not leader:
+            if time.monotonic() >= deadline:
+                return fn()
+            time.sleep(interval)
+            interval = min(interval * 1.5, 1.0)
+            try:
+                doc = db.ai_inflight.find_one({'_id': key})
+                if doc and doc['status'] == 'done' and doc['expires_at'] > datetime.utcnow():
+                    return doc['content'], doc['error']
+                # 租约文档消失或已过期（原执行者退出），尝试接管
+                if not doc or doc['expires_at'] <= datetime.utcnow():
+                    leader = self._try_acquire(db, key, token)
+            except Exception as e:
+                print(f"轮询请求合并结果失败: {str(e)}")
+                return fn()
+
+        content, error = None, None
+        try:
+            content, error = fn()
+        finally:
+            self._publish(db, key, token, content, error)
+        return content, error
+
+    def _publish(self, db, key, token, content, error):
+        """只共享成功结果；调用失败时删除租约，等待中的worker重新抢租约自行调用"""
+        try:
+            if _succeeded(content, error):
+                db.ai_inflight.update_one({'_id': key, 'owner': token}, {'$set': {
+                    'status': 'done',
+                    'content': content,
+                    'error': None,
+                    'expires_at': datetime.utcnow() + timedelta(seconds=self.result_ttl)
+                }})
+            else:
+                db.ai_inflight.delete_one({'_id': key, 'owner': token})
+        except Exception as e:
+            print(f"发布请求合并结果失败: {str(e)}")
+
+    def _try_acquire(self, db, key, token):
+        """插入租约文档；已存在时仅在其过期后接管"""
+        now = datetime.utcnow()
+        lease = {
+            'status': 'running',
+            'owner': token,
+            'content': None,
+            'error': None,
+            'expires_at': now + timedelta(seconds=self.lease_seconds)
+        }
+        try:
+            db.ai_inflight.insert_one(dict(lease, _id=key))
+            return True
+        except DuplicateKeyError:
+            pass
+        taken = db.ai_inflight.find_one_and_update(
+            {'_id': key, 'expires_at': {'$lte': now}},
+            {'$set': lease}
+        )
+        return taken is not None
+
+    def _ensure_indexes(self, db):
+        """首次使用时创建过期TTL索引"""
+        if self._indexes_ready:
+            return
+        db.ai_inflight.create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+
+# 全局请求合并实例
+ai_single_flight = SingleFlight()
+
+
+#初始化请求合并
+def init_ai_singleflight(app):
+    """读取请求合并配置"""
+    ai_single_flight.configure(
+        enabled=app.config.get('AI_SINGLEFLIGHT_ENABLED', True),
+        lease_seconds=app.config.get('AI_SINGLEFLIGHT_LEASE', 300),
+        wait_seconds=app.config.get('AI_SINGLEFLIGHT_WAIT', 300),
+        result_ttl=app.config.get('AI_SINGLEFLIGHT_RESULT_TTL', 30)
+    )
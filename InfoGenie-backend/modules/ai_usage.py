@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI使用记录模块
+AI调用记录写入独立的ai_usage集合（按(user_id, timestamp)建索引），
+每个worker先缓冲再批量插入；附带把旧版userdata.ai_usage_history数组迁移过来的脚本
+
+迁移用法（在后端根目录执行）：
+    python -m modules.ai_usage migrate
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import sys
+import atexit
+import hashlib
+import threading
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+# 读取用户文档时排除旧版使用历史数组，避免每次读取都传输完整历史
+USAGE_HISTORY_EXCLUDED = {'ai_usage_history': 0}
+
+
+def _only_duplicates(error):
+    """批量插入的错误是否全部为重复键（记录此前已写入）"""
+    return all(err.get('code') == 11000 for err in error.details.get('writeErrors', []))
+
+
+class UsageLedger:
+    """ai_usage集合的批量写入与查询"""
+
+    def __init__(self):
+        self.batch_size = 50
+        self.flush_interval = 1.0
+        self._buffer = []
+        self._db = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher_pid = None
+        self._indexes_ready = False
+
+    def configure(self, batch_size=50, flush_interval=1.0):
+        """更新批量大小和最长缓冲时间"""
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def _ensure_indexes(self, db):
+        """首次写入时创建(user_id, timestamp)索引"""
+        if self._indexes_ready:
+            return
+        db.ai_usage.create_index([('user_id', ASCENDING), ('timestamp', DESCENDING)])
+        self._indexes_ready = True
+
+    def _ensure_flusher(self):
+        """启动当前进程的后台刷新线程（fork后重建）"""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        self._flusher_pid = pid
+        self._buffer = []
+        threading.Thread(target=self._flush_loop, name='ai-usage-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def record(self, db, user_id, api_type, cost, timestamp=None):
+        """缓冲一条使用记录，达到批量大小或缓冲时间后批量插入"""
+        entry = {
+            'user_id': user_id,
+            'api_type': api_type,
+            'timestamp': timestamp or datetime.now().isoformat(),
+            'cost': cost
+        }
+        with self._lock:
+            self._ensure_flusher()
+            self._db = db
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """把缓冲区中的记录一次性插入，失败时放回缓冲区等待下次重试"""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            db = self._db
+        if not batch:
+            return 0
+        try:
+            self._ensure_indexes(db)
+            db.ai_usage.insert_many(batch, ordered=False)
+            return len(batch)
+        except Exception as e:
+            if isinstance(e, BulkWriteError) and _only_duplicates(e):
+                return len(batch)
+            print(f"写入AI使用记录失败: {str(e)}")
+            with self._lock:
+                # 已成功插入的记录带有_id，重试时会被判为重复而忽略
+                self._buffer = batch + self._buffer
+            return 0
+
+    def recent(self, db, user_id, limit=5):
+        """用户最近的使用记录（按时间正序，与旧版ai_usage_history[-5:]一致）"""
+        records = list(db.ai_usage.find(
+            {'user_id': user_id},
+            {'_id': 0, 'user_id': 0}
+        ).sort('timestamp', DESCENDING).limit(limit))
+        records.reverse()
+        return records
+
+    def migrate_history(self, db, batch=100):
+        """
+        把userdata中的ai_usage_history数组迁移到ai_usage集合并删除数组
+
+        记录按(用户, 序号, 内容)生成确定的_id，中途中断后重复执行不会产生重复记录；
+        迁移期间数组被追加时条件删除失败，该用户会在下一轮重新处理；
+        不是数组的旧值（如null）没有可迁移的记录，直接删除
+
+        Returns:
+            tuple: (迁移的用户数, 迁移的记录数)
+        """
+        self._ensure_indexes(db)
+        db.userdata.update_many(
+            {'ai_usage_history': {'$exists': True, '$not': {'$type': 'array'}}},
+            {'$unset': {'ai_usage_history': ''}}
+        )
+        users_done = records_done = 0
+        while True:
+            # 只取数组，条件删除按整个数组匹配，非数组值在上面已删除，不会被反复取出
+            users = list(db.userdata.find(
+                {'ai_usage_history': {'$type': 'array'}},
+                {'ai_usage_history': 1}
+            ).limit(batch))
+            if not users:
+                break
+            for user in users:
+                history = user['ai_usage_history']
+                user_id = str(user['_id'])
+                docs = []
+                for index, item in enumerate(history):
+                    if not isinstance(item, dict):
+                        continue
+                    raw = f"{user_id}:{index}:{item.get('timestamp')}:{item.get('api_type')}"
+                    docs.append({
+                        '_id': hashlib.sha1(raw.encode('utf-8')).hexdigest(),
+                        'user_id': user_id,
+                        'api_type': item.get('api_type'),
+                        'timestamp': item.get('timestamp'),
+                        'cost': item.get('cost')
+                    })
+                if docs:
+                    try:
+                        db.ai_usage.insert_many(docs, ordered=False)
+                    except BulkWriteError as e:
+                        # 重复执行时已迁移的记录会触发重复键错误，其余错误继续抛出
+                        if not _only_duplicates(e):
+                            raise
+                result = db.userdata.update_one(
+                    {'_id': user['_id'], 'ai_usage_history': history},
+                    {'$unset': {'ai_usage_history': ''}}
+                )
+                if result.modified_count:
+                    users_done += 1
+                    records_done += len(docs)
+        return users_done, records_done
+
+
+# 全局使用记录实例
+usage_ledger = UsageLedger()
+atexit.register(usage_ledger.flush)
+
+
+#初始化AI使用记录
+def init_ai_usage(app):
+    """读取批量写入配置"""
+    usage_ledger.configure(
+        batch_size=app.config.get('AI_USAGE_BATCH_SIZE', 50),
+        flush_interval=app.config.get('AI_USAGE_FLUSH_INTERVAL', 1.0)
+    )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('用法: python -m modules.ai_usage migrate')
+        sys.exit(1)
+    # 命令行迁移不需要预热AI连接
+    os.environ['AI_POOL_WARMUP'] = 'false'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import create_app
+    app = create_app()
+    users, records = usage_ledger.migrate_history(app.mongo.db)
+    print(f'✅ 迁移完成：{users}个用户，{records}条使用记录')
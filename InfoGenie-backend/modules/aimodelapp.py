@@ -6,13 +6,36 @@ Created by: 万象口袋
 Date: 2025-01-15
 """
 
-from flask import Blueprint, request, jsonify, current_app
-import requests
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context, g
 import json
-import os
+import time
 from datetime import datetime
 from bson import ObjectId
 from functools import wraps
+from .ai_config import ai_config_cache
+from .ai_router import ai_router
+from .ai_cache import ai_response_cache
+from .ai_singleflight import ai_single_flight
+from .context_budget import context_budgeter, estimate_tokens
+from .chat_sessions import chat_session_store
+from .kinship import resolve_kinship, DEFAULT_DIALECTS
+from .json_extract import JSON_SCHEMAS, IncrementalJSONExtractor, extract_json, repair_messages
+from .markdown_chunks import split_markdown, outline, stitch, map_bounded, chunk_settings
+from .translation_memory import (
+    translation_memory, split_segments, join_segments, needs_translation, detect_language, language_matches
+)
+from .auth import admin_required, token_required
+from .auth_middleware import AUTH_ERRORS, current_principal, current_auth_error
+from .user_cache import user_cache
+from .coins import reserve_coins, settle_reservation
+from .ai_admission import ai_admission
+from .ai_usage import usage_ledger
+from .ai_metrics import ai_metrics, LABELS as METRIC_LABELS
+from .deadline import (
+    start_deadline, requested_timeout, default_timeout, request_socket,
+    disconnect_watcher, endpoint_latency
+)
+from .ai_jobs import wants_async, try_acquire_slot, release_slot, submit_job, get_job, run_in_background
 
 # 创建蓝图
 aimodelapp_bp = Blueprint('aimodelapp', __name__)
@@ -20,51 +43,92 @@ aimodelapp_bp = Blueprint('aimodelapp', __name__)
 # AI功能萌芽币消耗配置
 AI_COST = 100  # 每次调用AI功能消耗的萌芽币数量
 
+# 可缓存接口的提示词版本，修改对应提示词时递增，使旧缓存自动失效
+PROMPT_VERSIONS = {
+    'kinship-calculator': 2,
+    'name-analysis': 1,
+    'linux-command': 1,
+    'variable-naming': 1,
+    'classical_conversion': 1
+}
+
 # 验证用户萌芽币余额装饰器
 def verify_user_coins(f):
-    """验证用户萌芽币余额并在调用AI功能后扣除相应数量的萌芽币"""
+    """通过准入控制并预扣萌芽币后调用AI功能，调用成功时确认扣费，失败时退回"""
     @wraps(f)
     def decorated(*args, **kwargs):
+        slot_held = False
+        finalize = None
         try:
-            # 获取用户认证信息
-            token = request.headers.get('Authorization')
-            if not token:
-                return jsonify({
-                    'success': False, 
-                    'message': '未提供认证信息',
-                    'error_code': 'auth_required'
-                }), 401
-            
-            if token.startswith('Bearer '):
-                token = token[7:]
-            
-            # 解析JWT token
-            import jwt
-            try:
-                payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-                user_id = payload['user_id']
-            except Exception as jwt_error:
-                print(f"JWT解析错误: {str(jwt_error)}")
+            # 获取统一认证层已验证的用户
+            principal = current_principal()
+            if not principal:
+                if current_auth_error() == 'missing':
+                    return jsonify({
+                        'success': False, 
+                        'message': '未提供认证信息',
+                        'error_code': 'auth_required'
+                    }), 401
                 return jsonify({
                     'success': False, 
                     'message': '无效的认证信息',
                     'error_code': 'invalid_token'
                 }), 401
+            user_id = principal['user_id']
             
-            # 查询用户萌芽币余额
-            users_collection = current_app.mongo.db.userdata
-            user = users_collection.find_one({'_id': ObjectId(user_id)})
+            # 请求截止时间：由请求头指定，或按该接口近期的p99耗时推算
+            request_started = time.monotonic()
+            endpoint = request.endpoint
+            timeout = requested_timeout(request.headers)
+            deadline = start_deadline(timeout if timeout is not None else default_timeout(endpoint))
+            # 请求结束时（流式输出在输出结束后）由teardown恢复，线程复用时不会带到后续请求
+            g.ai_deadline = deadline
             
-            if not user:
+            # 准入控制：用户和全站的并发AI调用数已满时短暂排队，仍无名额则在扣费前返回429
+            db = current_app.mongo.db
+            queue_started = time.monotonic()
+            ticket, retry_after = ai_admission.acquire(db, user_id)
+            ai_metrics.begin_request(request.endpoint, time.monotonic() - queue_started)
+            if not ticket:
+                response = jsonify({
+                    'success': False,
+                    'message': f'AI请求过多，请{retry_after}秒后重试',
+                    'error_code': 'too_many_requests',
+                    'retry_after': retry_after
+                })
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429
+            finalize = lambda http_status: ai_admission.release(db, ticket)
+            
+            # 异步模式：扣费前先占用后台任务名额，队列已满时直接拒绝且不扣费
+            async_mode = wants_async(request.get_json(silent=True))
+            if async_mode and not try_acquire_slot():
+                finalize(503)
                 return jsonify({
-                    'success': False, 
-                    'message': '用户不存在',
-                    'error_code': 'user_not_found'
-                }), 404
+                    'success': False,
+                    'message': 'AI任务队列已满，请稍后重试',
+                    'error_code': 'job_queue_full'
+                }), 503
+            slot_held = async_mode
+            
+            # 一次条件更新完成余额检查和预扣，并发请求不会把余额扣成负数
+            api_type = request.path.split('/')[-1]
+            user, reservation = reserve_coins(db, user_id, api_type, AI_COST)
             
-            # 检查萌芽币余额
-            current_coins = user.get('萌芽币', 0)
-            if current_coins < AI_COST:
+            if not user:
+                finalize(402)
+                if slot_held:
+                    release_slot()
+                    slot_held = False
+                # 仅在预扣失败时再查一次，区分用户不存在和余额不足
+                user = db.userdata.find_one({'_id': ObjectId(user_id)}, {'萌芽币': 1})
+                if not user:
+                    return jsonify({
+                        'success': False, 
+                        'message': '用户不存在',
+                        'error_code': 'user_not_found'
+                    }), 404
+                current_coins = user.get('萌芽币', 0)
                 return jsonify({
                     'success': False, 
                     'message': f'萌芽币余额不足！当前余额: {current_coins}, 需要: {AI_COST}',
@@ -73,15 +137,6 @@ def verify_user_coins(f):
                     'required_coins': AI_COST
                 }), 402
             
-            # 先扣除萌芽币，确保无论服务是否成功都会扣费
-            deduct_result = users_collection.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$inc': {'萌芽币': -AI_COST}}
-            )
-            
-            if deduct_result.modified_count < 1:
-                print(f"警告: 用户 {user_id} 萌芽币扣除失败")
-            
             # 为请求添加用户信息，以便在函数内部使用
             request.current_user = {
                 'user_id': user_id,
@@ -89,28 +144,62 @@ def verify_user_coins(f):
                 'email': user.get('邮箱', '')
             }
             
-            # 保存API调用类型
-            api_type = request.path.split('/')[-1]
+            # 结束时结算预扣（成功确认扣费，失败退回）并释放准入名额；只执行一次
+            settled = {'done': False}
+            sock = None if async_mode else request_socket(request.environ)
             
-            # 添加使用记录
-            usage_record = {
-                'api_type': api_type,
-                'timestamp': datetime.now().isoformat(),
-                'cost': AI_COST
-            }
+            def finalize(http_status):
+                if settled['done']:
+                    return
+                settled['done'] = True
+                disconnect_watcher.unwatch(sock)
+                settle_reservation(db, reservation, http_status)
+                ai_admission.release(db, ticket)
+                # 只统计实际调用了上游的请求，缓存命中等快速应答会拉低p99和推算的默认截止时间
+                if not async_mode and http_status < 400 and deadline.upstream_called:
+                    endpoint_latency.record(endpoint, time.monotonic() - request_started)
+            # 流式输出会接管结算，在输出结束时自行调用
+            request.ai_finalizer = finalize
             
-            # 更新用户的AI使用历史记录
-            users_collection.update_one(
-                {'_id': ObjectId(user_id)},
-                {'$push': {'ai_usage_history': usage_record}}
-            )
+            # 异步模式：交给后台线程池执行，立即返回任务ID，任务结束后再结算
+            if async_mode:
+                job_id = submit_job(
+                    current_app._get_current_object(), f, kwargs,
+                    request.current_user, request.get_json(silent=True),
+                    on_complete=finalize
+                )
+                slot_held = False
+                request.ai_finalizer = None
+                response = jsonify({
+                    'success': True,
+                    'job_id': job_id,
+                    'status': 'queued',
+                    'poll_url': f'/api/aimodelapp/jobs/{job_id}'
+                })
+                response.headers['Location'] = f'/api/aimodelapp/jobs/{job_id}'
+                return response, 202
+            
+            # 客户端断开时取消仍在进行的AI调用
+            disconnect_watcher.watch(sock, deadline)
             
-            # 调用原函数
+            # 调用原函数，成功时确认扣费，出错（含上游失败和超时）时退回萌芽币
             result = f(*args, **kwargs)
             
+            if request.ai_finalizer is not None:
+                response = current_app.make_response(result)
+                if response.status_code == 500 and deadline.expired():
+                    response.status_code = 504
+                request.ai_finalizer = None
+                finalize(response.status_code)
+                return response
             return result
             
         except Exception as e:
+            if slot_held:
+                release_slot()
+            if finalize:
+                request.ai_finalizer = None
+                finalize(500)
             print(f"验证萌芽币时发生错误: {str(e)}")
             return jsonify({
                 'success': False, 
@@ -120,117 +209,278 @@ def verify_user_coins(f):
             
     return decorated
 
+# 对话上下文预检装饰器
+def check_chat_context(f):
+    """在扣费前拒绝格式错误或单条超出模型上下文预算的消息（需放在verify_user_coins之上）"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        data = request.get_json(silent=True) or {}
+        if 'message' in data or data.get('session_id'):
+            # 会话模式只上传本轮消息
+            message = data.get('message')
+            if not isinstance(message, str) or not message.strip():
+                return jsonify({'error': '消息内容不能为空'}), 400
+            messages = [{'role': 'user', 'content': message}]
+        else:
+            messages = data.get('messages', [])
+        if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+            return jsonify({'error': 'messages格式错误，应为消息对象数组'}), 400
+        
+        error = context_budgeter.check(messages, data.get('model', 'deepseek-chat'))
+        if error:
+            return jsonify({'error': error, 'error_code': 'context_too_long'}), 413
+        
+        return f(*args, **kwargs)
+    
+    return decorated
+
 #加载AI配置文件
 def load_ai_config():
-    """加载AI配置文件"""
-    try:
-        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ai_config.json')
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"加载AI配置失败: {e}")
-        return None
+    """获取AI配置（进程内缓存，文件修改后自动重新加载）"""
+    return ai_config_cache.get()
+
+#经提供商路由调用AI
+def call_ai_api(messages, provider='deepseek', model=None, max_retries=3, **kwargs):
+    """
+    优先调用指定提供商；熔断或响应过慢时由路由切换/对冲到其他提供商
+    （kwargs透传给chat_completion，如json_mode、temperature）
+
+    Returns:
+        tuple: (content, error, provider, model)，provider和model为实际应答的提供商和模型
+    """
+    config = load_ai_config()
+    if not config or provider not in config:
+        return None, "AI配置加载失败", provider, model
+    
+    result, error, used_provider, used_model = ai_router.chat(
+        config, messages, provider, model, max_retries=max_retries, **kwargs
+    )
+    if error:
+        return None, error, used_provider, used_model
+    return result['content'], None, used_provider, used_model
 
 #调用DeepSeek API，带重试机制
-def call_deepseek_api(messages, model="deepseek-chat", max_retries=3):
-    """调用DeepSeek API，带重试机制"""
-    config = load_ai_config()
-    if not config or 'deepseek' not in config:
-        return None, "AI配置加载失败"
+def call_deepseek_api(messages, model="deepseek-chat", max_retries=3, **kwargs):
+    """调用DeepSeek API，带重试机制（故障时自动切换到备用提供商）"""
+    content, error, _, _ = call_ai_api(messages, 'deepseek', model, max_retries, **kwargs)
+    return content, error
+
+#调用Kimi API，带重试机制
+def call_kimi_api(messages, model="kimi-k2-0905-preview", max_retries=3):
+    """调用Kimi API，带重试机制（故障时自动切换到备用提供商）"""
+    content, error, _, _ = call_ai_api(messages, 'kimi', model, max_retries)
+    return content, error
+
+#让AI修复一次不合格的JSON输出
+def repair_ai_json(endpoint, content, parse_error, provider='deepseek', model='deepseek-chat', **kwargs):
+    """
+    把原输出（去掉推理块）和失败原因发回模型，只修复一次且不重试（kwargs如max_tokens透传给call_ai_api）
+
+    Returns:
+        tuple: (obj, error)
+    """
+    schema = JSON_SCHEMAS.get(endpoint)
+    print(f"{endpoint}的AI输出不合格（{parse_error}），请求修复")
+    content, error, _, _ = call_ai_api(
+        repair_messages(content, parse_error, schema), provider, model,
+        max_retries=1, json_mode=True, temperature=0, **kwargs
+    )
+    if error:
+        return None, error
+    obj, parse_error = extract_json(content, schema)
+    if obj is None:
+        return None, f'AI返回的数据格式无法解析（{parse_error}）'
+    return obj, None
+
+#以JSON模式调用AI并提取JSON对象
+def call_ai_json(endpoint, messages, provider='deepseek', model='deepseek-chat', **kwargs):
+    """
+    请求提供商的JSON输出格式，按接口schema提取并校验JSON对象，不合格时修复一次
+    （kwargs如max_tokens透传给call_ai_api）
+
+    Returns:
+        tuple: (obj, error)
+    """
+    content, error, used_provider, used_model = call_ai_api(messages, provider, model, json_mode=True, **kwargs)
+    if error:
+        return None, error
+    obj, parse_error = extract_json(content, JSON_SCHEMAS.get(endpoint))
+    if obj is not None:
+        return obj, None
+    return repair_ai_json(endpoint, content, parse_error, used_provider, used_model, **kwargs)
+
+#带响应缓存的DeepSeek调用
+def call_deepseek_cached(endpoint, cache_input, messages, validate=None, model='deepseek-chat', json_output=False):
+    """
+    先查询两级响应缓存，未命中时调用DeepSeek并写回缓存
+
+    缓存未命中时，相同输入的并发请求（含其他worker）合并为一次上游调用，
+    每个请求仍由verify_user_coins单独扣费和记录；
+    请求体中 no_cache=true 时跳过缓存读取；validate返回False的输出不写入缓存；
+    json_output为True时经call_ai_json调用，缓存规范化后的JSON文本，返回的content为解析后的对象
+
+    Returns:
+        tuple: (content, error, cache_meta)
+    """
+    db = current_app.mongo.db
+    key = ai_response_cache.make_key(endpoint, cache_input, model, PROMPT_VERSIONS.get(endpoint, 1))
+    data = request.get_json(silent=True) or {}
     
-    deepseek_config = config['deepseek']
+    if ai_response_cache.ttl_for(endpoint) > 0 and data.get('no_cache') is not True:
+        content, tier = ai_response_cache.lookup(db, key)
+        if content is not None and json_output:
+            content, _ = extract_json(content, JSON_SCHEMAS.get(endpoint))
+        if content is not None:
+            return content, None, {'hit': True, 'tier': tier}
     
-    headers = {
-        'Authorization': f'Bearer {deepseek_config["api_key"]}',
-        'Content-Type': 'application/json'
-    }
+    def fetch():
+        if json_output:
+            obj, error = call_ai_json(endpoint, messages, model=model)
+            content = None if error else json.dumps(obj, ensure_ascii=False)
+        else:
+            content, error = call_deepseek_api(messages, model)
+        if not error and (validate is None or validate(content)):
+            ai_response_cache.store(db, key, endpoint, content)
+        return content, error
     
-    data = {
-        'model': model,
-        'messages': messages,
-        'temperature': 0.7,
-        'max_tokens': 2000
-    }
+    content, error = ai_single_flight.do(db, key, fetch)
+    if error:
+        return None, error, {'hit': False, 'tier': None}
+    if json_output:
+        content = json.loads(content)
+    return content, None, {'hit': False, 'tier': None}
+
+#判断是否请求流式输出
+def wants_stream(data):
+    """客户端通过请求体或查询参数 stream=true 开启SSE流式输出"""
+    value = data.get('stream') if isinstance(data, dict) else None
+    if value is None:
+        value = request.args.get('stream')
+    return value is True or str(value).lower() in ('1', 'true', 'yes')
+
+#格式化SSE事件
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+#以SSE形式转发AI输出
+def stream_ai_response(messages, build_payload, provider='deepseek', model='deepseek-chat', json_endpoint=None, **kwargs):
+    """
+    以流式方式调用AI并通过SSE逐段转发给客户端
+
+    token事件携带增量文本，最后的done事件携带与JSON模式相同的完整响应体；
+    客户端断开时生成器被关闭，随即中断上游连接。
+    指定json_endpoint时以JSON模式调用，边接收边提取JSON对象，build_payload接收解析后的对象：
+    提取到符合schema的对象后立即结束并关闭上游，输出结束仍未提取到时修复一次；
+    kwargs（如max_tokens）透传给open_chat_stream，输出达到上限被截断时done事件带truncated=true
+    """
+    config = load_ai_config()
+    if not config or provider not in config:
+        return jsonify({'error': 'AI配置加载失败'}), 500
     
-    import time
+    stream, error, used_provider, used_model = ai_router.open_stream(
+        config, messages, provider, model, json_mode=json_endpoint is not None, **kwargs
+    )
+    if error:
+        return jsonify({'error': error}), 500
     
-    for attempt in range(max_retries):
+    # 接管结算：上游中断时退回萌芽币，正常结束或客户端主动断开时确认扣费，结束后释放准入名额
+    finalize = getattr(request, 'ai_finalizer', None)
+    request.ai_finalizer = None
+    
+    def generate():
+        parts = []
+        status = 200
+        extractor = IncrementalJSONExtractor(JSON_SCHEMAS.get(json_endpoint)) if json_endpoint else None
         try:
-            # 增加超时时间到90秒
-            response = requests.post(
-                f"{deepseek_config['api_base']}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=90
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content'], None
+            for delta in stream:
+                parts.append(delta)
+                yield sse_event('token', {'content': delta})
+                if extractor is not None and extractor.feed(delta) is not None:
+                    # 对象已完整，不再等待模型输出JSON之后的多余文字
+                    break
+            if extractor is None:
+                payload = build_payload(''.join(parts))
             else:
-                error_msg = f"API调用失败: {response.status_code} - {response.text}"
-                if attempt < max_retries - 1:
-                    print(f"第{attempt + 1}次尝试失败，等待重试: {error_msg}")
-                    time.sleep(2 ** attempt)  # 指数退避
-                    continue
-                return None, error_msg
-                
-        except requests.exceptions.Timeout:
-            error_msg = "API请求超时"
-            if attempt < max_retries - 1:
-                print(f"第{attempt + 1}次尝试超时，等待重试")
-                time.sleep(2 ** attempt)  # 指数退避
-                continue
-            return None, f"{error_msg}（已重试{max_retries}次）"
-            
+                result = extractor.result
+                if result is None:
+                    result, error = repair_ai_json(
+                        json_endpoint, ''.join(parts), extractor.finish(), used_provider, used_model
+                    )
+                    if error:
+                        status = 502
+                        yield sse_event('error', {'error': error})
+                        return
+                payload = build_payload(result)
+            if 'provider' in payload:
+                # 路由切换过提供商时返回实际应答的提供商和模型
+                payload.update(provider=used_provider, model=used_model)
+            if stream.finish_reason == 'length':
+                payload['truncated'] = True
+            yield sse_event('done', payload)
         except Exception as e:
-            error_msg = f"API调用异常: {str(e)}"
-            if attempt < max_retries - 1:
-                print(f"第{attempt + 1}次尝试异常，等待重试: {error_msg}")
-                time.sleep(2 ** attempt)  # 指数退避
-                continue
-            return None, f"{error_msg}（已重试{max_retries}次）"
-
-#调用Kimi API
-def call_kimi_api(messages, model="kimi-k2-0905-preview"):
-    """调用Kimi API"""
-    config = load_ai_config()
-    if not config or 'kimi' not in config:
-        return None, "AI配置加载失败"
-    
-    kimi_config = config['kimi']
+            status = 502
+            yield sse_event('error', {'error': f'流式输出中断: {str(e)}'})
+        finally:
+            stream.close()
+            if finalize:
+                finalize(status)
     
-    headers = {
-        'Authorization': f'Bearer {kimi_config["api_key"]}',
-        'Content-Type': 'application/json'
-    }
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 关闭nginx代理缓冲，保证逐段推送
+        }
+    )
+
+#以SSE形式按顺序输出分块结果
+def stream_chunk_results(results, build_payload):
+    """
+    分块并发生成时按原顺序输出：某个分块及其之前的分块都完成后发送一条token事件，
+    全部完成后done事件携带拼接后的完整响应体；任一分块失败时发送error事件并退回萌芽币
+
+    Args:
+        results: 按顺序产出(content, error)的生成器
+        build_payload: 接收各分块内容列表，返回完整响应体
+    """
+    finalize = getattr(request, 'ai_finalizer', None)
+    request.ai_finalizer = None
     
-    data = {
-        'model': model,
-        'messages': messages,
-        'temperature': 0.7,
-        'max_tokens': 2000
-    }
+    def generate():
+        parts = []
+        status = 200
+        try:
+            for content, error in results:
+                if error:
+                    status = 502
+                    yield sse_event('error', {'error': error})
+                    return
+                parts.append(content)
+                yield sse_event('token', {'content': content.strip() + '\n\n'})
+            yield sse_event('done', build_payload(parts))
+        except Exception as e:
+            status = 502
+            yield sse_event('error', {'error': f'流式输出中断: {str(e)}'})
+        finally:
+            # 停止提交尚未开始的分块
+            results.close()
+            if finalize:
+                finalize(status)
     
-    try:
-        response = requests.post(
-            f"{kimi_config['api_base']}/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content'], None
-        else:
-            return None, f"API调用失败: {response.status_code} - {response.text}"
-            
-    except Exception as e:
-        return None, f"API调用异常: {str(e)}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 #统一的AI聊天接口
 @aimodelapp_bp.route('/chat', methods=['POST'])
+@check_chat_context
 @verify_user_coins
 def ai_chat():
     """统一的AI聊天接口"""
@@ -240,36 +490,134 @@ def ai_chat():
         if not data:
             return jsonify({'error': '请求数据为空'}), 400
         
-        # 获取请求参数
-        messages = data.get('messages', [])
-        model_provider = data.get('provider', 'deepseek')  # 默认使用deepseek
-        model_name = data.get('model', 'deepseek-chat')  # 默认模型
+        # 会话模式：客户端只发送本轮消息，历史从chat_sessions集合读取（未指定session_id时新建会话）
+        session = None
+        if 'message' in data or data.get('session_id'):
+            db = current_app.mongo.db
+            user_id = request.current_user['user_id']
+            if data.get('session_id'):
+                session = chat_session_store.get(db, data['session_id'], user_id)
+                if not session:
+                    return jsonify({'error': '会话不存在或已过期'}), 404
+            else:
+                session = chat_session_store.create(
+                    db, user_id, data.get('system'),
+                    data.get('provider', 'deepseek'), data.get('model', 'deepseek-chat')
+                )
+            message = data['message'].strip()
+            sent_at = datetime.now().isoformat()
+            messages = chat_session_store.build_messages(session, message)
+        else:
+            messages = data.get('messages', [])
+        
+        # 获取请求参数（会话模式下默认沿用会话创建时的提供商和模型）
+        defaults = session or {}
+        model_provider = data.get('provider', defaults.get('provider', 'deepseek'))  # 默认使用deepseek
+        model_name = data.get('model', defaults.get('model', 'deepseek-chat'))  # 默认模型
         
         if not messages:
             return jsonify({'error': '消息内容不能为空'}), 400
         
-        # 根据提供商调用对应的API
-        if model_provider == 'deepseek':
-            content, error = call_deepseek_api(messages, model_name)
-        elif model_provider == 'kimi':
-            content, error = call_kimi_api(messages, model_name)
-        else:
+        if model_provider not in ('deepseek', 'kimi'):
             return jsonify({'error': f'不支持的AI提供商: {model_provider}'}), 400
         
+        # 按模型上下文预算裁剪对话历史：保留system提示词和最近对话，折叠最早的对话
+        messages, context_report = context_budgeter.fit(messages, model_name)
+        
+        def build_response(content, provider=model_provider, model=model_name):
+            payload = {
+                'success': True,
+                'content': content,
+                'provider': provider,
+                'model': model,
+                'context': context_report,
+                'timestamp': datetime.now().isoformat()
+            }
+            if session is not None:
+                # 拿到完整回复后保存本轮对话（流式模式下在输出结束时调用）
+                payload.update(save_session_turn(session['_id'], message, content, sent_at))
+            return payload
+        
+        if wants_stream(data):
+            return stream_ai_response(messages, build_response, model_provider, model_name)
+        
+        # 优先使用请求的提供商，故障时由路由切换，响应中返回实际应答的提供商和模型
+        content, error, provider, model = call_ai_api(messages, model_provider, model_name)
+        
         if error:
             return jsonify({'error': error}), 500
         
-        return jsonify({
-            'success': True,
-            'content': content,
-            'provider': model_provider,
-            'model': model_name,
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify(build_response(content, provider, model))
         
     except Exception as e:
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
 
+#保存会话中的一轮对话
+def save_session_turn(session_id, message, reply, sent_at):
+    """追加本轮消息和回复，未摘要消息过多时提交后台摘要任务，返回响应中附加的会话字段"""
+    db = current_app.mongo.db
+    counters = chat_session_store.append_turn(
+        db, session_id, request.current_user['user_id'], message, reply, sent_at
+    )
+    summarizing = chat_session_store.needs_summary(counters)
+    if summarizing:
+        run_in_background(
+            chat_session_store.summarize, db, session_id,
+            lambda prompt: call_deepseek_api([{'role': 'user', 'content': prompt}])
+        )
+    return {
+        'session_id': session_id,
+        'turn_count': counters['turn_count'] if counters else None,
+        'summarizing': summarizing
+    }
+
+#创建对话会话
+@aimodelapp_bp.route('/chat/sessions', methods=['POST'])
+@token_required
+def create_chat_session():
+    """创建服务端对话会话（不消耗萌芽币），之后/chat只需发送session_id和本轮消息"""
+    try:
+        data = request.get_json(silent=True) or {}
+        provider = data.get('provider', 'deepseek')
+        if provider not in ('deepseek', 'kimi'):
+            return jsonify({'error': f'不支持的AI提供商: {provider}'}), 400
+        
+        session = chat_session_store.create(
+            current_app.mongo.db, request.current_user['user_id'],
+            data.get('system'), provider, data.get('model', 'deepseek-chat')
+        )
+        return jsonify({
+            'success': True,
+            'session_id': session['_id'],
+            'provider': session['provider'],
+            'model': session['model'],
+            'created_at': session['created_at']
+        }), 201
+    except Exception as e:
+        return jsonify({'error': f'创建会话失败: {str(e)}'}), 500
+
+#查询或删除对话会话
+@aimodelapp_bp.route('/chat/sessions/<session_id>', methods=['GET', 'DELETE'])
+@token_required
+def chat_session_detail(session_id):
+    """GET返回会话的摘要和历史消息，DELETE删除会话"""
+    try:
+        db = current_app.mongo.db
+        user_id = request.current_user['user_id']
+        if request.method == 'DELETE':
+            if not chat_session_store.delete(db, session_id, user_id):
+                return jsonify({'error': '会话不存在或已过期'}), 404
+            return jsonify({'success': True, 'message': '会话已删除'}), 200
+        
+        session = chat_session_store.get(db, session_id, user_id)
+        if not session:
+            return jsonify({'error': '会话不存在或已过期'}), 404
+        session['session_id'] = session.pop('_id')
+        session.pop('user_id', None)
+        return jsonify({'success': True, 'session': session}), 200
+    except Exception as e:
+        return jsonify({'error': f'查询会话失败: {str(e)}'}), 500
+
 #姓名分析专用接口
 @aimodelapp_bp.route('/name-analysis', methods=['POST'])
 @verify_user_coins
@@ -317,8 +665,8 @@ def name_analysis():
             {"role": "user", "content": prompt}
         ]
         
-        # 使用DeepSeek进行分析
-        content, error = call_deepseek_api(messages)
+        # 使用DeepSeek进行分析（优先命中响应缓存）
+        content, error, cache_meta = call_deepseek_cached('name-analysis', {'name': name}, messages)
         
         if error:
             return jsonify({'error': error}), 500
@@ -327,6 +675,7 @@ def name_analysis():
             'success': True,
             'analysis': content,
             'name': name,
+            'cache': cache_meta,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -402,37 +751,29 @@ def variable_naming():
             {"role": "user", "content": prompt}
         ]
         
-        # 使用DeepSeek进行分析
-        content, error = call_deepseek_api(messages)
+        def build_response(ai_response, cache_meta=None):
+            return {
+                'success': True,
+                'suggestions': ai_response['suggestions'],
+                'description': description,
+                'language': language,
+                'cache': cache_meta or {'hit': False, 'tier': None},
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        if wants_stream(data):
+            return stream_ai_response(messages, build_response, json_endpoint='variable-naming')
+        
+        # 使用DeepSeek进行分析（优先命中响应缓存），按JSON模式提取并校验结果
+        ai_response, error, cache_meta = call_deepseek_cached(
+            'variable-naming', {'description': description, 'language': language},
+            messages, json_output=True
+        )
         
         if error:
             return jsonify({'error': error}), 500
         
-        # 解析AI返回的JSON格式数据
-        try:
-            # 尝试直接解析JSON
-            ai_response = json.loads(content)
-            suggestions = ai_response.get('suggestions', {})
-        except json.JSONDecodeError:
-            # 如果直接解析失败，尝试提取JSON部分
-            import re
-            json_match = re.search(r'\{[\s\S]*\}', content)
-            if json_match:
-                try:
-                    ai_response = json.loads(json_match.group())
-                    suggestions = ai_response.get('suggestions', {})
-                except json.JSONDecodeError:
-                    return jsonify({'error': 'AI返回的数据格式无法解析'}), 500
-            else:
-                return jsonify({'error': 'AI返回的数据中未找到有效的JSON格式'}), 500
-        
-        return jsonify({
-            'success': True,
-            'suggestions': suggestions,
-            'description': description,
-            'language': language,
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify(build_response(ai_response, cache_meta))
         
     except Exception as e:
         return jsonify({'error': f'变量命名失败: {str(e)}'}), 500
@@ -471,24 +812,89 @@ def poetry_assistant():
             {"role": "user", "content": prompt}
         ]
         
+        def build_response(content):
+            return {
+                'success': True,
+                'poem': content,
+                'theme': theme,
+                'style': style,
+                'mood': mood,
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        if wants_stream(data):
+            return stream_ai_response(messages, build_response)
+        
         # 使用DeepSeek进行创作
         content, error = call_deepseek_api(messages)
         
         if error:
             return jsonify({'error': error}), 500
         
-        return jsonify({
-            'success': True,
-            'poem': content,
-            'theme': theme,
-            'style': style,
-            'mood': mood,
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify(build_response(content))
         
     except Exception as e:
         return jsonify({'error': f'诗歌创作失败: {str(e)}'}), 500
 
+#按句段翻译并复用翻译记忆
+def translate_segments(segments, source_language, target_language, target_language_name, model='deepseek-chat'):
+    """
+    逐句段查询翻译记忆，未命中的句段（相同句段只算一次）合并为一次AI调用，
+    译文写回翻译记忆后按原顺序拼接
+
+    Returns:
+        tuple: (translation, error, memory_meta)
+    """
+    db = current_app.mongo.db
+    keys = [
+        translation_memory.make_key(source_language, target_language, model, segment) if needs_translation(segment) else None
+        for segment, _ in segments
+    ]
+    found = translation_memory.lookup_many(db, [key for key in keys if key])
+    hits = sum(1 for key in keys if key in found)
+    pending = list(dict.fromkeys(key for key in keys if key and key not in found))
+    
+    if pending:
+        sources = {key: segment for key, (segment, _) in zip(keys, segments) if key}
+        numbered = {str(index): sources[key] for index, key in enumerate(pending, 1)}
+        prompt = f"""你是一位专业的翻译专家。请把下面JSON中每个编号的句段翻译成{target_language_name}。
+
+翻译要求：
+- 忠实原文，译文通顺自然，符合目标语言的表达习惯
+- 各句段按原文顺序排列，属于同一篇文章，请保持术语和称谓前后一致
+- 逐句段翻译，不要合并、拆分或遗漏句段；保留原有的Markdown标记、数字和专有名词
+
+句段：
+{json.dumps(numbered, ensure_ascii=False, indent=2)}
+
+请按以下JSON格式返回，键为句段编号：
+{{
+  "translations": {{"1": "译文1", "2": "译文2"}}
+}}
+
+只返回JSON格式的结果，不要包含其他文字。"""
+        
+        # 译文长度与原文相近，按原文估算输出上限，避免长文被截断
+        max_tokens = min(8192, sum(estimate_tokens(text) for text in numbered.values()) * 2 + 256)
+        result, error = call_ai_json('translation', [{"role": "user", "content": prompt}], model=model, max_tokens=max_tokens)
+        if error:
+            return None, error, None
+        translations = result['translations']
+        missing = [number for number in numbered if not str(translations.get(number) or '').strip()]
+        if missing:
+            return None, f'AI返回的译文缺少{len(missing)}个句段', None
+        
+        entries = [(key, numbered[str(index)], str(translations[str(index)]).strip()) for index, key in enumerate(pending, 1)]
+        translation_memory.store_many(db, entries, source_language, target_language)
+        found.update({key: text for key, _, text in entries})
+    
+    pieces = [(found[key] if key else segment, separator) for key, (segment, separator) in zip(keys, segments)]
+    return join_segments(pieces, target_language), None, {
+        'segments': len(segments),
+        'hits': hits,
+        'translated': len(pending)
+    }
+
 #AI语言翻译接口
 @aimodelapp_bp.route('/translation', methods=['POST'])
 @verify_user_coins
@@ -523,6 +929,47 @@ def translation():
         
         target_language_name = language_map.get(target_language, target_language)
         
+        def build_response(content):
+            return {
+                'success': True,
+                'translation_result': content,
+                'source_text': source_text,
+                'target_language': target_language,
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        # 本地检测到原文已是目标语言时直接返回原文
+        detected_language = detect_language(source_text)
+        if language_matches(detected_language, target_language):
+            return jsonify(build_response(json.dumps({
+                'detected_language': target_language_name,
+                'target_language': target_language_name,
+                'translation': source_text,
+                'alternative_translations': [],
+                'explanation': '原文已是目标语言，无需翻译',
+                'pronunciation': ''
+            }, ensure_ascii=False)))
+        
+        # 多句原文按句段查询翻译记忆，只翻译未命中的句段（流式输出仍整段翻译）
+        segments = split_segments(source_text)
+        if translation_memory.enabled and len(segments) >= translation_memory.min_segments and not wants_stream(data):
+            translated, error, memory_meta = translate_segments(
+                segments, detected_language, target_language, target_language_name
+            )
+            if error:
+                return jsonify({'error': error}), 500
+            detected_name = '中文' if detected_language == 'zh' else language_map.get(detected_language, '自动检测')
+            response = build_response(json.dumps({
+                'detected_language': detected_name,
+                'target_language': target_language_name,
+                'translation': translated,
+                'alternative_translations': [],
+                'explanation': f"全文共{memory_meta['segments']}个句段，其中{memory_meta['hits']}个来自翻译记忆",
+                'pronunciation': ''
+            }, ensure_ascii=False))
+            response['translation_memory'] = memory_meta
+            return jsonify(response)
+        
         # 构建翻译的专业提示词
         prompt = f"""你是一位专业的翻译专家，精通多种语言的翻译工作。请将以下文本翻译成{target_language_name}。
 
@@ -561,19 +1008,16 @@ def translation():
             {"role": "user", "content": prompt}
         ]
         
+        if wants_stream(data):
+            return stream_ai_response(messages, build_response)
+        
         # 使用DeepSeek进行翻译
         content, error = call_deepseek_api(messages)
         
         if error:
             return jsonify({'error': error}), 500
         
-        return jsonify({
-            'success': True,
-            'translation_result': content,
-            'source_text': source_text,
-            'target_language': target_language,
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify(build_response(content))
         
     except Exception as e:
         return jsonify({'error': f'翻译失败: {str(e)}'}), 500
@@ -641,20 +1085,31 @@ def classical_conversion():
             {"role": "user", "content": prompt}
         ]
         
-        # 使用DeepSeek进行文言文转换
-        content, error = call_deepseek_api(messages)
+        def build_response(content, cache_meta=None):
+            return {
+                'success': True,
+                'conversion_result': content,
+                'modern_text': modern_text,
+                'style': style,
+                'article_type': article_type,
+                'cache': cache_meta or {'hit': False, 'tier': None},
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        if wants_stream(data):
+            return stream_ai_response(messages, build_response)
+        
+        # 使用DeepSeek进行文言文转换（优先命中响应缓存）
+        content, error, cache_meta = call_deepseek_cached(
+            'classical_conversion',
+            {'modern_text': modern_text, 'style': style, 'article_type': article_type},
+            messages
+        )
         
         if error:
             return jsonify({'error': error}), 500
         
-        return jsonify({
-            'success': True,
-            'conversion_result': content,
-            'modern_text': modern_text,
-            'style': style,
-            'article_type': article_type,
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify(build_response(content, cache_meta))
         
     except Exception as e:
         return jsonify({'error': f'文言文转换失败: {str(e)}'}), 500
@@ -746,40 +1201,26 @@ def expression_maker():
             {"role": "user", "content": prompt}
         ]
         
-        # 使用DeepSeek进行分析
-        content, error = call_deepseek_api(messages)
+        def build_response(ai_response):
+            return {
+                'success': True,
+                'expressions': ai_response['expressions'],
+                'summary': ai_response['summary'],
+                'text': text,
+                'style': style,
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        if wants_stream(data):
+            return stream_ai_response(messages, build_response, json_endpoint='expression-maker')
+        
+        # 使用DeepSeek进行分析，按JSON模式提取并校验结果
+        ai_response, error = call_ai_json('expression-maker', messages)
         
         if error:
             return jsonify({'error': error}), 500
         
-        # 解析AI返回的JSON格式数据
-        try:
-            # 尝试直接解析JSON
-            ai_response = json.loads(content)
-            expressions = ai_response.get('expressions', {})
-            summary = ai_response.get('summary', {})
-        except json.JSONDecodeError:
-            # 如果直接解析失败，尝试提取JSON部分
-            import re
-            json_match = re.search(r'\{[\s\S]*\}', content)
-            if json_match:
-                try:
-                    ai_response = json.loads(json_match.group())
-                    expressions = ai_response.get('expressions', {})
-                    summary = ai_response.get('summary', {})
-                except json.JSONDecodeError:
-                    return jsonify({'error': 'AI返回的数据格式无法解析'}), 500
-            else:
-                return jsonify({'error': 'AI返回的数据中未找到有效的JSON格式'}), 500
-        
-        return jsonify({
-            'success': True,
-            'expressions': expressions,
-            'summary': summary,
-            'text': text,
-            'style': style,
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify(build_response(ai_response))
         
     except Exception as e:
         return jsonify({'error': f'表情制作失败: {str(e)}'}), 500
@@ -838,8 +1279,12 @@ def linux_command_generator():
             {"role": "user", "content": prompt}
         ]
         
-        # 使用DeepSeek进行命令生成
-        content, error = call_deepseek_api(messages)
+        # 使用DeepSeek进行命令生成（优先命中响应缓存）
+        content, error, cache_meta = call_deepseek_cached(
+            'linux-command',
+            {'task_description': task_description, 'difficulty_level': difficulty_level},
+            messages
+        )
         
         if error:
             return jsonify({'error': error}), 500
@@ -849,12 +1294,92 @@ def linux_command_generator():
             'command_result': content,
             'task_description': task_description,
             'difficulty_level': difficulty_level,
+            'cache': cache_meta,
             'timestamp': datetime.now().isoformat()
         })
         
     except Exception as e:
         return jsonify({'error': f'Linux命令生成失败: {str(e)}'}), 500
 
+# 文章排版的Emoji风格和排版选项，整篇文章的各分块使用相同的规则
+MARKDOWN_EMOJI_STYLES = {
+    'light': '清爽：只在一级、二级标题前各加1个Emoji，正文不加',
+    'balanced': '适中：每个标题前加1个Emoji，每段最多在关键句处加1个',
+    'rich': '丰富：标题、列表项和关键句都可以加Emoji，每段不超过3个'
+}
+
+MARKDOWN_OPTIONS = {
+    'standard': '标准Markdown：标题、段落、列表、引用按常规方式排版',
+    'compact': '紧凑排版：减少空行，不使用分隔线',
+    'readable': '易读增强：段落之间留空行，关键词加粗，并列内容整理为列表'
+}
+
+#构建文章排版提示词
+def build_markdown_prompt(article_text, emoji_style, markdown_option, part=None):
+    """part为(序号, 总数, 原文标题大纲)时生成分块提示词：不生成目录，标题层级按大纲统一"""
+    emoji_rule = MARKDOWN_EMOJI_STYLES.get(emoji_style, emoji_style)
+    option_rule = MARKDOWN_OPTIONS.get(markdown_option, markdown_option)
+    if part is None:
+        scope = "如果原文本较长，可在开头自动生成简洁的“目录”以便阅读。"
+    else:
+        index, total, headings = part
+        heading_list = '\n'.join(f'- {heading}' for heading in headings) or '（原文没有明显的标题）'
+        scope = f"""这是一篇长文章的第{index}/{total}部分，各部分分别排版后按顺序拼接，请遵守：
+- 只排版下面给出的这一部分，不要生成目录，不要添加总结或过渡语
+- {'可以为文章标题使用一级标题(#)，' if index == 1 else '不要使用一级标题(#)，'}其余标题从二级标题(##)开始，同级标题使用相同的级别
+- 全文标题大纲如下，标题层级请与大纲保持一致：
+{heading_list}"""
+    return f"""你是一位专业的文档排版助手。请将用户提供的全文按“标准Markdown格式”进行排版，并在不改变任何原文内容的前提下进行结构化呈现。严格遵守以下规则：
+
+1) 保留所有原始内容，严禁改写、删减或添加新内容。
+2) 使用合理的Markdown结构（标题、分节、段落、列表、引用、表格如有必要、代码块仅当原文包含）。
+3) 智能添加适量Emoji以增强可读性（{emoji_rule}），在标题、关键句、列表项等处点缀；避免过度使用，保持专业。
+4) 排版风格：{option_rule}。
+5) 保持语言与语气不变，只优化排版和表现形式。
+6) 输出“纯Markdown文本”，不要包含任何JSON、HTML、XML、解释文字、或代码块围栏标记（例如不要在最外层使用```）。
+
+{scope}
+
+原文如下：
+{article_text}
+"""
+
+#排版一篇文章或一个分块
+def format_markdown_chunk(chunk, emoji_style, markdown_option, part=None, splits=0):
+    """
+    输出达到max_tokens被截断时拆成更小的分块依次重新排版（最多拆分max_splits层），
+    仍无法完整输出时返回错误，不返回残缺结果
+
+    Returns:
+        tuple: (content, error)
+    """
+    config = load_ai_config()
+    if not config or 'deepseek' not in config:
+        return None, "AI配置加载失败"
+    settings = chunk_settings()
+    messages = [{"role": "user", "content": build_markdown_prompt(chunk, emoji_style, markdown_option, part)}]
+    result, error, _, _ = ai_router.chat(
+        config, messages, 'deepseek', 'deepseek-chat', max_tokens=settings['max_tokens'], temperature=0.3
+    )
+    if error:
+        return None, error
+    if result.get('finish_reason') != 'length':
+        return result['content'], None
+    
+    pieces = split_markdown(chunk, max(100, estimate_tokens(chunk) // 2))
+    if splits >= settings['max_splits'] or len(pieces) < 2:
+        return None, '排版结果超出单次输出上限，请缩短文章后重试'
+    print(f"排版输出被截断，拆分为{len(pieces)}块重新排版")
+    sub_part = part or (1, 1, outline(chunk))
+    parts = []
+    for piece in pieces:
+        content, error = format_markdown_chunk(piece, emoji_style, markdown_option, sub_part, splits + 1)
+        if error:
+            return None, error
+        parts.append(content)
+    # 整篇文章被拆分时统一生成目录；分块内的拆分由外层拼接时生成
+    return stitch(parts, with_toc=part is None), None
+
 #AI文章排版（Markdown格式化）接口
 @aimodelapp_bp.route('/markdown_formatting', methods=['POST'])
 @verify_user_coins
@@ -869,38 +1394,55 @@ def markdown_formatting():
         if not article_text:
             return jsonify({'error': '文章内容不能为空'}), 400
         
-        # 构建Markdown排版的提示词
-        prompt = f"""你是一位专业的文档排版助手。请将用户提供的全文按“标准Markdown格式”进行排版，并在不改变任何原文内容的前提下进行结构化呈现。严格遵守以下规则：
-
-1) 保留所有原始内容，严禁改写、删减或添加新内容。
-2) 使用合理的Markdown结构（标题、分节、段落、列表、引用、表格如有必要、代码块仅当原文包含）。
-3) 智能添加适量Emoji以增强可读性（{emoji_style}），在标题、关键句、列表项等处点缀；避免过度使用，保持专业。
-4) 保持语言与语气不变，只优化排版和表现形式。
-5) 输出“纯Markdown文本”，不要包含任何JSON、HTML、XML、解释文字、或代码块围栏标记（例如不要在最外层使用```）。
-
-如果原文本较长，可在开头自动生成简洁的“目录”以便阅读。
-
-原文如下：
-{article_text}
-"""
+        def build_response(content, chunks=1):
+            return {
+                'success': True,
+                'formatted_markdown': content,
+                'source_text': article_text,
+                'emoji_style': emoji_style,
+                'markdown_option': markdown_option,
+                'chunks': chunks,
+                'timestamp': datetime.now().isoformat()
+            }
         
-        messages = [{"role": "user", "content": prompt}]
+        # 按标题和段落边界切分，短文章只有一块
+        chunks = split_markdown(article_text)
         
-        # 使用DeepSeek进行排版生成
-        content, error = call_deepseek_api(messages)
+        if len(chunks) == 1:
+            if wants_stream(data):
+                prompt = build_markdown_prompt(article_text, emoji_style, markdown_option)
+                return stream_ai_response(
+                    [{"role": "user", "content": prompt}], build_response,
+                    max_tokens=chunk_settings()['max_tokens'], temperature=0.3
+                )
+            
+            # 使用DeepSeek进行排版生成
+            content, error = format_markdown_chunk(article_text, emoji_style, markdown_option)
+            if error:
+                return jsonify({'error': error}), 500
+            return jsonify(build_response(content))
+        
+        # 长文章：各分块并发排版，总耗时约为最慢的一块
+        headings = outline(article_text)
+        results = map_bounded(
+            lambda item: format_markdown_chunk(
+                item[1], emoji_style, markdown_option, (item[0] + 1, len(chunks), headings)
+            ),
+            enumerate(chunks)
+        )
         
-        if error:
-            return jsonify({'error': error}), 500
+        if wants_stream(data):
+            return stream_chunk_results(results, lambda parts: build_response(stitch(parts), len(chunks)))
         
-        # 返回AI生成的Markdown文本
-        return jsonify({
-            'success': True,
-            'formatted_markdown': content,
-            'source_text': article_text,
-            'emoji_style': emoji_style,
-            'markdown_option': markdown_option,
-            'timestamp': datetime.now().isoformat()
-        })
+        parts = []
+        for content, error in results:
+            if error:
+                results.close()
+                return jsonify({'error': error}), 500
+            parts.append(content)
+        
+        # 返回按原顺序拼接的Markdown文本
+        return jsonify(build_response(stitch(parts), len(chunks)))
         
     except Exception as e:
         return jsonify({'error': f'文章排版失败: {str(e)}'}), 500
@@ -910,39 +1452,32 @@ def markdown_formatting():
 def get_user_coins():
     """获取用户萌芽币余额"""
     try:
-        # 获取用户认证信息
-        token = request.headers.get('Authorization')
-        if not token:
+        # 获取统一认证层已验证的用户
+        principal = current_principal()
+        auth_error = current_auth_error()
+        if auth_error == 'missing':
             return jsonify({
                 'success': False, 
                 'message': '未提供认证信息',
                 'error_code': 'auth_required'
             }), 401
-        
-        if token.startswith('Bearer '):
-            token = token[7:]
-        
-        # 解析JWT token
-        import jwt
-        try:
-            payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            user_id = payload['user_id']
-        except jwt.ExpiredSignatureError:
+        if auth_error == 'expired':
             return jsonify({
                 'success': False, 
                 'message': 'Token已过期，请重新登录',
                 'error_code': 'token_expired'
             }), 401
-        except Exception as e:
+        if not principal:
             return jsonify({
                 'success': False, 
-                'message': f'无效的认证信息: {str(e)}',
+                'message': f'无效的认证信息: {AUTH_ERRORS[auth_error]}',
                 'error_code': 'invalid_token'
             }), 401
+        user_id = principal['user_id']
         
-        # 查询用户萌芽币余额
-        users_collection = current_app.mongo.db.userdata
-        user = users_collection.find_one({'_id': ObjectId(user_id)})
+        # 查询用户萌芽币余额（只取需要的字段）
+        db = current_app.mongo.db
+        user = user_cache.get(db, user_id, ['萌芽币', '用户名'])
         
         if not user:
             return jsonify({
@@ -955,11 +1490,9 @@ def get_user_coins():
         current_coins = user.get('萌芽币', 0)
         username = user.get('用户名', '用户')
         
-        # 增加额外有用信息
-        ai_usage_history = [] 
-        if 'ai_usage_history' in user:
-            ai_usage_history = user['ai_usage_history'][-5:]  # 最近5条使用记录
-            
+        # 增加额外有用信息：最近5条使用记录（ai_usage集合按(user_id, timestamp)索引查询）
+        ai_usage_history = usage_ledger.recent(db, user_id, 5)
+        
         return jsonify({
             'success': True,
             'data': {
@@ -979,29 +1512,115 @@ def get_user_coins():
             'error': str(e)
         }), 500
 
+#查询异步任务状态和结果
+@aimodelapp_bp.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_ai_job(job_id):
+    """查询异步AI任务（任意worker均可应答）"""
+    try:
+        job = get_job(current_app.mongo.db, job_id, request.current_user['user_id'])
+        if not job:
+            return jsonify({
+                'success': False,
+                'message': '任务不存在或已过期',
+                'error_code': 'job_not_found'
+            }), 404
+        
+        finished = job['status'] in ('succeeded', 'failed')
+        return jsonify({
+            'success': True,
+            'job_id': job['_id'],
+            'endpoint': job['endpoint'],
+            'status': job['status'],
+            'http_status': job.get('http_status'),
+            'result': job.get('result') if finished else None,
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at']
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': '处理请求时出错',
+            'error': str(e)
+        }), 500
+
 #获取可用的AI模型列表
 @aimodelapp_bp.route('/models', methods=['GET'])
 def get_available_models():
-    """获取可用的AI模型列表"""
+    """获取可用的AI模型列表（支持ETag条件请求）"""
     try:
-        config = load_ai_config()
-        if not config:
+        payload, etag = ai_config_cache.models_response()
+        if not payload:
             return jsonify({'error': 'AI配置加载失败'}), 500
         
-        models = {}
-        for provider, provider_config in config.items():
-            if 'model' in provider_config:
-                models[provider] = provider_config['model']
+        response = jsonify(payload)
+        response.set_etag(etag)
+        return response.make_conditional(request)
         
+    except Exception as e:
+        return jsonify({'error': f'获取模型列表失败: {str(e)}'}), 500
+
+#重新加载AI配置（管理员）
+@aimodelapp_bp.route('/config/reload', methods=['POST'])
+@admin_required
+def reload_ai_config():
+    """立即重新加载ai_config.json（仅作用于处理该请求的worker，其余worker按mtime自动刷新）"""
+    ok, error = ai_config_cache.reload()
+    if not ok:
+        return jsonify({
+            'success': False,
+            'message': f'AI配置重新加载失败，继续使用旧配置: {error}'
+        }), 500
+    
+    payload, etag = ai_config_cache.models_response()
+    return jsonify({
+        'success': True,
+        'message': 'AI配置已重新加载',
+        'models': payload['models'],
+        'etag': etag
+    }), 200
+
+#查看AI提供商健康状态（管理员）
+@aimodelapp_bp.route('/providers/status', methods=['GET'])
+@admin_required
+def get_provider_status():
+    """当前worker内各提供商的熔断状态、错误率和p95延迟"""
+    return jsonify({
+        'success': True,
+        'providers': ai_router.snapshot(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+#AI调用指标接口（管理员）
+@aimodelapp_bp.route('/metrics', methods=['GET'])
+@admin_required
+def get_ai_metrics():
+    """
+    汇总各worker的AI调用指标（排队、连接、首字节、首token、总耗时和生成速度的分位数）
+
+    查询参数: hours（默认24）、group_by（逗号分隔的标签，默认endpoint,provider,model）、
+    endpoint/provider/model/status（按标签过滤）
+    """
+    try:
+        hours = min(max(request.args.get('hours', 24, type=int), 1), ai_metrics.retention_days * 24)
+        group_by = [name.strip() for name in request.args.get('group_by', 'endpoint,provider,model').split(',') if name.strip()]
+        invalid = [name for name in group_by if name not in METRIC_LABELS]
+        if invalid:
+            return jsonify({'success': False, 'message': f'不支持的分组标签: {", ".join(invalid)}'}), 400
+        filters = {name: request.args[name] for name in ('endpoint', 'provider', 'model', 'status') if request.args.get(name)}
+
+        # 先写入当前worker尚未落库的指标
+        ai_metrics.flush()
+        series = ai_metrics.summary(current_app.mongo.db, hours=hours, group_by=group_by, filters=filters)
         return jsonify({
             'success': True,
-            'models': models,
-            'default_provider': 'deepseek',
-            'default_model': 'deepseek-chat'
-        })
-        
+            'hours': hours,
+            'group_by': group_by,
+            'series': series,
+            'timestamp': datetime.now().isoformat()
+        }), 200
     except Exception as e:
-        return jsonify({'error': f'获取模型列表失败: {str(e)}'}), 500
+        return jsonify({'success': False, 'message': f'查询AI调用指标失败: {str(e)}'}), 500
 
 #中国亲戚称呼计算器接口（普通话版 + 方言）
 @aimodelapp_bp.route('/kinship-calculator', methods=['POST'])
@@ -1017,16 +1636,33 @@ def kinship_calculator():
             return jsonify({'error': '亲属关系链不能为空'}), 400
 
         # 组装提示词：要求严格JSON输出
-        requested_dialects = dialects if isinstance(dialects, list) and dialects else [
-            '粤语', '闽南语', '上海话', '四川话', '东北话', '客家话'
-        ]
+        requested_dialects = dialects if isinstance(dialects, list) and dialects else DEFAULT_DIALECTS
+
+        # 优先使用本地规则引擎：关系链和方言称呼都能确定时直接返回；
+        # 称呼已确定但部分方言不在对照表中时，只就这些方言调用AI，结果与本地部分合并
+        local_result = resolve_kinship(relation_chain, requested_dialects)
+        if local_result and not local_result['missing_dialects']:
+            return jsonify({
+                'success': True,
+                'relation_chain': relation_chain,
+                'mandarin_title': local_result['mandarin_title'],
+                'dialect_titles': local_result['dialect_titles'],
+                'notes': local_result['notes'],
+                'cache': {'hit': False, 'tier': None},
+                'timestamp': datetime.now().isoformat()
+            })
+
+        ai_dialects = local_result['missing_dialects'] if local_result else requested_dialects
+        known_title = ''
+        if local_result:
+            known_title = f"\n该关系链的普通话称呼已确定为“{local_result['mandarin_title']}”，mandarin_title请直接使用该称呼。"
 
         prompt = f"""你是一位中国亲属称呼专家。请解析下面的亲属关系链，给出最终的亲属称呼。
-输入的关系链会用“的”连接，如“妈妈的爸爸”“爸爸的姐姐的儿子”。
+输入的关系链会用“的”连接，如“妈妈的爸爸”“爸爸的姐姐的儿子”。{known_title}
 
 请遵循：
 1) 以中国大陆通行的标准普通话称呼为准，给出最常用、规范的最终称呼。
-2) 同时给出若干方言的对应称呼：{', '.join(requested_dialects)}。
+2) 同时给出若干方言的对应称呼：{', '.join(ai_dialects)}。
 3) 如存在地区差异或性别歧义，请在notes中说明，但最终给出一个最常用称呼。
 4) 不要展示推理过程；只输出JSON。
 
@@ -1049,39 +1685,42 @@ def kinship_calculator():
 """
 
         messages = [{"role": "user", "content": prompt}]
-        content, error = call_deepseek_api(messages)
+
+        def build_response(result, cache_meta=None):
+            mandarin_title = result['mandarin_title']
+            dialect_titles = result.get('dialect_titles', {})
+            notes = result.get('notes', '')
+            if local_result:
+                # 普通话称呼和已收录的方言以本地结果为准，AI只补充未收录的方言
+                ai_titles = dialect_titles if isinstance(dialect_titles, dict) else {}
+                mandarin_title = local_result['mandarin_title']
+                dialect_titles = {d: ai_titles[d] for d in local_result['missing_dialects'] if d in ai_titles}
+                dialect_titles.update(local_result['dialect_titles'])
+                notes = local_result['notes'] or notes
+            return {
+                'success': True,
+                'relation_chain': relation_chain,
+                'mandarin_title': mandarin_title,
+                'dialect_titles': dialect_titles,
+                'notes': notes,
+                'cache': cache_meta or {'hit': False, 'tier': None},
+                'timestamp': datetime.now().isoformat()
+            }
+
+        if wants_stream(data):
+            return stream_ai_response(messages, build_response, json_endpoint='kinship-calculator')
+
+        # schema要求mandarin_title非空，缺失时先修复一次
+        result, error, cache_meta = call_deepseek_cached(
+            'kinship-calculator',
+            {'relation_chain': relation_chain, 'dialects': ai_dialects},
+            messages, json_output=True
+        )
 
         if error:
             return jsonify({'error': error}), 500
 
-        # 解析AI返回的JSON
-        try:
-            result = json.loads(content)
-        except json.JSONDecodeError:
-            import re
-            m = re.search(r'\{[\s\S]*\}', content)
-            if not m:
-                return jsonify({'error': 'AI返回的数据中未找到有效JSON'}), 500
-            try:
-                result = json.loads(m.group())
-            except Exception:
-                return jsonify({'error': 'AI返回的JSON格式无法解析'}), 500
-
-        mandarin_title = result.get('mandarin_title')
-        dialect_titles = result.get('dialect_titles', {})
-        notes = result.get('notes', '')
-
-        if not mandarin_title:
-            return jsonify({'error': '未获得标准普通话称呼'}), 500
-
-        return jsonify({
-            'success': True,
-            'relation_chain': relation_chain,
-            'mandarin_title': mandarin_title,
-            'dialect_titles': dialect_titles,
-            'notes': notes,
-            'timestamp': datetime.now().isoformat()
-        })
+        return jsonify(build_response(result, cache_meta))
 
     except Exception as e:
         return jsonify({'error': f'亲戚称呼计算失败: {str(e)}'}), 500
\ No newline at end of file
@@ -7,12 +7,19 @@ Date: 2025-09-02
 """
 
 from flask import Blueprint, request, jsonify, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
 import hashlib
+import hmac
 import re
+import secrets
 import jwt
 from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from functools import wraps
+from .auth_middleware import AUTH_ERRORS, token_auth, bearer_token, current_principal, current_auth_error
+from .user_cache import user_cache, versioned
+from .migrations import unique_indexes_ready
+from .password_hash import PasswordHashBusy, hash_password, check_password, needs_rehash
 from .email_service import send_verification_email, verify_code, is_qq_email, get_qq_avatar_url
 
 auth_bp = Blueprint('auth', __name__)
@@ -25,41 +32,61 @@ def generate_token(user_data):
         'email': user_data['email'],
         'username': user_data['username'],
         'exp': datetime.utcnow() + timedelta(days=7),  # 7天过期
-        'iat': datetime.utcnow()
+        'iat': datetime.utcnow(),
+        'jti': secrets.token_hex(8)  # 每个token唯一，同一秒内重新登录也不会得到已注销的token
     }
     return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
 
 #验证JWT token
 def verify_token(token):
-    """验证JWT token"""
-    try:
-        payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-        return {'success': True, 'data': payload}
-    except jwt.ExpiredSignatureError:
-        return {'success': False, 'message': 'Token已过期'}
-    except jwt.InvalidTokenError:
-        return {'success': False, 'message': 'Token无效'}
+    """验证JWT token（经统一认证层的验证缓存和注销列表）"""
+    payload, error = token_auth.verify(token, current_app.config['SECRET_KEY'])
+    if error:
+        return {'success': False, 'message': AUTH_ERRORS[error]}
+    return {'success': True, 'data': payload}
 
 #JWT token验证装饰器
 def token_required(f):
-    """JWT token验证装饰器"""
+    """JWT token验证装饰器（读取before_request中已验证的用户）"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'success': False, 'message': '缺少认证token'}), 401
+        principal = current_principal()
+        if not principal:
+            return jsonify({'success': False, 'message': AUTH_ERRORS[current_auth_error()]}), 401
         
-        if token.startswith('Bearer '):
-            token = token[7:]
+        request.current_user = principal
+        return f(*args, **kwargs)
+    return decorated
+
+#管理员接口验证装饰器
+def admin_required(f):
+    """管理员接口验证装饰器（校验X-Admin-Token请求头，未配置ADMIN_TOKEN时接口关闭）"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        admin_token = current_app.config.get('ADMIN_TOKEN')
+        if not admin_token:
+            return jsonify({'success': False, 'message': '管理接口未启用'}), 403
         
-        result = verify_token(token)
-        if not result['success']:
-            return jsonify({'success': False, 'message': result['message']}), 401
+        provided = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(provided.encode('utf-8'), admin_token.encode('utf-8')):
+            return jsonify({'success': False, 'message': '管理员认证失败'}), 403
         
-        request.current_user = result['data']
         return f(*args, **kwargs)
     return decorated
 
+#判断重复键错误对应的字段
+def duplicate_key_field(error):
+    """从DuplicateKeyError中取出冲突的字段（邮箱或用户名），无法判断时为None"""
+    details = error.details or {}
+    for key in ('keyPattern', 'keyValue'):
+        if details.get(key):
+            return next(iter(details[key]))
+    message = details.get('errmsg') or str(error)
+    for field in ('用户名', '邮箱'):
+        if f'{field}_' in message:
+            return field
+    return None
+
 #验证QQ邮箱格式
 def validate_qq_email(email):
     """验证QQ邮箱格式"""
@@ -99,7 +126,7 @@ def send_verification():
         users_collection = db.userdata
         
         # 检查邮箱是否已注册
-        existing_user = users_collection.find_one({'邮箱': email})
+        existing_user = users_collection.find_one({'邮箱': email}, {'_id': 1})
         
         if verification_type == 'register' and existing_user:
             return jsonify({
@@ -201,25 +228,25 @@ def register():
         db = current_app.mongo.db
         users_collection = db.userdata
         
-        # 检查邮箱是否已被注册
-        if users_collection.find_one({'邮箱': email}):
-            return jsonify({
-                'success': False,
-                'message': '该邮箱已被注册'
-            }), 409
-        
-        # 检查用户名是否已被使用
-        if users_collection.find_one({'用户名': username}):
-            return jsonify({
-                'success': False,
-                'message': '该用户名已被使用'
-            }), 409
+        # 唯一索引确认建立前（迁移0001未完成或失败）仍先查重，之后由唯一索引保证不重复
+        if not unique_indexes_ready(db):
+            if users_collection.find_one({'邮箱': email}, {'_id': 1}):
+                return jsonify({
+                    'success': False,
+                    'message': '该邮箱已被注册'
+                }), 409
+            
+            if users_collection.find_one({'用户名': username}, {'_id': 1}):
+                return jsonify({
+                    'success': False,
+                    'message': '该用户名已被使用'
+                }), 409
         
         # 获取QQ头像
         avatar_url = get_qq_avatar_url(email)
         
         # 创建新用户
-        password_hash = generate_password_hash(password)
+        password_hash = hash_password(password)
         user_data = {
             '邮箱': email,
             '用户名': username,
@@ -239,7 +266,23 @@ def register():
             }
         }
         
-        result = users_collection.insert_one(user_data)
+        # 唯一索引建立后一次插入完成查重和创建，并发注册同一邮箱也只会成功一个
+        try:
+            result = users_collection.insert_one(user_data)
+        except DuplicateKeyError as e:
+            field = duplicate_key_field(e)
+            if field is None:
+                # 错误中没有冲突字段时（如旧版MongoDB）再查一次邮箱
+                field = '邮箱' if users_collection.find_one({'邮箱': email}, {'_id': 1}) else '用户名'
+            if field == '用户名':
+                return jsonify({
+                    'success': False,
+                    'message': '该用户名已被使用'
+                }), 409
+            return jsonify({
+                'success': False,
+                'message': '该邮箱已被注册'
+            }), 409
         
         if result.inserted_id:
             return jsonify({
@@ -257,6 +300,11 @@ def register():
                 'message': '注册失败，请稍后重试'
             }), 500
             
+    except PasswordHashBusy:
+        return jsonify({
+            'success': False,
+            'message': '服务繁忙，请稍后重试'
+        }), 503
     except Exception as e:
         current_app.logger.error(f"注册失败: {str(e)}")
         return jsonify({
@@ -287,57 +335,83 @@ def login():
                 'message': '仅支持QQ邮箱登录'
             }), 400
         
-        # 获取数据库集合
-        db = current_app.mongo.db
-        users_collection = db.userdata
-        
-        # 查找用户
-        user = users_collection.find_one({'邮箱': email})
-        
-        if not user:
+        if not code and not password:
             return jsonify({
                 'success': False,
-                'message': '该邮箱尚未注册'
-            }), 404
+                'message': '请输入密码或验证码'
+            }), 400
         
-        # 检查用户状态
-        if user.get('用户状态') != 'active':
-            return jsonify({
-                'success': False,
-                'message': '账号已被禁用，请联系管理员'
-            }), 403
+        # 获取数据库集合
+        db = current_app.mongo.db
+        users_collection = db.userdata
+        login_query = {'邮箱': email, '用户状态': 'active'}
+        login_update = {'最后登录': datetime.now().isoformat()}
         
         # 验证方式：验证码登录或密码登录
         if code:
-            # 验证码登录
+            # 验证码登录：验证码在本地校验，无需先查询用户
             verify_result = verify_code(email, code)
             if not verify_result['success'] or verify_result.get('type') != 'login':
                 return jsonify({
                     'success': False,
                     'message': '验证码无效或已过期'
                 }), 400
-        elif password:
-            # 密码登录
-            if not check_password_hash(user['密码'], password):
+        else:
+            # 密码登录：只取校验所需的字段
+            credentials = users_collection.find_one({'邮箱': email}, {'密码': 1, '用户状态': 1})
+            if not credentials:
+                return jsonify({
+                    'success': False,
+                    'message': '该邮箱尚未注册'
+                }), 404
+            if credentials.get('用户状态') != 'active':
+                return jsonify({
+                    'success': False,
+                    'message': '账号已被禁用，请联系管理员'
+                }), 403
+            if not check_password(credentials.get('密码'), password):
                 return jsonify({
                     'success': False,
                     'message': '密码错误'
                 }), 401
-        else:
-            return jsonify({
-                'success': False,
-                'message': '请输入密码或验证码'
-            }), 400
-        
-        # 登录成功，更新用户信息
-        users_collection.update_one(
-            {'邮箱': email},
-            {
-                '$set': {'最后登录': datetime.now().isoformat()},
+            # 只在哈希未被并发修改时记录登录；密码哈希参数已变化时顺带升级保存的哈希
+            login_query = {'_id': credentials['_id'], '密码': credentials['密码'], '用户状态': 'active'}
+            try:
+                if needs_rehash(credentials['密码']):
+                    login_update['密码'] = hash_password(password)
+            except PasswordHashBusy:
+                pass
+        
+        # 一次条件更新记录登录并取回响应所需的字段
+        user = users_collection.find_one_and_update(
+            login_query,
+            versioned({
+                '$set': login_update,
                 '$inc': {'登录次数': 1}
-            }
+            }),
+            projection={'用户名': 1, '头像': 1, '登录次数': 1},
+            return_document=ReturnDocument.AFTER
         )
         
+        if not user:
+            # 仅在登录失败时再查一次，区分未注册、已禁用和密码被并发修改
+            existing = users_collection.find_one({'邮箱': email}, {'用户状态': 1})
+            if not existing:
+                return jsonify({
+                    'success': False,
+                    'message': '该邮箱尚未注册'
+                }), 404
+            if existing.get('用户状态') != 'active':
+                return jsonify({
+                    'success': False,
+                    'message': '账号已被禁用，请联系管理员'
+                }), 403
+            return jsonify({
+                'success': False,
+                'message': '密码错误'
+            }), 401
+        user_cache.invalidate(user['_id'])
+        
         # 生成JWT token
         user_data = {
             'user_id': str(user['_id']),
@@ -355,10 +429,15 @@ def login():
                 'email': email,
                 'username': user.get('用户名', ''),
                 'avatar': user.get('头像', ''),
-                'login_count': user.get('登录次数', 0) + 1
+                'login_count': user.get('登录次数', 0)
             }
         }), 200
         
+    except PasswordHashBusy:
+        return jsonify({
+            'success': False,
+            'message': '服务繁忙，请稍后重试'
+        }), 503
     except Exception as e:
         current_app.logger.error(f"登录失败: {str(e)}")
         return jsonify({
@@ -400,9 +479,13 @@ def login():
 #用户登出
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
-    """用户登出"""
+    """用户登出（注销当前token，所有worker在同步间隔内拒绝该token）"""
     try:
-        # JWT是无状态的，客户端删除token即可
+        token = bearer_token(request.headers)
+        principal = current_principal()
+        if token and principal:
+            token_auth.revoke(current_app.mongo.db, token, principal)
+        
         return jsonify({
             'success': True,
             'message': '已成功登出'
@@ -414,24 +497,23 @@ def logout():
             'message': f'服务器错误: {str(e)}'
         }), 500
 
+#查看token验证缓存统计
+@auth_bp.route('/token-cache', methods=['GET'])
+@admin_required
+def token_cache_stats():
+    """本worker的token验证缓存命中、未命中和注销计数"""
+    return jsonify({
+        'success': True,
+        'data': token_auth.stats()
+    }), 200
+
 #检查登录状态
 @auth_bp.route('/check', methods=['GET'])
 def check_login():
     """检查登录状态"""
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({
-                'success': True,
-                'logged_in': False
-            }), 200
-        
-        if token.startswith('Bearer '):
-            token = token[7:]
-        
-        result = verify_token(token)
-        if result['success']:
-            user_data = result['data']
+        user_data = current_principal()
+        if user_data:
             return jsonify({
                 'success': True,
                 'logged_in': True,
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+统一认证中间件
+每个请求在before_request中解析一次Authorization请求头，把验证通过的JWT声明放到g.principal，
+各蓝图都从current_principal()读取当前用户；验证结果按token摘要缓存在有界LRU中，
+缓存到token的exp为止，已注销的token记录在MongoDB revoked_tokens集合中并定期同步到各worker
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import jwt
+from flask import g, request, current_app
+
+# 认证失败的原因及提示
+AUTH_ERRORS = {
+    'missing': '缺少认证token',
+    'expired': 'Token已过期',
+    'invalid': 'Token无效',
+    'revoked': 'Token已注销'
+}
+
+
+#计算token摘要
+def token_digest(token):
+    """缓存和注销列表只保存摘要，不保存token原文"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+#从请求头取token
+def bearer_token(headers):
+    token = headers.get('Authorization')
+    if not token:
+        return None
+    if token.startswith('Bearer '):
+        token = token[7:]
+    return token.strip() or None
+
+
+class TokenAuth:
+    """JWT验证结果缓存与注销列表（每个worker一份，注销记录跨worker共享）"""
+
+    def __init__(self):
+        self.enabled = True
+        self.cache_size = 10000
+        self.sync_interval = 5.0
+        self._cache = OrderedDict()  # 摘要 -> (声明, 过期时间戳)
+        self._revoked = {}  # 摘要 -> 过期时间戳
+        self._last_sync = None
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+        self.counters = {'hits': 0, 'misses': 0, 'expired': 0, 'invalid': 0, 'revoked': 0}
+
+    def configure(self, enabled=True, cache_size=10000, sync_interval=5.0):
+        """更新缓存开关、容量和注销列表同步间隔"""
+        self.enabled = enabled
+        self.cache_size = cache_size
+        self.sync_interval = sync_interval
+        with self._lock:
+            self._cache.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def verify(self, token, secret_key):
+        """
+        验证token，命中缓存时不再做HS256校验和解码
+
+        Returns:
+            tuple: (claims, error)，error为AUTH_ERRORS的键
+        """
+        digest = token_digest(token)
+        now = time.time()
+        with self._lock:
+            if digest in self._revoked:
+                self.counters['revoked'] += 1
+                return None, 'revoked'
+            entry = self._cache.get(digest) if self.enabled else None
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at > now:
+                    self._cache.move_to_end(digest)
+                    self.counters['hits'] += 1
+                    return claims, None
+                del self._cache[digest]
+            self.counters['misses'] += 1
+
+        try:
+            claims = jwt.decode(token, secret_key, algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+            self._count('expired')
+            return None, 'expired'
+        except jwt.InvalidTokenError:
+            self._count('invalid')
+            return None, 'invalid'
+
+        if self.enabled and claims.get('exp'):
+            with self._lock:
+                self._cache[digest] = (claims, float(claims['exp']))
+                self._cache.move_to_end(digest)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims, None
+
+    def revoke(self, db, token, claims=None):
+        """注销token：立即从本worker缓存移除，并写入注销列表（保留到token过期）"""
+        digest = token_digest(token)
+        expires_at = float((claims or {}).get('exp') or time.time() + 7 * 86400)
+        with self._lock:
+            self._cache.pop(digest, None)
+            self._revoked[digest] = expires_at
+        self._ensure_indexes(db)
+        db.revoked_tokens.update_one(
+            {'_id': digest},
+            {'$set': {
+                'user_id': (claims or {}).get('user_id'),
+                'revoked_at': datetime.utcnow(),
+                'expires_at': datetime.utcfromtimestamp(expires_at)
+            }},
+            upsert=True
+        )
+
+    def sync_revocations(self, db, force=False):
+        """按同步间隔拉取其他worker新增的注销记录，并清理已过期的记录"""
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+        started = datetime.utcnow()
+        query = {'expires_at': {'$gt': started}}
+        if self._last_sync is not None:
+            # 留出1秒重叠，避免各worker时钟和写入延迟造成遗漏
+            query['revoked_at'] = {'$gte': self._last_sync - timedelta(seconds=1)}
+        try:
+            docs = list(db.revoked_tokens.find(query, {'expires_at': 1}))
+        except Exception as e:
+            print(f"同步token注销列表失败: {str(e)}")
+            return
+        self._last_sync = started
+        wall_now = time.time()
+        with self._lock:
+            for doc in docs:
+                self._revoked[doc['_id']] = doc['expires_at'].replace(tzinfo=timezone.utc).timestamp()
+                self._cache.pop(doc['_id'], None)
+            for digest in [d for d, expires_at in self._revoked.items() if expires_at <= wall_now]:
+                del self._revoked[digest]
+
+    def _ensure_indexes(self, db):
+        """首次写入时创建过期TTL索引"""
+        if self._indexes_ready:
+            return
+        db.revoked_tokens.create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    def stats(self):
+        """本worker的缓存计数"""
+        with self._lock:
+            counters = dict(self.counters)
+            size = len(self._cache)
+            revoked = len(self._revoked)
+        lookups = counters['hits'] + counters['misses']
+        return {
+            **counters,
+            'hit_rate': round(counters['hits'] / lookups, 4) if lookups else None,
+            'cached_tokens': size,
+            'revoked_tokens': revoked
+        }
+
+
+# 全局认证实例
+token_auth = TokenAuth()
+
+
+#解析当前请求的认证信息
+def authenticate_request():
+    """before_request钩子：只解析不拦截，是否需要登录由各接口的装饰器决定"""
+    g.principal = None
+    g.auth_error = 'missing'
+    token = bearer_token(request.headers)
+    if not token:
+        return
+    try:
+        token_auth.sync_revocations(current_app.mongo.db)
+    except Exception as e:
+        print(f"同步token注销列表失败: {str(e)}")
+    claims, error = token_auth.verify(token, current_app.config['SECRET_KEY'])
+    g.principal = claims
+    g.auth_error = error
+
+def current_principal():
+    """当前请求已验证的JWT声明，未登录或验证失败时为None（未经过钩子的请求上下文在此补做解析）"""
+    if 'auth_error' not in g:
+        authenticate_request()
+    return g.principal
+
+def current_auth_error():
+    """当前请求认证失败的原因（AUTH_ERRORS的键），已登录时为None"""
+    if 'auth_error' not in g:
+        authenticate_request()
+    return g.auth_error
+
+
+#初始化统一认证
+def init_auth_middleware(app):
+    """注册before_request钩子并读取缓存配置"""
+    token_auth.configure(
+        enabled=app.config.get('AUTH_TOKEN_CACHE_ENABLED', True),
+        cache_size=app.config.get('AUTH_TOKEN_CACHE_SIZE', 10000),
+        sync_interval=app.config.get('AUTH_REVOCATION_SYNC_INTERVAL', 5.0)
+    )
+    app.before_request(authenticate_request)
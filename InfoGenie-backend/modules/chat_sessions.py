@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI对话会话模块
+对话历史保存在服务端chat_sessions集合中，客户端每轮只上传新消息；
+未摘要的消息过多时在后台把较早的对话合并进滚动摘要，控制提示词长度
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+
+# 生成摘要时使用的提示词
+SUMMARY_PROMPT = """请把下面的对话内容合并进已有摘要，输出一段新的摘要。
+要求：保留用户的身份信息、偏好、已确认的事实、未解决的问题和双方的约定，省略寒暄和重复内容；
+只输出摘要正文，不超过500字。
+
+已有摘要：
+{summary}
+
+新增对话：
+{transcript}"""
+
+
+class ChatSessionStore:
+    """chat_sessions集合的读写"""
+
+    def __init__(self):
+        self.session_ttl = 30 * 86400
+        self.max_messages = 200
+        self.summary_enabled = True
+        self.summary_trigger = 24
+        self.summary_keep = 8
+        self.summary_lease = 300
+        self._indexes_ready = False
+
+    def configure(self, session_ttl=30 * 86400, max_messages=200, summary_enabled=True,
+                  summary_trigger=24, summary_keep=8):
+        """更新会话保留时间、历史条数上限和摘要参数"""
+        self.session_ttl = session_ttl
+        self.max_messages = max_messages
+        self.summary_enabled = summary_enabled
+        self.summary_trigger = summary_trigger
+        self.summary_keep = summary_keep
+
+    def _ensure_indexes(self, db):
+        """首次使用时创建过期TTL索引和用户索引"""
+        if self._indexes_ready:
+            return
+        db.chat_sessions.create_index('expires_at', expireAfterSeconds=0)
+        db.chat_sessions.create_index([('user_id', 1), ('updated_at', -1)])
+        self._indexes_ready = True
+
+    def create(self, db, user_id, system_prompt=None, provider='deepseek', model='deepseek-chat'):
+        """
+        创建会话
+
+        Returns:
+            dict: 会话文档
+        """
+        self._ensure_indexes(db)
+        now = datetime.now().isoformat()
+        session = {
+            '_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'provider': provider,
+            'model': model,
+            'system_prompt': system_prompt or None,
+            'summary': None,
+            'messages': [],
+            'unsummarized': 0,
+            'turn_count': 0,
+            'summary_lease': None,
+            'created_at': now,
+            'updated_at': now,
+            'expires_at': datetime.utcnow() + timedelta(seconds=self.session_ttl)
+        }
+        db.chat_sessions.insert_one(session)
+        return session
+
+    def get(self, db, session_id, user_id, with_messages=True):
+        """读取属于该用户的会话（历史只取最近max_messages条）"""
+        projection = {'summary_lease': 0, 'expires_at': 0}
+        if with_messages:
+            projection['messages'] = {'$slice': -self.max_messages}
+        else:
+            projection['messages'] = 0
+        return db.chat_sessions.find_one({'_id': session_id, 'user_id': user_id}, projection)
+
+    def delete(self, db, session_id, user_id):
+        """删除会话，返回是否删除成功"""
+        return db.chat_sessions.delete_one({'_id': session_id, 'user_id': user_id}).deleted_count > 0
+
+    def build_messages(self, session, message):
+        """由system提示词、滚动摘要、历史消息和本轮用户消息组成发给模型的消息列表"""
+        messages = []
+        if session.get('system_prompt'):
+            messages.append({'role': 'system', 'content': session['system_prompt']})
+        if session.get('summary'):
+            messages.append({'role': 'system', 'content': f"以下是此前对话的摘要：\n{session['summary']}"})
+        messages.extend(
+            {'role': m['role'], 'content': m['content']} for m in session.get('messages', [])
+        )
+        messages.append({'role': 'user', 'content': message})
+        return messages
+
+    def append_turn(self, db, session_id, user_id, message, reply, sent_at):
+        """
+        追加本轮用户消息和AI回复（历史超过上限时丢弃最早的消息）
+
+        Returns:
+            dict: 更新后的会话计数字段，会话不存在时为None
+        """
+        now = datetime.now().isoformat()
+        return db.chat_sessions.find_one_and_update(
+            {'_id': session_id, 'user_id': user_id},
+            {
+                '$push': {'messages': {
+                    '$each': [
+                        {'role': 'user', 'content': message, 'timestamp': sent_at},
+                        {'role': 'assistant', 'content': reply, 'timestamp': now}
+                    ],
+                    '$slice': -self.max_messages
+                }},
+                '$inc': {'turn_count': 1, 'unsummarized': 2},
+                '$set': {
+                    'updated_at': now,
+                    'expires_at': datetime.utcnow() + timedelta(seconds=self.session_ttl)
+                }
+            },
+            projection={'turn_count': 1, 'unsummarized': 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def needs_summary(self, counters):
+        """未摘要消息数达到阈值时需要在后台生成摘要"""
+        return bool(
+            self.summary_enabled and counters
+            and counters.get('unsummarized', 0) >= self.summary_trigger
+        )
+
+    def summarize(self, db, session_id, summarize_fn):
+        """
+        把最近summary_keep条之前的消息合并进滚动摘要并从历史中移除
+
+        summarize_fn(prompt)返回(content, error)；通过租约保证同一会话同时只有一个摘要任务
+        """
+        now = datetime.utcnow()
+        session = db.chat_sessions.find_one_and_update(
+            {'_id': session_id, '$or': [{'summary_lease': None}, {'summary_lease': {'$lt': now}}]},
+            {'$set': {'summary_lease': now + timedelta(seconds=self.summary_lease)}},
+            projection={'summary': 1, 'messages': 1}
+        )
+        if not session:
+            return
+
+        try:
+            old = session['messages'][:-self.summary_keep] if self.summary_keep else session['messages']
+            if not old:
+                return
+            transcript = '\n'.join(
+                f"{'用户' if m['role'] == 'user' else '助手'}：{m['content']}" for m in old
+            )
+            content, error = summarize_fn(SUMMARY_PROMPT.format(
+                summary=session.get('summary') or '（无）',
+                transcript=transcript
+            ))
+            if error or not content:
+                print(f"会话{session_id}生成摘要失败: {error}")
+                return
+
+            # 按时间戳移除已摘要的消息，期间新追加的消息不受影响
+            db.chat_sessions.update_one({'_id': session_id}, {
+                '$set': {'summary': content.strip()},
+                '$pull': {'messages': {'timestamp': {'$lte': old[-1]['timestamp']}}},
+                '$inc': {'unsummarized': -len(old)}
+            })
+        finally:
+            db.chat_sessions.update_one({'_id': session_id}, {'$set': {'summary_lease': None}})
+
+
+# 全局会话存储实例
+chat_session_store = ChatSessionStore()
+
+
+#初始化对话会话
+def init_chat_sessions(app):
+    """读取会话保留时间和摘要配置"""
+    chat_session_store.configure(
+        session_ttl=app.config.get('AI_CHAT_SESSION_TTL', 30 * 86400),
+        max_messages=app.config.get('AI_CHAT_SESSION_MAX_MESSAGES', 200),
+        summary_enabled=app.config.get('AI_CHAT_SUMMARY_ENABLED', True),
+        summary_trigger=app.config.get('AI_CHAT_SUMMARY_TRIGGER', 24),
+        summary_keep=app.config.get('AI_CHAT_SUMMARY_KEEP', 8)
+    )
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+萌芽币预扣模块
+AI调用前用一次条件更新预扣萌芽币并取回用户信息；调用成功后确认扣费，
+失败时退回。预扣记录保存在用户文档的coin_reservations数组中，
+超时未结算的预扣（如worker中途退出）由清理任务退回
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from .ai_jobs import run_in_background
+from .ai_usage import usage_ledger
+from .user_cache import user_cache, versioned
+
+# 预扣配置（init_coins时由Flask配置覆盖）
+_coin_settings = {
+    'reservation_timeout': 900,
+    'sweep_interval': 60
+}
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+_indexes_ready = False
+
+
+#初始化萌芽币预扣配置
+def init_coins(app):
+    """读取预扣超时和清理间隔配置"""
+    _coin_settings['reservation_timeout'] = app.config.get('AI_COIN_RESERVATION_TIMEOUT', 900)
+    _coin_settings['sweep_interval'] = app.config.get('AI_COIN_SWEEP_INTERVAL', 60)
+
+#预扣萌芽币
+def reserve_coins(db, user_id, api_type, cost):
+    """
+    余额充足时原子地扣除萌芽币并记录预扣，同时返回用户信息
+
+    Returns:
+        tuple: (user, reservation)，余额不足或用户不存在时user为None
+    """
+    _maybe_sweep(db)
+    reservation = {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'api_type': api_type,
+        'cost': cost,
+        'created_at': datetime.utcnow()
+    }
+    user = db.userdata.find_one_and_update(
+        {'_id': ObjectId(user_id), '萌芽币': {'$gte': cost}},
+        versioned({
+            '$inc': {'萌芽币': -cost},
+            '$push': {'coin_reservations': {
+                'id': reservation['id'],
+                'api_type': api_type,
+                'cost': cost,
+                'created_at': reservation['created_at']
+            }}
+        }),
+        projection={'用户名': 1, '邮箱': 1, '萌芽币': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        return None, None
+    user_cache.invalidate(user_id)
+    return user, reservation
+
+#确认扣费
+def commit_reservation(db, reservation):
+    """AI调用成功，移除预扣记录并写入使用记录（ai_usage集合）；已结算的预扣不会重复处理
+    （预扣记录不在用户快照中，余额在预扣时已变化，因此不递增版本）"""
+    result = db.userdata.update_one(
+        {'_id': ObjectId(reservation['user_id']), 'coin_reservations.id': reservation['id']},
+        {'$pull': {'coin_reservations': {'id': reservation['id']}}}
+    )
+    if result.modified_count < 1:
+        return False
+    usage_ledger.record(db, reservation['user_id'], reservation['api_type'], reservation['cost'])
+    return True
+
+#退回预扣
+def refund_reservation(db, reservation):
+    """AI调用失败，移除预扣记录并退回萌芽币；已结算的预扣不会重复退回"""
+    result = db.userdata.update_one(
+        {'_id': ObjectId(reservation['user_id']), 'coin_reservations.id': reservation['id']},
+        versioned({
+            '$pull': {'coin_reservations': {'id': reservation['id']}},
+            '$inc': {'萌芽币': reservation['cost']}
+        })
+    )
+    if result.modified_count < 1:
+        return False
+    user_cache.invalidate(reservation['user_id'])
+    return True
+
+#按响应状态结算预扣
+def settle_reservation(db, reservation, http_status):
+    """状态码小于400时确认扣费，否则退回"""
+    try:
+        if http_status < 400:
+            commit_reservation(db, reservation)
+        else:
+            refund_reservation(db, reservation)
+    except Exception as e:
+        print(f"结算萌芽币预扣{reservation['id']}失败: {str(e)}")
+
+#清理超时预扣
+def sweep_stale_reservations(db, limit=100):
+    """
+    退回超过reservation_timeout仍未结算的预扣
+
+    Returns:
+        int: 退回的预扣数量
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=_coin_settings['reservation_timeout'])
+    refunded = 0
+    users = db.userdata.find(
+        {'coin_reservations.created_at': {'$lt': cutoff}},
+        {'coin_reservations': 1}
+    ).limit(limit)
+    for user in users:
+        for item in user.get('coin_reservations', []):
+            if item['created_at'] >= cutoff:
+                continue
+            reservation = dict(item, user_id=str(user['_id']))
+            if refund_reservation(db, reservation):
+                refunded += 1
+                print(f"退回超时未结算的萌芽币预扣: 用户{reservation['user_id']} {item['cost']}")
+    return refunded
+
+def _maybe_sweep(db):
+    """每个worker按sweep_interval在后台触发一次清理"""
+    global _last_sweep
+    now = time.monotonic()
+    with _sweep_lock:
+        if now - _last_sweep < _coin_settings['sweep_interval']:
+            return
+        _last_sweep = now
+    run_in_background(_sweep, db)
+
+def _sweep(db):
+    """后台清理任务"""
+    global _indexes_ready
+    if not _indexes_ready:
+        db.userdata.create_index('coin_reservations.created_at', sparse=True)
+        _indexes_ready = True
+    sweep_stale_reservations(db)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI对话上下文预算模块
+本地估算消息token数，按模型的上下文预算裁剪对话历史：
+保留system提示词和最近的对话，把超出预算的最早对话折叠为一条说明
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import re
+import math
+
+# 估算系数：中日韩字符约0.6个token，其余字符约0.3个token，每条消息另计格式开销
+CJK_TOKEN_RATIO = 0.6
+OTHER_TOKEN_RATIO = 0.3
+MESSAGE_OVERHEAD = 4
+
+# 折叠说明中每条被省略消息保留的字符数
+COLLAPSE_SNIPPET_CHARS = 40
+
+_CJK_PATTERN = re.compile(
+    r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]'
+)
+
+
+#提取消息文本
+def message_text(message):
+    """消息content可能是字符串或多段内容列表，统一转为文本"""
+    content = message.get('content') if isinstance(message, dict) else message
+    if content is None:
+        return ''
+    if isinstance(content, list):
+        return ''.join(
+            part.get('text', '') if isinstance(part, dict) else str(part) for part in content
+        )
+    return str(content)
+
+#估算文本token数
+def estimate_tokens(text):
+    """按中日韩字符和其他字符分别计数的快速估算，无需加载分词器"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return math.ceil(cjk * CJK_TOKEN_RATIO + (len(text) - cjk) * OTHER_TOKEN_RATIO)
+
+#估算单条消息token数
+def estimate_message_tokens(message):
+    """消息文本token数加上角色等格式开销"""
+    return estimate_tokens(message_text(message)) + MESSAGE_OVERHEAD
+
+
+class ContextBudgeter:
+    """按模型预算裁剪对话历史"""
+
+    def __init__(self):
+        self.budgets = {}  # 各模型预算只在Config.AI_CONTEXT_BUDGETS中配置，初始化前均使用默认预算
+        self.default_budget = 16000
+
+    def configure(self, budgets=None, default_budget=16000):
+        """更新各模型预算和未配置模型的默认预算"""
+        if budgets is not None:
+            self.budgets = dict(budgets)
+        self.default_budget = default_budget
+
+    def budget_for(self, model):
+        """模型的上下文token预算"""
+        return self.budgets.get(model, self.default_budget)
+
+    def check(self, messages, model):
+        """
+        检查是否存在无法通过裁剪解决的超长消息
+
+        Returns:
+            str: 错误信息，可以处理时返回None
+        """
+        budget = self.budget_for(model)
+        system_tokens = sum(
+            estimate_message_tokens(m) for m in messages if m.get('role') == 'system'
+        )
+        if system_tokens > budget:
+            return f'系统提示词过长（约{system_tokens} tokens），超出模型上下文预算{budget} tokens'
+        for index, message in enumerate(messages):
+            if message.get('role') == 'system':
+                continue
+            tokens = estimate_message_tokens(message)
+            if system_tokens + tokens > budget:
+                return f'第{index + 1}条消息过长（约{tokens} tokens），超出模型上下文预算{budget} tokens'
+        return None
+
+    def fit(self, messages, model):
+        """
+        裁剪对话历史使其不超过模型预算（调用前需已通过check）
+
+        Returns:
+            tuple: (裁剪后的消息列表, 裁剪报告)
+        """
+        budget = self.budget_for(model)
+        system_messages = [m for m in messages if m.get('role') == 'system']
+        turns = [m for m in messages if m.get('role') != 'system']
+        costs = [estimate_message_tokens(m) for m in turns]
+        input_tokens = sum(estimate_message_tokens(m) for m in system_messages) + sum(costs)
+        remaining = budget - (input_tokens - sum(costs))
+
+        # 从最新的消息往前保留，直到预算用完
+        keep_from = len(turns)
+        while keep_from > 0 and costs[keep_from - 1] <= remaining:
+            keep_from -= 1
+            remaining -= costs[keep_from]
+
+        dropped = turns[:keep_from]
+        kept = turns[keep_from:]
+        collapsed = None
+        if dropped:
+            collapsed = self._collapse(dropped, remaining)
+            # 说明本身放不下时，再让出一条最早的保留消息（始终保留最新一条）
+            while collapsed is None and len(kept) > 1:
+                remaining += estimate_message_tokens(kept[0])
+                dropped.append(kept.pop(0))
+                collapsed = self._collapse(dropped, remaining)
+
+        result = list(system_messages)
+        if collapsed:
+            result.append(collapsed)
+        result.extend(kept)
+
+        report = {
+            'trimmed': bool(dropped),
+            'dropped_messages': len(dropped),
+            'collapsed': collapsed is not None,
+            'input_tokens_estimate': input_tokens,
+            'sent_tokens_estimate': sum(estimate_message_tokens(m) for m in result),
+            'budget': budget
+        }
+        return result, report
+
+    def _collapse(self, dropped, available):
+        """把被省略的最早对话折叠为一条system说明，预算放不下时返回None"""
+        header = f'（为控制上下文长度，此前的{len(dropped)}条较早对话已省略，以下为其中用户消息的摘录）'
+        note = {'role': 'system', 'content': header}
+        if estimate_message_tokens(note) > available:
+            return None
+        lines = [header]
+        for message in dropped:
+            if message.get('role') != 'user':
+                continue
+            text = re.sub(r'\s+', ' ', message_text(message)).strip()
+            if not text:
+                continue
+            if len(text) > COLLAPSE_SNIPPET_CHARS:
+                text = text[:COLLAPSE_SNIPPET_CHARS] + '…'
+            candidate = '\n'.join(lines + [f'- {text}'])
+            if estimate_message_tokens({'content': candidate}) > available:
+                break
+            lines.append(f'- {text}')
+        note['content'] = '\n'.join(lines)
+        return note
+
+
+# 全局上下文预算实例
+context_budgeter = ContextBudgeter()
+
+
+#初始化上下文预算
+def init_context_budget(app):
+    """读取各模型上下文预算配置"""
+    context_budgeter.configure(
+        budgets=app.config.get('AI_CONTEXT_BUDGETS'),
+        default_budget=app.config.get('AI_CONTEXT_DEFAULT_BUDGET', 16000)
+    )
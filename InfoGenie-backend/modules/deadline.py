@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI请求截止时间模块
+每个AI请求带一个整体截止时间：来自X-Request-Timeout/X-Request-Deadline请求头，
+或按该接口最近观测到的p99耗时推算的默认值（不超过nginx/gunicorn的300秒超时）。
+服务商调用的单次超时、是否重试都由剩余时间决定；客户端断开或截止时间已过时取消仍在进行的调用
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import math
+import time
+import select
+import socket
+import threading
+from collections import deque
+from contextvars import ContextVar
+from flask import g
+
+# 截止时间已过时返回的错误信息
+DEADLINE_ERROR = "AI请求超过截止时间"
+
+# 截止时间配置（init_deadline时由Flask配置覆盖）
+_deadline_settings = {
+    'default': 120,
+    'max': 280,
+    'min': 10,
+    'p99_multiplier': 2.0,
+    'min_samples': 20,
+    'min_attempt': 3
+}
+
+_current_deadline = ContextVar('ai_deadline', default=None)
+
+
+class CancelEvent(threading.Event):
+    """置位时调用已注册回调的取消事件，用于中断正在等待响应的上游请求"""
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """注册置位时的回调（已置位时立即调用），返回注销函数"""
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"取消回调执行失败: {str(e)}")
+
+
+class Deadline:
+    """一次请求的截止时间和取消信号"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.cancelled = CancelEvent()
+        self.upstream_called = False  # 是否向上游发出过请求（只有这类请求计入接口耗时）
+        self._linked = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def remaining(self):
+        """剩余秒数（不小于0）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.cancelled.is_set() or time.monotonic() >= self.expires_at
+
+    def can_start(self, expected=0.0, delay=0.0):
+        """等待delay秒后，剩余时间是否仍足够发起一次预计耗时expected秒的尝试"""
+        if self.cancelled.is_set():
+            return False
+        return self.remaining() - delay >= max(expected or 0.0, _deadline_settings['min_attempt'])
+
+    def link(self, event):
+        """取消时一并置位的事件（如路由中各提供商的取消事件）"""
+        with self._lock:
+            self._linked.append(event)
+            if self.cancelled.is_set():
+                event.set()
+
+    def mark_upstream(self):
+        """记录已向上游发出请求（缓存命中、合并请求的跟随者、本地计算的请求不会调用）"""
+        self.upstream_called = True
+
+    def cancel(self):
+        """取消请求：置位自身和所有关联的事件"""
+        with self._lock:
+            self.cancelled.set()
+            for event in self._linked:
+                event.set()
+
+
+class EndpointLatency:
+    """各接口最近的完整请求耗时，用于推算默认截止时间"""
+
+    def __init__(self, max_samples=200):
+        self._samples = {}
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            samples = self._samples.setdefault(endpoint, deque(maxlen=self._max_samples))
+            samples.append(seconds)
+
+    def p99(self, endpoint):
+        """样本不足min_samples时返回None"""
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < _deadline_settings['min_samples']:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(len(samples) * 0.99) - 1)]
+
+
+class DisconnectWatcher:
+    """后台线程轮询请求socket，客户端断开时取消对应请求"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, sock, deadline):
+        if sock is None:
+            return
+        with self._lock:
+            self._watched[sock] = deadline
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ai-disconnect-watch', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, sock):
+        with self._lock:
+            self._watched.pop(sock, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = dict(self._watched)
+            if not watched:
+                continue
+            try:
+                readable, _, _ = select.select(list(watched), [], [], 0)
+            except (OSError, ValueError):
+                readable = [sock for sock in watched if sock.fileno() < 0]
+            for sock in readable:
+                if _peer_closed(sock):
+                    watched[sock].cancel()
+                    self.unwatch(sock)
+
+
+def _peer_closed(sock):
+    """socket可读但读不到数据说明客户端已关闭连接（请求体此前已读完）"""
+    try:
+        return sock.fileno() < 0 or sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+endpoint_latency = EndpointLatency()
+disconnect_watcher = DisconnectWatcher()
+
+
+#初始化截止时间配置
+def init_deadline(app):
+    """读取默认截止时间、上限和推算参数"""
+    _deadline_settings['default'] = app.config.get('AI_DEADLINE_DEFAULT', 120)
+    _deadline_settings['max'] = app.config.get('AI_DEADLINE_MAX', 280)
+    _deadline_settings['min'] = app.config.get('AI_DEADLINE_MIN', 10)
+    _deadline_settings['p99_multiplier'] = app.config.get('AI_DEADLINE_P99_MULTIPLIER', 2.0)
+    _deadline_settings['min_attempt'] = app.config.get('AI_DEADLINE_MIN_ATTEMPT', 3)
+    app.teardown_request(_end_request_deadline)
+
+#解析请求头中的截止时间
+def requested_timeout(headers):
+    """
+    X-Request-Timeout为相对秒数，X-Request-Deadline为Unix时间戳（秒或毫秒）
+
+    Returns:
+        float: 剩余秒数，未提供或无法解析时为None
+    """
+    value = headers.get('X-Request-Timeout')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    value = headers.get('X-Request-Deadline')
+    if value:
+        try:
+            deadline = float(value)
+        except ValueError:
+            return None
+        if deadline > 1e12:
+            deadline /= 1000.0
+        return deadline - time.time()
+    return None
+
+#计算接口默认截止时间
+def default_timeout(endpoint):
+    """按接口最近p99耗时乘以系数推算，样本不足时使用配置的默认值"""
+    p99 = endpoint_latency.p99(endpoint)
+    if p99 is None:
+        return _deadline_settings['default']
+    return max(_deadline_settings['min'], p99 * _deadline_settings['p99_multiplier'])
+
+#开始请求截止时间
+def start_deadline(seconds, capped=True):
+    """创建截止时间（capped时不超过配置上限）并设为当前上下文的截止时间"""
+    seconds = max(seconds, 0.0)
+    deadline = Deadline(min(seconds, _deadline_settings['max']) if capped else seconds)
+    deadline._token = _current_deadline.set(deadline)
+    return deadline
+
+#结束请求截止时间
+def end_deadline(deadline):
+    """恢复设置该截止时间之前的值，避免复用的线程把它带到后续请求（只能在设置它的上下文中恢复）"""
+    if deadline is None or deadline._token is None:
+        return
+    token, deadline._token = deadline._token, None
+    try:
+        _current_deadline.reset(token)
+    except ValueError:
+        # 在其他上下文中调用（如后台线程），该上下文中没有设置过这个截止时间
+        pass
+
+def _end_request_deadline(exc):
+    """请求结束时（流式输出在输出结束后）结束verify_user_coins开始的截止时间"""
+    end_deadline(g.pop('ai_deadline', None))
+
+def current_deadline():
+    """当前上下文的截止时间，没有时为None"""
+    return _current_deadline.get()
+
+def request_socket(environ):
+    """取底层客户端socket（gunicorn同步worker或werkzeug开发服务器）"""
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+
+#限制单次尝试的超时时间
+def attempt_timeout(timeout):
+    """单次尝试的超时不超过剩余时间"""
+    deadline = current_deadline()
+    if deadline is None:
+        return timeout
+    return max(0.1, min(timeout, deadline.remaining()))
+
+#记录已调用上游
+def mark_upstream():
+    """当前请求即将向上游发出请求"""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.mark_upstream()
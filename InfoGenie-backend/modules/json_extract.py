@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI输出JSON提取模块
+从模型输出中提取第一个完整且符合接口schema的JSON对象：
+跳过<think>推理块和代码块围栏，用线性时间的括号配对扫描定位对象（感知字符串和转义），
+支持流式输出逐段输入；提取失败时可构造一次低成本的修复请求
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import re
+import json
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+
+# 各接口要求的字段及类型（值为空也视为缺少）
+JSON_SCHEMAS = {
+    'variable-naming': {'suggestions': dict},
+    'expression-maker': {'expressions': dict, 'summary': dict},
+    'kinship-calculator': {'mandarin_title': str},
+    'translation': {'translations': dict}
+}
+
+_TYPE_NAMES = {dict: '对象', list: '数组', str: '字符串'}
+
+# 对象外只关心对象起点和<think>标签；对象内只关心括号和引号；字符串内只关心引号和转义
+_OUTSIDE_SPECIAL = re.compile(r'[{<]')
+_OBJECT_SPECIAL = re.compile(r'[{}"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_THINK_BLOCK = re.compile(r'<think>[\s\S]*?(?:</think>|$)')
+
+
+#校验JSON对象是否符合schema
+def validate_schema(obj, schema):
+    """
+    Returns:
+        str: 不符合时的错误说明，符合时为None
+    """
+    if not isinstance(obj, dict):
+        return 'JSON顶层不是对象'
+    for field, expected in (schema or {}).items():
+        value = obj.get(field)
+        if not value:
+            return f'缺少字段{field}'
+        if not isinstance(value, expected):
+            return f'字段{field}应为{_TYPE_NAMES.get(expected, expected.__name__)}'
+    return None
+
+#去掉推理块
+def strip_think(text):
+    """去掉<think>推理块（含未闭合的），用于修复请求时减少回传的token"""
+    return _THINK_BLOCK.sub('', text or '').strip()
+
+
+class IncrementalJSONExtractor:
+    """逐段输入模型输出，扫描出第一个完整且符合schema的JSON对象（每个字符只处理一次）"""
+
+    def __init__(self, schema=None):
+        self.schema = schema
+        self.result = None
+        self.error = None  # 最近一个候选对象的解析或校验错误
+        self._parts = []  # 当前候选对象已扫描到的片段
+        self._tail = ''  # 上一段末尾可能被截断的标签
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._in_think = False
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    def feed(self, chunk):
+        """输入一段输出，已找到符合schema的对象时返回该对象，否则返回None"""
+        if self.result is not None or not chunk:
+            return self.result
+        text = self._tail + chunk
+        self._tail = ''
+        i, n = 0, len(text)
+        while i < n:
+            if self._in_think:
+                end = text.find(THINK_CLOSE, i)
+                if end < 0:
+                    # 结束标签可能跨段，保留末尾不足一个标签长度的部分
+                    self._tail = text[max(i, n - len(THINK_CLOSE) + 1):]
+                    return None
+                self._in_think = False
+                i = end + len(THINK_CLOSE)
+                continue
+
+            if self._depth == 0:
+                match = _OUTSIDE_SPECIAL.search(text, i)
+                if not match:
+                    return None
+                i = match.start()
+                if text[i] == '{':
+                    self._parts.append('{')
+                    self._depth = 1
+                    i += 1
+                elif text.startswith(THINK_OPEN, i):
+                    self._in_think = True
+                    i += len(THINK_OPEN)
+                elif n - i < len(THINK_OPEN) and THINK_OPEN.startswith(text[i:]):
+                    self._tail = text[i:]
+                    return None
+                else:
+                    i += 1
+                continue
+
+            start = i
+            i = self._scan_object(text, i)
+            self._parts.append(text[start:i])
+            if self._depth == 0 and self._accept(''.join(self._parts)):
+                return self.result
+        return None
+
+    def _scan_object(self, text, i):
+        """在对象内扫描到对象闭合处或本段末尾，返回扫描结束的位置"""
+        n = len(text)
+        while i < n:
+            if self._escape:
+                self._escape = False
+                i += 1
+            elif self._in_string:
+                match = _STRING_SPECIAL.search(text, i)
+                if not match:
+                    return n
+                i = match.end()
+                if match.group() == '\\':
+                    self._escape = True
+                else:
+                    self._in_string = False
+            else:
+                match = _OBJECT_SPECIAL.search(text, i)
+                if not match:
+                    return n
+                i = match.end()
+                char = match.group()
+                if char == '"':
+                    self._in_string = True
+                elif char == '{':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        return i
+        return n
+
+    def _accept(self, candidate):
+        """尝试解析并校验一个括号配对完整的候选对象"""
+        self._parts = []
+        try:
+            obj = json.loads(candidate)
+        except ValueError:
+            self.error = 'JSON格式无法解析'
+            return False
+        self.error = validate_schema(obj, self.schema)
+        if self.error:
+            return False
+        self.result = obj
+        return True
+
+    def finish(self):
+        """输出结束，返回未能提取的原因（已提取到对象时为None）"""
+        if self.result is not None:
+            return None
+        if self._depth > 0:
+            return 'JSON对象不完整（输出可能被截断）'
+        return self.error or '未找到JSON对象'
+
+
+#从AI输出中提取JSON对象
+def extract_json(content, schema=None):
+    """
+    Returns:
+        tuple: (obj, error)，提取失败时obj为None、error为失败原因
+    """
+    extractor = IncrementalJSONExtractor(schema)
+    obj = extractor.feed(content or '')
+    if obj is None:
+        return None, extractor.finish()
+    return obj, None
+
+#构造JSON修复请求
+def repair_messages(content, error, schema=None):
+    """只回传去掉推理块的原输出和失败原因，不重复原始提示词"""
+    fields = f"，必须包含字段：{'、'.join(schema)}" if schema else ''
+    prompt = (
+        f"下面这段输出本应是一个JSON对象，但{error}。"
+        f"请在不改变内容的前提下修正为合法的JSON对象{fields}。只返回JSON，不要包含其他文字。\n\n"
+        f"{strip_think(content)}"
+    )
+    return [{'role': 'user', 'content': prompt}]
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+亲属称呼本地解析引擎
+将“的”连接的关系链化简为关系代码序列，查表得到普通话称呼及常用方言称呼
+无法确定的关系链（如涉及自身性别或年龄比较）返回None，交由AI处理；
+方言对照表未收录的称呼或方言列在missing_dialects中，由接口只就这些方言调用AI
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+# 基本关系词 -> 关系代码
+# f父 m母 h丈夫 w妻子 s儿子 d女儿 ob哥哥 lb弟弟 os姐姐 ls妹妹
+RELATION_ALIASES = {
+    '爸爸': 'f', '父亲': 'f', '爸': 'f', '老爸': 'f', '爹': 'f',
+    '妈妈': 'm', '母亲': 'm', '妈': 'm', '老妈': 'm', '娘': 'm',
+    '丈夫': 'h', '老公': 'h',
+    '妻子': 'w', '老婆': 'w',
+    '儿子': 's',
+    '女儿': 'd',
+    '哥哥': 'ob', '哥': 'ob',
+    '弟弟': 'lb', '弟': 'lb',
+    '姐姐': 'os', '姐': 'os',
+    '妹妹': 'ls', '妹': 'ls'
+}
+
+# 相邻两段关系的化简规则，仅收录与自身性别、年龄无关的确定性规则
+REDUCTION_RULES = {
+    ('f', 'w'): ('m',),
+    ('m', 'h'): ('f',),
+    ('h', 'w'): (),
+    ('w', 'h'): (),
+    # 兄弟姐妹的父母就是自己的父母
+    ('ob', 'f'): ('f',), ('lb', 'f'): ('f',), ('os', 'f'): ('f',), ('ls', 'f'): ('f',),
+    ('ob', 'm'): ('m',), ('lb', 'm'): ('m',), ('os', 'm'): ('m',), ('ls', 'm'): ('m',),
+    # 年长者的年长同胞仍年长于自己，年幼者的年幼同胞仍年幼于自己
+    ('ob', 'ob'): ('ob',), ('ob', 'os'): ('os',), ('os', 'ob'): ('ob',), ('os', 'os'): ('os',),
+    ('lb', 'lb'): ('lb',), ('lb', 'ls'): ('ls',), ('ls', 'lb'): ('lb',), ('ls', 'ls'): ('ls',)
+}
+
+# 关系代码序列 -> (普通话称呼, 说明)
+MANDARIN_TITLES = {
+    (): ('自己', ''),
+    ('f',): ('爸爸', ''),
+    ('m',): ('妈妈', ''),
+    ('h',): ('丈夫', ''),
+    ('w',): ('妻子', ''),
+    ('s',): ('儿子', ''),
+    ('d',): ('女儿', ''),
+    ('ob',): ('哥哥', ''),
+    ('lb',): ('弟弟', ''),
+    ('os',): ('姐姐', ''),
+    ('ls',): ('妹妹', ''),
+    # 祖辈
+    ('f', 'f'): ('爷爷', '父系，书面称祖父'),
+    ('f', 'm'): ('奶奶', '父系，书面称祖母'),
+    ('m', 'f'): ('外公', '母系，书面称外祖父，北方多称姥爷'),
+    ('m', 'm'): ('外婆', '母系，书面称外祖母，北方多称姥姥'),
+    ('f', 'f', 'f'): ('曾祖父', '父系，口语称太爷爷'),
+    ('f', 'f', 'm'): ('曾祖母', '父系，口语称太奶奶'),
+    ('m', 'f', 'f'): ('外曾祖父', '母系，口语称太姥爷'),
+    ('m', 'f', 'm'): ('外曾祖母', '母系，口语称太姥姥'),
+    # 父母的兄弟姐妹及其配偶
+    ('f', 'ob'): ('伯父', '父亲的哥哥，口语称伯伯'),
+    ('f', 'lb'): ('叔叔', '父亲的弟弟，书面称叔父'),
+    ('f', 'os'): ('姑妈', '父亲的姐姐'),
+    ('f', 'ls'): ('姑姑', '父亲的妹妹'),
+    ('m', 'ob'): ('舅舅', '母亲的哥哥'),
+    ('m', 'lb'): ('舅舅', '母亲的弟弟'),
+    ('m', 'os'): ('姨妈', '母亲的姐姐'),
+    ('m', 'ls'): ('小姨', '母亲的妹妹'),
+    ('f', 'ob', 'w'): ('伯母', '伯父的妻子'),
+    ('f', 'lb', 'w'): ('婶婶', '叔叔的妻子'),
+    ('f', 'os', 'h'): ('姑父', '姑妈的丈夫'),
+    ('f', 'ls', 'h'): ('姑父', '姑姑的丈夫'),
+    ('m', 'ob', 'w'): ('舅妈', '舅舅的妻子'),
+    ('m', 'lb', 'w'): ('舅妈', '舅舅的妻子'),
+    ('m', 'os', 'h'): ('姨父', '姨妈的丈夫'),
+    ('m', 'ls', 'h'): ('姨父', '小姨的丈夫'),
+    # 堂亲、表亲（与自己的长幼无法由关系链确定）
+    ('f', 'ob', 's'): ('堂哥/堂弟', '比自己年长称堂哥，年幼称堂弟'),
+    ('f', 'lb', 's'): ('堂哥/堂弟', '比自己年长称堂哥，年幼称堂弟'),
+    ('f', 'ob', 'd'): ('堂姐/堂妹', '比自己年长称堂姐，年幼称堂妹'),
+    ('f', 'lb', 'd'): ('堂姐/堂妹', '比自己年长称堂姐，年幼称堂妹'),
+    ('f', 'os', 's'): ('表哥/表弟', '父系姑表亲，比自己年长称表哥，年幼称表弟'),
+    ('f', 'ls', 's'): ('表哥/表弟', '父系姑表亲，比自己年长称表哥，年幼称表弟'),
+    ('f', 'os', 'd'): ('表姐/表妹', '父系姑表亲，比自己年长称表姐，年幼称表妹'),
+    ('f', 'ls', 'd'): ('表姐/表妹', '父系姑表亲，比自己年长称表姐，年幼称表妹'),
+    ('m', 'ob', 's'): ('表哥/表弟', '母系舅表亲，比自己年长称表哥，年幼称表弟'),
+    ('m', 'lb', 's'): ('表哥/表弟', '母系舅表亲，比自己年长称表哥，年幼称表弟'),
+    ('m', 'ob', 'd'): ('表姐/表妹', '母系舅表亲，比自己年长称表姐，年幼称表妹'),
+    ('m', 'lb', 'd'): ('表姐/表妹', '母系舅表亲，比自己年长称表姐，年幼称表妹'),
+    ('m', 'os', 's'): ('表哥/表弟', '母系姨表亲，比自己年长称表哥，年幼称表弟'),
+    ('m', 'ls', 's'): ('表哥/表弟', '母系姨表亲，比自己年长称表哥，年幼称表弟'),
+    ('m', 'os', 'd'): ('表姐/表妹', '母系姨表亲，比自己年长称表姐，年幼称表妹'),
+    ('m', 'ls', 'd'): ('表姐/表妹', '母系姨表亲，比自己年长称表姐，年幼称表妹'),
+    # 兄弟姐妹的配偶和子女
+    ('ob', 'w'): ('嫂子', '哥哥的妻子'),
+    ('lb', 'w'): ('弟媳', '弟弟的妻子'),
+    ('os', 'h'): ('姐夫', '姐姐的丈夫'),
+    ('ls', 'h'): ('妹夫', '妹妹的丈夫'),
+    ('ob', 's'): ('侄子', '兄弟的儿子'),
+    ('lb', 's'): ('侄子', '兄弟的儿子'),
+    ('ob', 'd'): ('侄女', '兄弟的女儿'),
+    ('lb', 'd'): ('侄女', '兄弟的女儿'),
+    ('os', 's'): ('外甥', '姐妹的儿子'),
+    ('ls', 's'): ('外甥', '姐妹的儿子'),
+    ('os', 'd'): ('外甥女', '姐妹的女儿'),
+    ('ls', 'd'): ('外甥女', '姐妹的女儿'),
+    # 子女的配偶和子女
+    ('s', 'w'): ('儿媳', '儿子的妻子'),
+    ('d', 'h'): ('女婿', '女儿的丈夫'),
+    ('s', 's'): ('孙子', ''),
+    ('s', 'd'): ('孙女', ''),
+    ('d', 's'): ('外孙', ''),
+    ('d', 'd'): ('外孙女', ''),
+    # 配偶的亲属
+    ('h', 'f'): ('公公', '丈夫的父亲'),
+    ('h', 'm'): ('婆婆', '丈夫的母亲'),
+    ('w', 'f'): ('岳父', '妻子的父亲，口语称老丈人'),
+    ('w', 'm'): ('岳母', '妻子的母亲，口语称丈母娘'),
+    ('h', 'ob'): ('大伯子', '丈夫的哥哥'),
+    ('h', 'lb'): ('小叔子', '丈夫的弟弟'),
+    ('h', 'os'): ('大姑子', '丈夫的姐姐'),
+    ('h', 'ls'): ('小姑子', '丈夫的妹妹'),
+    ('w', 'ob'): ('大舅子', '妻子的哥哥'),
+    ('w', 'lb'): ('小舅子', '妻子的弟弟'),
+    ('w', 'os'): ('大姨子', '妻子的姐姐'),
+    ('w', 'ls'): ('小姨子', '妻子的妹妹')
+}
+
+# 默认查询的方言
+DEFAULT_DIALECTS = ['粤语', '闽南语', '上海话', '四川话', '东北话', '客家话']
+
+# 常用称呼的方言对照表：普通话称呼 -> 方言 -> (称呼, 发音)
+DIALECT_TITLES = {
+    '爸爸': {
+        '粤语': ('阿爸', 'aa3 baa4'), '闽南语': ('阿爸', 'a-pah'), '上海话': ('阿爸', 'a-pa'),
+        '四川话': ('老汉儿', 'lao3 har1'), '东北话': ('爸', 'ba4'), '客家话': ('阿爸', 'a-pa')
+    },
+    '妈妈': {
+        '粤语': ('阿妈', 'aa3 maa1'), '闽南语': ('阿母', 'a-bú'), '上海话': ('姆妈', 'm-ma'),
+        '四川话': ('妈', 'ma1'), '东北话': ('妈', 'ma1'), '客家话': ('阿姆', 'a-me')
+    },
+    '爷爷': {
+        '粤语': ('阿爷', 'aa3 je4'), '闽南语': ('阿公', 'a-kong'), '上海话': ('阿爷', 'a-ya'),
+        '四川话': ('爷爷', 'ye2 ye'), '东北话': ('爷爷', 'ye2 ye'), '客家话': ('阿公', 'a-kung')
+    },
+    '奶奶': {
+        '粤语': ('阿嫲', 'aa3 maa4'), '闽南语': ('阿嬷', 'a-má'), '上海话': ('阿娘', 'a-nian'),
+        '四川话': ('奶奶', 'nai3 nai'), '东北话': ('奶奶', 'nai3 nai'), '客家话': ('阿婆', 'a-pho')
+    },
+    '外公': {
+        '粤语': ('公公', 'gung4 gung1'), '闽南语': ('外公', 'guā-kong'), '上海话': ('外公', 'nga-gong'),
+        '四川话': ('家公', 'ga1 gong1'), '东北话': ('姥爷', 'lao3 ye'), '客家话': ('姐公', 'tsia-kung')
+    },
+    '外婆': {
+        '粤语': ('婆婆', 'po4 po2'), '闽南语': ('外嬷', 'guā-má'), '上海话': ('外婆', 'nga-bu'),
+        '四川话': ('家婆', 'ga1 po2'), '东北话': ('姥姥', 'lao3 lao'), '客家话': ('姐婆', 'tsia-pho')
+    },
+    '哥哥': {
+        '粤语': ('哥哥', 'go4 go1'), '闽南语': ('阿兄', 'a-hiann'), '上海话': ('阿哥', 'a-gu'),
+        '四川话': ('哥哥', 'go1 go'), '东北话': ('哥', 'ge1'), '客家话': ('阿哥', 'a-ko')
+    },
+    '姐姐': {
+        '粤语': ('家姐', 'gaa1 ze1'), '闽南语': ('阿姊', 'a-tsí'), '上海话': ('阿姐', 'a-tsia'),
+        '四川话': ('姐姐', 'jie3 jie'), '东北话': ('姐', 'jie3'), '客家话': ('阿姊', 'a-tsi')
+    },
+    '弟弟': {
+        '粤语': ('细佬', 'sai3 lou2'), '闽南语': ('小弟', 'sió-tī'), '上海话': ('阿弟', 'a-di'),
+        '四川话': ('弟娃儿', 'di4 war2'), '东北话': ('老弟', 'lao3 di4'), '客家话': ('老弟', 'lo-thai')
+    },
+    '妹妹': {
+        '粤语': ('细妹', 'sai3 mui2'), '闽南语': ('小妹', 'sió-muē'), '上海话': ('阿妹', 'a-me'),
+        '四川话': ('妹儿', 'mer4'), '东北话': ('老妹儿', 'lao3 meir4'), '客家话': ('老妹', 'lo-moi')
+    },
+    '伯父': {
+        '粤语': ('阿伯', 'aa3 baak3'), '闽南语': ('阿伯', 'a-peh'), '上海话': ('老伯伯', 'lau-pa-pa'),
+        '四川话': ('伯伯', 'be2 be'), '东北话': ('大爷', 'da4 ye'), '客家话': ('阿伯', 'a-pak')
+    },
+    '叔叔': {
+        '粤语': ('阿叔', 'aa3 suk1'), '闽南语': ('阿叔', 'a-tsik'), '上海话': ('爷叔', 'ya-soh'),
+        '四川话': ('幺爸', 'yao1 ba1'), '东北话': ('叔', 'shu1'), '客家话': ('阿叔', 'a-suk')
+    },
+    '姑妈': {
+        '粤语': ('姑妈', 'gu1 maa1'), '闽南语': ('阿姑', 'a-koo'), '上海话': ('娘娘', 'nyian-nyian'),
+        '四川话': ('嬢嬢', 'niang1 niang'), '东北话': ('姑', 'gu1'), '客家话': ('阿姑', 'a-ku')
+    },
+    '舅舅': {
+        '粤语': ('舅父', 'kau5 fu2'), '闽南语': ('阿舅', 'a-kū'), '上海话': ('娘舅', 'nyian-jieu'),
+        '四川话': ('舅舅', 'jiu4 jiu'), '东北话': ('舅', 'jiu4'), '客家话': ('阿舅', 'a-khiu')
+    },
+    '姨妈': {
+        '粤语': ('姨妈', 'ji4 maa1'), '闽南语': ('阿姨', 'a-î'), '上海话': ('阿姨', 'a-yi'),
+        '四川话': ('嬢嬢', 'niang1 niang'), '东北话': ('姨', 'yi2'), '客家话': ('阿姨', 'a-yi')
+    }
+}
+
+# 方言对照表中的补充说明
+DIALECT_NOTES = {
+    ('叔叔', '四川话'): '幺爸多指父亲最小的弟弟，其余按排行称二爸、三爸等'
+}
+
+
+#解析关系链
+def parse_relation_chain(relation_chain):
+    """将“妈妈的爸爸”解析为关系代码列表，含未知关系词时返回None"""
+    parts = [p.strip() for p in relation_chain.replace(' ', '').split('的')]
+    if parts and parts[0] in ('我', '自己'):
+        parts = parts[1:]
+    if not parts or any(not p for p in parts):
+        return None
+
+    codes = []
+    for part in parts:
+        code = RELATION_ALIASES.get(part)
+        if code is None:
+            return None
+        codes.append(code)
+    return codes
+
+#化简关系代码序列
+def reduce_relations(codes):
+    """按化简规则从左到右反复归约，直到无法继续"""
+    stack = []
+    for code in codes:
+        stack.append(code)
+        while len(stack) >= 2:
+            replacement = REDUCTION_RULES.get((stack[-2], stack[-1]))
+            if replacement is None:
+                break
+            del stack[-2:]
+            stack.extend(replacement)
+    return tuple(stack)
+
+#本地解析亲属称呼
+def resolve_kinship(relation_chain, dialects=None):
+    """
+    用本地规则解析亲属称呼
+
+    Returns:
+        dict: mandarin_title、已收录方言的dialect_titles、notes，以及对照表未收录的missing_dialects；
+              关系链无法确定时返回None
+    """
+    codes = parse_relation_chain(relation_chain)
+    if codes is None:
+        return None
+
+    entry = MANDARIN_TITLES.get(reduce_relations(codes))
+    if entry is None:
+        return None
+    mandarin_title, notes = entry
+
+    dialect_titles = {}
+    missing_dialects = []
+    table = DIALECT_TITLES.get(mandarin_title, {})
+    for dialect in (dialects or DEFAULT_DIALECTS):
+        if dialect not in table:
+            missing_dialects.append(dialect)
+            continue
+        title, romanization = table[dialect]
+        dialect_titles[dialect] = {
+            'title': title,
+            'romanization': romanization,
+            'notes': DIALECT_NOTES.get((mandarin_title, dialect), '')
+        }
+
+    return {
+        'mandarin_title': mandarin_title,
+        'dialect_titles': dialect_titles,
+        'notes': notes,
+        'missing_dialects': missing_dialects
+    }
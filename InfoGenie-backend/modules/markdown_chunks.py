@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+长文排版分块模块
+把长文章按标题和段落边界切成不超过token预算的分块（代码块不拆开，超长段落再按句切分），
+在每个worker的有界线程池中并发排版，按原顺序拼接并统一生成目录
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import re
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .context_budget import estimate_tokens
+from .translation_memory import split_segments
+
+# 分块配置（init_markdown_chunks时由Flask配置覆盖）
+_chunk_settings = {
+    'chunk_tokens': 1500,
+    'max_tokens': 4096,
+    'parallelism': 4,
+    'workers': 8,
+    'max_splits': 2
+}
+
+# 标题行：Markdown标题、“第X章/节”、“一、”，以及不以句末标点结尾的短编号行
+_HEADING = re.compile(
+    r'^\s{0,3}(#{1,6}\s+\S'
+    r'|第[一二三四五六七八九十百零\d]+[章节部分篇回]'
+    r'|[一二三四五六七八九十]+[、.．]'
+    r'|\d+(\.\d+)*[、.．]\s*\S[^。！？.!?]{0,28}$)'
+)
+_MARKDOWN_HEADING = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$', re.MULTILINE)
+_OUTER_FENCE = re.compile(r'^\s*```[a-zA-Z]*\n([\s\S]*?)\n```\s*$')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+#判断是否为标题行
+def is_heading(line):
+    stripped = line.strip()
+    return bool(stripped) and len(stripped) <= 40 and _HEADING.match(stripped) is not None
+
+#按行切分为段落块
+def split_blocks(text):
+    """
+    每个非空行为一块，空行并入上一块，代码围栏内的内容合为一块
+
+    Returns:
+        list: 依次拼接即为原文
+    """
+    blocks = []
+    fence = None
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if fence is not None:
+            fence.append(line)
+            if stripped.startswith('```'):
+                blocks.append(''.join(fence))
+                fence = None
+        elif stripped.startswith('```'):
+            fence = [line]
+        elif not stripped and blocks:
+            blocks[-1] += line
+        else:
+            blocks.append(line)
+    if fence is not None:
+        blocks.append(''.join(fence))
+    return blocks
+
+def _split_long_block(block, budget):
+    """超出预算的段落按句切分，单句仍超出时按字符数硬切"""
+    pieces = []
+    for segment, separator in split_segments(block) or [(block, '')]:
+        piece = segment + separator
+        tokens = estimate_tokens(piece)
+        if tokens <= budget:
+            pieces.append(piece)
+            continue
+        step = max(1, int(len(piece) * budget / tokens))
+        pieces.extend(piece[i:i + step] for i in range(0, len(piece), step))
+    return pieces
+
+#切分长文章
+def split_markdown(text, budget=None):
+    """
+    把段落块装入不超过budget个token的分块；遇到标题且当前分块已过半时提前换块，
+    使分块尽量从标题开始
+
+    Returns:
+        list: 分块文本，依次拼接即为原文
+    """
+    budget = budget or _chunk_settings['chunk_tokens']
+    chunks, current, size = [], [], 0
+    for block in split_blocks(text):
+        tokens = estimate_tokens(block)
+        pieces = [block] if tokens <= budget else _split_long_block(block, budget)
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if current and (size + tokens > budget or (is_heading(piece) and size >= budget // 2)):
+                chunks.append(''.join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+#提取原文标题大纲
+def outline(text, limit=30):
+    """原文中的标题行，供各分块统一标题层级"""
+    return [line.strip() for line in text.splitlines() if is_heading(line)][:limit]
+
+#去掉模型输出最外层的代码围栏
+def strip_outer_fence(content):
+    match = _OUTER_FENCE.match(content or '')
+    return match.group(1) if match else (content or '')
+
+#拼接各分块的排版结果
+def stitch(parts, with_toc=True):
+    """按顺序拼接各分块，标题不少于3个时在开头统一生成目录（各分块不自行生成目录）"""
+    body = '\n\n'.join(strip_outer_fence(part).strip() for part in parts if part and part.strip())
+    # 一级标题视为文章标题，不列入目录
+    headings = [(len(level), title) for level, title in _MARKDOWN_HEADING.findall(body) if len(level) > 1]
+    if not with_toc or len(headings) < 3:
+        return body
+    top = min(level for level, _ in headings)
+    toc = '\n'.join(['## 📑 目录', ''] + [f"{'  ' * (level - top)}- {title}" for level, title in headings])
+    if body.startswith('# '):
+        title_line, _, rest = body.partition('\n')
+        return f"{title_line}\n\n{toc}\n\n{rest.lstrip()}"
+    return f"{toc}\n\n{body}"
+
+
+def _get_executor():
+    """获取当前进程的排版线程池（fork后重建）"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(
+                max_workers=_chunk_settings['workers'],
+                thread_name_prefix='ai-markdown'
+            )
+            _executor_pid = pid
+        return _executor
+
+#有界并发执行
+def map_bounded(fn, items, parallelism=None):
+    """
+    每个请求同时最多parallelism个任务在线程池中执行（携带当前上下文，截止时间和指标随之传递），
+    按原顺序逐个产出结果
+    """
+    parallelism = parallelism or _chunk_settings['parallelism']
+    executor = _get_executor()
+    items = list(items)
+    futures = []
+    for index in range(len(items)):
+        while len(futures) - index < parallelism and len(futures) < len(items):
+            futures.append(executor.submit(contextvars.copy_context().run, fn, items[len(futures)]))
+        yield futures[index].result()
+
+def chunk_settings():
+    """当前分块配置"""
+    return dict(_chunk_settings)
+
+
+#初始化长文排版分块配置
+def init_markdown_chunks(app):
+    """读取分块token预算、单块输出上限和并发数"""
+    _chunk_settings['chunk_tokens'] = app.config.get('MARKDOWN_CHUNK_TOKENS', 1500)
+    _chunk_settings['max_tokens'] = app.config.get('MARKDOWN_MAX_TOKENS', 4096)
+    _chunk_settings['parallelism'] = app.config.get('MARKDOWN_CHUNK_PARALLELISM', 4)
+    _chunk_settings['workers'] = app.config.get('MARKDOWN_CHUNK_WORKERS', 8)
+    _chunk_settings['max_splits'] = app.config.get('MARKDOWN_MAX_SPLITS', 2)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库迁移模块
+按顺序执行带编号的迁移（主要是建索引），已执行的迁移记录在schema_migrations集合中，
+重复执行是幂等的。应用启动时同步执行一次（失败时记录错误日志并在/api/health中显示），也可以单独执行：
+    python -m modules.migrations          执行未完成的迁移
+    python -m modules.migrations status   查看各迁移的执行状态
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+import pymongo
+from pymongo import ASCENDING, DESCENDING
+
+# 本进程启动时执行迁移的结果（/api/health中显示）
+_startup_state = {
+    'status': 'not_run',  # not_run / disabled / ok / error
+    'applied': [],
+    'error': None,
+    'finished_at': None
+}
+
+# userdata唯一索引是否已确认建立（确认后不再检查）
+_unique_index_check = {'ready': False, 'checked_at': None}
+UNIQUE_INDEX_RECHECK_INTERVAL = 30
+
+
+class MigrationError(Exception):
+    """迁移无法完成（如已有重复数据无法建唯一索引），需人工处理后重新执行"""
+
+
+#检查字段是否有重复值
+def find_duplicates(collection, field, limit=5):
+    """
+    Returns:
+        list: 出现多次的取值及次数（最多limit个）
+    """
+    pipeline = [
+        {'$match': {field: {'$exists': True}}},
+        {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$limit': limit}
+    ]
+    return [(doc['_id'], doc['count']) for doc in collection.aggregate(pipeline)]
+
+def _create_unique_index(collection, field):
+    """唯一索引只约束有该字段的文档（旧版文档可能没有用户名）；已有重复数据时报告而不是建索引失败"""
+    duplicates = find_duplicates(collection, field)
+    if duplicates:
+        sample = '、'.join(f'{value}（{count}条）' for value, count in duplicates)
+        raise MigrationError(f'{collection.name}.{field}存在重复值，无法建立唯一索引：{sample}')
+    collection.create_index(
+        field, unique=True, name=f'{field}_unique',
+        partialFilterExpression={field: {'$exists': True}}
+    )
+
+
+#检查userdata唯一索引是否已建立
+def unique_indexes_ready(db):
+    """
+    userdata上邮箱、用户名的唯一索引是否都已建立（迁移0001）；
+    确认建立后不再查询，未建立时每UNIQUE_INDEX_RECHECK_INTERVAL秒最多查询一次index_information()
+    """
+    if _unique_index_check['ready']:
+        return True
+    now = time.monotonic()
+    checked_at = _unique_index_check['checked_at']
+    if checked_at is not None and now - checked_at < UNIQUE_INDEX_RECHECK_INTERVAL:
+        return False
+    _unique_index_check['checked_at'] = now
+    try:
+        indexes = db.userdata.index_information()
+    except Exception as e:
+        print(f"检查userdata唯一索引失败: {str(e)}")
+        return False
+    _unique_index_check['ready'] = all(
+        indexes.get(f'{field}_unique', {}).get('unique') for field in ('邮箱', '用户名')
+    )
+    return _unique_index_check['ready']
+
+
+def _userdata_unique_indexes(db):
+    """登录、注册、发送验证码、加币按邮箱查询用户，注册按用户名查重"""
+    _create_unique_index(db.userdata, '邮箱')
+    _create_unique_index(db.userdata, '用户名')
+
+def _userdata_reservation_index(db):
+    """清理超时未结算预扣时按预扣时间查询"""
+    db.userdata.create_index('coin_reservations.created_at', sparse=True)
+
+def _collection_indexes(db):
+    """各功能集合的查询索引和过期TTL索引（与各模块首次使用时创建的索引相同）"""
+    db.ai_usage.create_index([('user_id', ASCENDING), ('timestamp', DESCENDING)])
+    db.ai_jobs.create_index('expires_at', expireAfterSeconds=0)
+    db.ai_jobs.create_index([('user_id', 1), ('created_at', -1)])
+    db.chat_sessions.create_index('expires_at', expireAfterSeconds=0)
+    db.chat_sessions.create_index([('user_id', 1), ('updated_at', -1)])
+    db.ai_metrics.create_index('hour')
+    db.ai_metrics.create_index('expires_at', expireAfterSeconds=0)
+    db.ai_inflight.create_index('expires_at', expireAfterSeconds=0)
+    db.ai_response_cache.create_index('expires_at', expireAfterSeconds=0)
+    db.translation_memory.create_index('expires_at', expireAfterSeconds=0)
+    db.revoked_tokens.create_index('expires_at', expireAfterSeconds=0)
+
+
+# 迁移列表：(编号, 说明, 函数)，只能在末尾追加，已发布的迁移不要修改编号
+MIGRATIONS = [
+    ('0001_userdata_unique_email_username', 'userdata按邮箱、用户名建唯一索引', _userdata_unique_indexes),
+    ('0002_userdata_reservation_index', 'userdata按预扣时间建索引', _userdata_reservation_index),
+    ('0003_collection_indexes', '各功能集合的查询索引和TTL索引', _collection_indexes)
+]
+
+
+#执行未完成的迁移
+def run_migrations(db, migrations=None):
+    """
+    按顺序执行schema_migrations中没有记录的迁移；某个迁移失败时停止，后续迁移下次再执行
+
+    Returns:
+        tuple: (本次执行的迁移编号列表, 失败信息)，全部成功时失败信息为None
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    applied = {doc['_id'] for doc in db.schema_migrations.find({}, {'_id': 1})}
+    done = []
+    for migration_id, description, migrate in migrations:
+        if migration_id in applied:
+            continue
+        started = datetime.utcnow()
+        try:
+            migrate(db)
+        except Exception as e:
+            return done, f'{migration_id}: {str(e)}'
+        # 多个worker同时执行时只会留下一条记录
+        db.schema_migrations.update_one(
+            {'_id': migration_id},
+            {'$setOnInsert': {
+                'description': description,
+                'started_at': started,
+                'applied_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+        done.append(migration_id)
+    return done, None
+
+#查看迁移状态
+def migration_status(db, migrations=None):
+    """
+    Returns:
+        list: [(编号, 说明, 执行时间或None)]
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    applied = {doc['_id']: doc.get('applied_at') for doc in db.schema_migrations.find()}
+    return [(migration_id, description, applied.get(migration_id)) for migration_id, description, _ in migrations]
+
+def _run_on_startup(app):
+    """
+    同步执行迁移；数据库在连接超时内不可用或迁移失败时记录错误日志并继续启动，
+    MIGRATIONS_REQUIRED开启时改为抛出MigrationError使启动失败
+    """
+    db = app.mongo.db
+    try:
+        # 只限制连接检查的等待时间，建索引可能较慢，不受此限制
+        with pymongo.timeout(app.config.get('MIGRATIONS_CONNECT_TIMEOUT', 5)):
+            db.command('ping')
+        done, error = run_migrations(db)
+    except Exception as e:
+        done, error = [], f'数据库不可用: {str(e)}'
+
+    _startup_state.update(
+        status='error' if error else 'ok',
+        applied=done,
+        error=error,
+        finished_at=datetime.utcnow().isoformat()
+    )
+    if done:
+        print(f"✅ 已执行数据库迁移: {', '.join(done)}")
+    if error:
+        app.logger.error(f"数据库迁移失败: {error}")
+        if app.config.get('MIGRATIONS_REQUIRED', False):
+            raise MigrationError(error)
+
+#获取启动迁移状态
+def migration_health():
+    """
+    Returns:
+        dict: 本进程启动时执行迁移的状态、本次执行的迁移和失败信息
+    """
+    return dict(_startup_state)
+
+
+#初始化数据库迁移
+def init_migrations(app):
+    """MIGRATIONS_ON_STARTUP开启时在启动过程中同步执行未完成的迁移"""
+    if not app.config.get('MIGRATIONS_ON_STARTUP', True):
+        _startup_state.update(status='disabled', applied=[], error=None, finished_at=None)
+        return
+    _run_on_startup(app)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] != 'status'):
+        print('用法: python -m modules.migrations [status]')
+        sys.exit(1)
+    # 由本命令执行并输出结果，create_app中不再执行迁移，也不预热AI连接
+    os.environ['MIGRATIONS_ON_STARTUP'] = 'false'
+    os.environ['AI_POOL_WARMUP'] = 'false'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import create_app
+    db = create_app().mongo.db
+    if len(sys.argv) == 1:
+        done, error = run_migrations(db)
+        print(f"✅ 本次执行 {len(done)} 个迁移{': ' + ', '.join(done) if done else ''}")
+        if error:
+            print(f"❌ 迁移失败: {error}")
+            sys.exit(1)
+    for migration_id, description, applied_at in migration_status(db):
+        state = applied_at.strftime('%Y-%m-%d %H:%M:%S') if applied_at else '未执行'
+        print(f"{migration_id:<40} {state:<20} {description}")
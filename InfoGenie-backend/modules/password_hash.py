@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+密码哈希模块
+PBKDF2/scrypt哈希在每个worker的有界进程池中计算，不占用请求线程的CPU时间；
+排队的哈希数超过上限时直接拒绝（返回503），不让登录高峰堆积请求。
+哈希算法和成本由PASSWORD_HASH_METHOD配置，登录成功时把旧参数的哈希透明升级。
+进程池和排队上限都是每个进程独立的：gunicorn的每个worker各自启动PASSWORD_HASH_WORKERS个子进程，
+整机哈希进程数为 worker数 × PASSWORD_HASH_WORKERS；同步worker每次只处理一个请求，
+排队上限只在多线程运行（开发服务器、gthread worker）时起作用。
+进程池以spawn方式启动子进程，直接运行的入口脚本需有 if __name__ == '__main__' 保护（app.py已满足）
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+# 哈希配置（init_password_hash时由Flask配置覆盖；workers和max_pending为每个进程的值）
+_hash_settings = {
+    'method': 'pbkdf2:sha256:600000',
+    'workers': 1,
+    'max_pending': 4,
+    'timeout': 10.0
+}
+
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+class PasswordHashBusy(Exception):
+    """排队的密码哈希已达上限或计算超时"""
+
+
+def _get_executor():
+    """获取当前进程的哈希进程池（fork后重建；spawn启动，避免在多线程进程中fork）"""
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ProcessPoolExecutor(
+                max_workers=_hash_settings['workers'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _slots = threading.BoundedSemaphore(_hash_settings['max_pending'])
+            _executor_pid = pid
+        return _executor
+
+def _discard_executor(executor):
+    """进程池损坏（子进程被杀）时丢弃，下次使用时重建"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _run(fn, *args):
+    """
+    在进程池中执行哈希函数并等待结果；未启用进程池（workers为0）时直接在当前线程计算
+
+    Raises:
+        PasswordHashBusy: 排队已满或超时
+    """
+    if _hash_settings['workers'] <= 0:
+        return fn(*args)
+    executor = _get_executor()
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        raise PasswordHashBusy('密码校验排队已满')
+    try:
+        try:
+            future = executor.submit(fn, *args)
+            return future.result(timeout=_hash_settings['timeout'])
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            print("密码哈希进程池已损坏，本次在当前线程计算")
+            return fn(*args)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordHashBusy('密码校验超时')
+    finally:
+        slots.release()
+
+
+#生成密码哈希
+def hash_password(password):
+    """按配置的算法和成本生成密码哈希"""
+    return _run(generate_password_hash, password, _hash_settings['method'])
+
+#校验密码
+def check_password(password_hash, password):
+    """校验密码是否与哈希匹配"""
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+def _method_prefix(method):
+    """
+    配置的算法在哈希中的前缀（如pbkdf2:sha256:600000），按werkzeug的规则补全省略的参数：
+    pbkdf2默认sha256和DEFAULT_PBKDF2_ITERATIONS次迭代，scrypt默认32768:8:1
+    """
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    return method
+
+#判断密码哈希是否需要升级
+def needs_rehash(password_hash):
+    """已保存的哈希与当前配置的算法或成本不同时返回True"""
+    if not password_hash or '$' not in password_hash:
+        return True
+    return password_hash.split('$', 1)[0] != _method_prefix(_hash_settings['method'])
+
+def _hash_loop(method, seconds):
+    """在单个进程中连续计算哈希，返回计算次数"""
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        generate_password_hash('benchmark-password', method)
+        count += 1
+    return count
+
+#测量哈希吞吐量
+def benchmark(method=None, seconds=3.0, processes=None):
+    """
+    在processes个进程中同时连续计算哈希
+
+    Returns:
+        dict: 算法、进程数、总哈希数、每秒哈希数、每核每秒哈希数、单次哈希耗时
+    """
+    method = method or _hash_settings['method']
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # 先让每个子进程完成启动和导入，不计入测量时间
+        list(pool.map(_hash_loop, [method] * processes, [0.2] * processes))
+        started = time.perf_counter()
+        counts = list(pool.map(_hash_loop, [method] * processes, [seconds] * processes))
+        elapsed = time.perf_counter() - started
+    total = sum(counts)
+    return {
+        'method': method,
+        'processes': processes,
+        'hashes': total,
+        'hashes_per_second': round(total / elapsed, 2),
+        'hashes_per_second_per_core': round(total / elapsed / processes, 2),
+        'ms_per_hash': round(elapsed * processes * 1000 / total, 2) if total else None
+    }
+
+
+#初始化密码哈希
+def init_password_hash(app):
+    """读取哈希算法、进程数、排队上限和超时配置"""
+    _hash_settings['method'] = app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    _hash_settings['workers'] = app.config.get('PASSWORD_HASH_WORKERS', 1)
+    _hash_settings['max_pending'] = app.config.get('PASSWORD_HASH_MAX_PENDING', 4)
+    _hash_settings['timeout'] = app.config.get('PASSWORD_HASH_TIMEOUT', 10.0)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI服务提供商限额模块
+按提供商和模型分别维护请求数（RPM）和token数（TPM）两个令牌桶，
+桶状态保存在可替换的存储中（默认MongoDB ai_rate_buckets集合，各worker共享）；
+调用前取令牌，取不到时短暂等待，仍不足则让路由切换到其他提供商；
+收到响应后按提供商返回的限额响应头校准桶内余量
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import re
+import time
+import threading
+from pymongo import ReturnDocument
+
+# 限额不足时返回的错误信息（路由据此切换提供商，且不计入熔断统计）
+RATE_LIMIT_ERROR = "AI服务商调用额度暂时用尽"
+
+
+#解析限额重置时间
+def parse_reset_seconds(value):
+    """解析"1s"、"6m0s"、"200ms"或纯数字秒形式的重置时间，无法解析时返回None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+class MemoryBucketStore:
+    """进程内令牌桶存储（单worker或测试使用）"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, amount, now):
+        """
+        补充令牌后尝试取出amount个
+
+        Returns:
+            float: 取到时为0，否则为令牌补足还需等待的秒数
+        """
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= amount:
+                self._buckets[key] = (tokens - amount, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (amount - tokens) / rate
+
+    def adjust(self, key, capacity, rate, delta, now):
+        """按实际用量增减令牌（可以为负，之后的调用会相应等待）"""
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            self._buckets[key] = (tokens + delta, now)
+
+    def resync(self, key, remaining, now):
+        """以提供商返回的剩余额度为准"""
+        with self._lock:
+            self._buckets[key] = (remaining, now)
+
+
+class MongoBucketStore:
+    """MongoDB令牌桶存储，用流水线更新在一次往返内完成补充和扣减"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def take(self, key, capacity, rate, amount, now):
+        """补充令牌后尝试取出amount个，返回还需等待的秒数"""
+        refilled = {'$min': [capacity, {'$add': [
+            {'$ifNull': ['$tokens', capacity]},
+            {'$multiply': [{'$max': [0, {'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}]}, rate]}
+        ]}]}
+        doc = self.db.ai_rate_buckets.find_one_and_update(
+            {'_id': key},
+            [
+                {'$set': {'tokens': refilled, 'updated_at': now}},
+                {'$set': {'granted': {'$gte': ['$tokens', amount]}}},
+                {'$set': {'tokens': {'$cond': ['$granted', {'$subtract': ['$tokens', amount]}, '$tokens']}}}
+            ],
+            projection={'tokens': 1, 'granted': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc['granted']:
+            return 0.0
+        return (amount - doc['tokens']) / rate
+
+    def adjust(self, key, capacity, rate, delta, now):
+        """按实际用量增减令牌"""
+        refilled = {'$min': [capacity, {'$add': [
+            {'$ifNull': ['$tokens', capacity]},
+            {'$multiply': [{'$max': [0, {'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}]}, rate]}
+        ]}]}
+        self.db.ai_rate_buckets.update_one(
+            {'_id': key},
+            [{'$set': {'tokens': {'$add': [refilled, delta]}, 'updated_at': now}}],
+            upsert=True
+        )
+
+    def resync(self, key, remaining, now):
+        """以提供商返回的剩余额度为准"""
+        self.db.ai_rate_buckets.update_one(
+            {'_id': key},
+            {'$set': {'tokens': remaining, 'updated_at': now}},
+            upsert=True
+        )
+
+
+class RateLimiter:
+    """按提供商和模型的请求数/token数双令牌桶"""
+
+    def __init__(self):
+        self.enabled = True
+        self.limits = {}  # 由init_rate_limiter从Config.AI_RATE_LIMITS读取，未配置时不限流
+        self.max_wait = 2.0
+        self.store = MemoryBucketStore()
+
+    def configure(self, enabled=True, limits=None, max_wait=2.0, store=None):
+        """更新开关、限额、最长等待时间和桶存储"""
+        self.enabled = enabled
+        if limits is not None:
+            self.limits = dict(limits)
+        self.max_wait = max_wait
+        if store is not None:
+            self.store = store
+
+    def limits_for(self, provider, model):
+        """"提供商/模型"的限额优先于提供商的限额，均未配置时不限流"""
+        return self.limits.get(f'{provider}/{model}') or self.limits.get(provider)
+
+    def _buckets(self, provider, model):
+        """返回[(桶键, 容量, 每秒补充量)]，依次为请求桶和token桶"""
+        limits = self.limits_for(provider, model)
+        if not limits:
+            return []
+        buckets = []
+        if limits.get('rpm'):
+            buckets.append((f'{provider}/{model}/requests', limits['rpm'], limits['rpm'] / 60.0))
+        if limits.get('tpm'):
+            buckets.append((f'{provider}/{model}/tokens', limits['tpm'], limits['tpm'] / 60.0))
+        return buckets
+
+    def acquire(self, provider, model, tokens, cancel_event=None):
+        """
+        为一次调用取1个请求令牌和tokens个token令牌，不足时最多等待max_wait秒
+
+        Returns:
+            bool: 是否取到令牌
+        """
+        if not self.enabled:
+            return True
+        deadline = time.monotonic() + self.max_wait
+        taken = []
+        for key, capacity, rate in self._buckets(provider, model):
+            amount = 1 if key.endswith('/requests') else min(tokens, capacity)
+            while True:
+                try:
+                    wait = self.store.take(key, capacity, rate, amount, time.time())
+                except Exception as e:
+                    # 存储不可用时不阻塞调用
+                    print(f"读取限额令牌桶失败: {str(e)}")
+                    return True
+                if wait <= 0:
+                    taken.append((key, capacity, rate, amount))
+                    break
+                if time.monotonic() + wait > deadline or (cancel_event is not None and cancel_event.wait(wait)):
+                    # 没有发出调用，退回已从前面的桶取出的令牌
+                    self._refund(taken)
+                    return False
+                if cancel_event is None:
+                    time.sleep(wait)
+        return True
+
+    def _refund(self, taken):
+        """退回已取出的令牌"""
+        for key, capacity, rate, amount in taken:
+            try:
+                self.store.adjust(key, capacity, rate, amount, time.time())
+            except Exception as e:
+                print(f"退回限额令牌失败: {str(e)}")
+
+    def record_usage(self, provider, model, estimated_tokens, usage):
+        """调用完成后按usage中的实际token数修正token桶（取令牌时只扣了估算的提示词部分）"""
+        if not self.enabled or not usage:
+            return
+        actual = usage.get('total_tokens') or (
+            usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)
+        )
+        for key, capacity, rate in self._buckets(provider, model):
+            if key.endswith('/tokens') and actual:
+                try:
+                    self.store.adjust(key, capacity, rate, estimated_tokens - actual, time.time())
+                except Exception as e:
+                    print(f"修正限额令牌桶失败: {str(e)}")
+
+    def mark_exhausted(self, provider, model):
+        """收到429但没有限额响应头时，清空请求桶让所有worker暂停调用该模型"""
+        if not self.enabled:
+            return
+        for key, _, _ in self._buckets(provider, model):
+            if key.endswith('/requests'):
+                try:
+                    self.store.resync(key, 0, time.time())
+                except Exception as e:
+                    print(f"校准限额令牌桶失败: {str(e)}")
+
+    def resync(self, provider, model, headers):
+        """
+        按提供商返回的x-ratelimit-remaining-*响应头校准令牌桶
+
+        Returns:
+            float: 响应头给出的重置等待时间（秒），未提供时为None
+        """
+        if not self.enabled or headers is None:
+            return None
+        reset = None
+        now = time.time()
+        for key, _, _ in self._buckets(provider, model):
+            kind = 'requests' if key.endswith('/requests') else 'tokens'
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            if remaining is None:
+                continue
+            try:
+                self.store.resync(key, float(remaining), now)
+            except Exception as e:
+                print(f"校准限额令牌桶失败: {str(e)}")
+            seconds = parse_reset_seconds(headers.get(f'x-ratelimit-reset-{kind}'))
+            if seconds is not None and float(remaining) <= 0:
+                reset = max(reset or 0.0, seconds)
+        retry_after = parse_reset_seconds(headers.get('Retry-After'))
+        if retry_after is not None:
+            reset = max(reset or 0.0, retry_after)
+        return reset
+
+
+# 全局限额实例
+rate_limiter = RateLimiter()
+
+
+#初始化提供商限额
+def init_rate_limiter(app):
+    """读取限额配置并选择令牌桶存储（mongo为各worker共享，memory为进程内）"""
+    store = None
+    if app.config.get('AI_RATE_LIMIT_STORE', 'mongo') == 'mongo' and getattr(app, 'mongo', None):
+        store = MongoBucketStore(app.mongo.db)
+    rate_limiter.configure(
+        enabled=app.config.get('AI_RATE_LIMIT_ENABLED', True),
+        limits=app.config.get('AI_RATE_LIMITS'),
+        max_wait=app.config.get('AI_RATE_LIMIT_MAX_WAIT', 2.0),
+        store=store
+    )
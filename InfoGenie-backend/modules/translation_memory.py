@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+翻译记忆模块
+把原文按句切分（兼顾中日文标点和英文缩写），每个句段按语言对和模型哈希后查询翻译记忆，
+只有未命中的句段交给AI翻译；另提供本地语言检测，原文已是目标语言时无需调用AI。
+记忆分两级：进程内LRU + MongoDB translation_memory集合（TTL索引）
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import re
+import json
+import hashlib
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from .ai_cache import LRUTTLCache, normalize_input
+
+# 句段格式版本，切分规则或翻译提示词变化时递增，使旧记忆失效
+MEMORY_VERSION = 1
+
+# 句末标点：中日文标点后无需空白；英文标点后须跟空白或位于结尾；换行总是分段
+_SENTENCE_END = re.compile(
+    r'[。！？；…]+[」』”’）》】]*'
+    r'|[.!?]+[)\]"\'”’]*(?=\s|$)'
+    r'|\n'
+)
+_WHITESPACE = re.compile(r'\s*')
+_WORD_BEFORE = re.compile(r'([A-Za-z]+)\.$')
+_LETTER = re.compile(r'[^\W\d_]')
+
+# 句点后不分句的英文缩写
+ABBREVIATIONS = {'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'vs', 'etc', 'no', 'fig', 'inc', 'ltd', 'co', 'e', 'i'}
+
+# 非拉丁文字的Unicode范围
+_SCRIPTS = (
+    ('kana', re.compile(r'[぀-ヿ]')),
+    ('hangul', re.compile(r'[가-힯ᄀ-ᇿ]')),
+    ('han', re.compile(r'[一-鿿]')),
+    ('ru', re.compile(r'[Ѐ-ӿ]')),
+    ('ar', re.compile(r'[؀-ۿ]')),
+    ('hi', re.compile(r'[ऀ-ॿ]')),
+    ('th', re.compile(r'[฀-๿]'))
+)
+
+# 常用字的简繁对照（逐字对应），用于区分简体和繁体中文
+_SIMPLIFIED = '这们来说时国会对过还没发现经为与开关门见长东车马鱼鸟书学习认识话语让觉历爱应实样'
+_TRADITIONAL = '這們來說時國會對過還沒發現經為與開關門見長東車馬魚鳥書學習認識話語讓覺歷愛應實樣'
+
+_VIETNAMESE = re.compile(r'[ăâđêôơưạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ]', re.IGNORECASE)
+_LATIN_WORD = re.compile(r"[a-zàâäçéèêëîïôöùûüÿñáíóúãõœß']+", re.IGNORECASE)
+
+# 拉丁文字语言的高频虚词
+STOPWORDS = {
+    'en': {'the', 'and', 'is', 'are', 'of', 'to', 'in', 'that', 'it', 'with', 'for', 'this', 'you', 'was', 'have'},
+    'fr': {'le', 'les', 'et', 'est', 'des', 'une', 'du', 'pour', 'dans', 'pas', 'je', 'vous', 'nous', 'sur', 'avec'},
+    'de': {'der', 'die', 'das', 'und', 'ist', 'nicht', 'ein', 'eine', 'ich', 'zu', 'mit', 'auf', 'sie', 'den', 'auch'},
+    'es': {'el', 'los', 'las', 'y', 'es', 'una', 'por', 'para', 'con', 'del', 'está', 'pero', 'muy', 'como', 'su'},
+    'it': {'il', 'di', 'che', 'è', 'non', 'per', 'una', 'sono', 'gli', 'con', 'del', 'ma', 'ho', 'questo', 'anche'},
+    'pt': {'os', 'não', 'uma', 'um', 'para', 'com', 'é', 'do', 'da', 'em', 'que', 'mas', 'muito', 'você', 'são'}
+}
+
+# 句段之间不加空格的目标语言
+_NO_SPACE_LANGUAGES = ('zh', 'ja')
+
+
+#按句切分原文
+def split_segments(text):
+    """
+    按句末标点和换行切分，句段之间的空白作为分隔符保留
+
+    Returns:
+        list: [(句段, 分隔符)]，依次拼接即为原文
+    """
+    segments = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        if match.start() < start:
+            # 已被上一个分隔符吞掉的换行
+            continue
+        if match.group() == '\n':
+            cut = match.start()
+        else:
+            if match.group().startswith('.'):
+                word = _WORD_BEFORE.search(text, start, match.start() + 1)
+                if word and (word.group(1).lower() in ABBREVIATIONS or len(word.group(1)) == 1):
+                    continue
+            cut = match.end()
+        segment = text[start:cut].rstrip()
+        end = _WHITESPACE.match(text, cut).end()
+        if segment:
+            segments.append((segment, text[start + len(segment):end]))
+        elif segments:
+            segments[-1] = (segments[-1][0], segments[-1][1] + text[start:end])
+        start = end
+    tail = text[start:]
+    if tail.strip():
+        segment = tail.rstrip()
+        segments.append((segment, tail[len(segment):]))
+    elif segments:
+        segments[-1] = (segments[-1][0], segments[-1][1] + tail)
+    return segments
+
+#拼接译文句段
+def join_segments(pieces, target_language):
+    """
+    按原分隔符拼接译文：中日文目标语言去掉行内空格，其他语言在紧挨的句段间补一个空格
+
+    Args:
+        pieces: [(译文, 原分隔符)]
+    """
+    no_space = target_language.startswith(_NO_SPACE_LANGUAGES)
+    parts = []
+    for index, (text, separator) in enumerate(pieces):
+        if no_space and '\n' not in separator:
+            separator = ''
+        elif not no_space and not separator and index < len(pieces) - 1:
+            separator = ' '
+        parts.append(text + separator)
+    return ''.join(parts)
+
+#判断句段是否需要翻译
+def needs_translation(segment):
+    """只有数字、符号的句段原样保留"""
+    return _LETTER.search(segment) is not None
+
+
+#本地检测语言
+def detect_language(text, threshold=0.8):
+    """
+    按文字所属的书写系统判断语言，拉丁文字再按高频虚词区分
+
+    Returns:
+        str: 与翻译接口target_language一致的语言代码；简繁无法区分的中文为'zh'，无法确定时为None
+    """
+    letters = _LETTER.findall(text or '')
+    if not letters:
+        return None
+    counts = {name: len(pattern.findall(text)) for name, pattern in _SCRIPTS}
+    if counts['kana'] and counts['kana'] + counts['han'] >= threshold * len(letters):
+        return 'ja'
+    if counts['hangul'] >= threshold * len(letters):
+        return 'ko'
+    if counts['han'] >= threshold * len(letters):
+        simplified = sum(text.count(char) for char in _SIMPLIFIED)
+        traditional = sum(text.count(char) for char in _TRADITIONAL)
+        if simplified > traditional:
+            return 'zh-CN'
+        if traditional > simplified:
+            return 'zh-TW'
+        return 'zh'
+    for name in ('ru', 'ar', 'hi', 'th'):
+        if counts[name] >= threshold * len(letters):
+            return name
+
+    if len(_VIETNAMESE.findall(text)) >= 2:
+        return 'vi'
+    words = [word.lower() for word in _LATIN_WORD.findall(text)]
+    if sum(len(word) for word in words) < threshold * len(letters):
+        return None
+    scores = sorted(
+        ((sum(1 for word in words if word in stopwords), language) for language, stopwords in STOPWORDS.items()),
+        reverse=True
+    )
+    (best, language), (second, _) = scores[0], scores[1]
+    if best >= 2 and best >= 2 * second:
+        return language
+    return None
+
+#判断检测到的语言是否就是目标语言
+def language_matches(detected, target_language):
+    if not detected:
+        return False
+    if detected == 'zh':
+        return target_language.startswith('zh')
+    return detected == target_language
+
+
+class TranslationMemory:
+    """句段级翻译记忆"""
+
+    def __init__(self):
+        self.enabled = True
+        self.ttl_days = 90
+        self.min_segments = 2
+        self.memory = LRUTTLCache(4096)
+        self._indexes_ready = False
+
+    def configure(self, enabled=True, memory_size=4096, ttl_days=90, min_segments=2):
+        """更新开关、内存容量、保留天数和启用翻译记忆的最少句段数"""
+        self.enabled = enabled
+        self.memory = LRUTTLCache(memory_size)
+        self.ttl_days = ttl_days
+        self.min_segments = min_segments
+
+    def make_key(self, source_language, target_language, model, segment):
+        """由语言对、模型和规范化后的句段生成记忆键（源语言只取主语言，简繁检测结果不同不影响命中）"""
+        source_language = (source_language or 'auto').split('-')[0]
+        raw = json.dumps(
+            [MEMORY_VERSION, source_language, target_language, model, normalize_input(segment)],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def lookup_many(self, db, keys):
+        """
+        先查内存，剩余的键用一次$in查询MongoDB
+
+        Returns:
+            dict: 命中的 {key: 译文}
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            translation = self.memory.get(key)
+            if translation is None:
+                missing.append(key)
+            else:
+                found[key] = translation
+        if not missing:
+            return found
+
+        try:
+            docs = db.translation_memory.find(
+                {'_id': {'$in': missing}, 'expires_at': {'$gt': datetime.utcnow()}},
+                {'translation': 1}
+            )
+            for doc in docs:
+                found[doc['_id']] = doc['translation']
+                self.memory.set(doc['_id'], doc['translation'], self.ttl_days * 86400)
+        except Exception as e:
+            print(f"读取翻译记忆失败: {str(e)}")
+        return found
+
+    def store_many(self, db, entries, source_language, target_language):
+        """
+        批量写入两级记忆（MongoDB写入失败不影响本次响应）
+
+        Args:
+            entries: [(key, 原文句段, 译文)]
+        """
+        if not entries:
+            return
+        ttl = self.ttl_days * 86400
+        operations = []
+        for key, source, translation in entries:
+            self.memory.set(key, translation, ttl)
+            operations.append(UpdateOne({'_id': key}, {'$set': {
+                'source': source,
+                'translation': translation,
+                'source_language': source_language or 'auto',
+                'target_language': target_language,
+                'created_at': datetime.now().isoformat(),
+                'expires_at': datetime.utcnow() + timedelta(seconds=ttl)
+            }}, upsert=True))
+        try:
+            self._ensure_indexes(db)
+            db.translation_memory.bulk_write(operations, ordered=False)
+        except Exception as e:
+            print(f"写入翻译记忆失败: {str(e)}")
+
+    def _ensure_indexes(self, db):
+        """首次写入时创建过期TTL索引"""
+        if self._indexes_ready:
+            return
+        db.translation_memory.create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+
+# 全局翻译记忆实例
+translation_memory = TranslationMemory()
+
+
+#初始化翻译记忆
+def init_translation_memory(app):
+    """读取翻译记忆开关、容量、保留天数和最少句段数"""
+    translation_memory.configure(
+        enabled=app.config.get('TRANSLATION_MEMORY_ENABLED', True),
+        memory_size=app.config.get('TRANSLATION_MEMORY_SIZE', 4096),
+        ttl_days=app.config.get('TRANSLATION_MEMORY_TTL_DAYS', 90),
+        min_segments=app.config.get('TRANSLATION_MEMORY_MIN_SEGMENTS', 2)
+    )
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+用户文档缓存模块
+读接口（资料、游戏数据、萌芽币余额）共用每个worker的用户快照缓存：同一请求内重复读取直接用请求内存，
+快照在USER_CACHE_TTL内直接使用，之后只查询version字段复核，版本未变时继续使用；
+所有写路径通过versioned()递增version字段，本worker写入后立即失效快照
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from bson import ObjectId
+from flask import g, has_request_context
+
+# 用户文档的版本字段，每次写入递增（旧文档没有该字段，视为0）
+VERSION_FIELD = 'version'
+
+# 快照不保存的字段（密码和结算中的预扣只由写路径直接读取）
+SNAPSHOT_EXCLUDED = {'ai_usage_history': 0, '密码': 0, 'coin_reservations': 0}
+
+
+#给更新语句加上版本递增
+def versioned(update):
+    """
+    在MongoDB更新语句中加入 $inc: {version: 1}
+
+    Returns:
+        dict: 新的更新语句（不修改传入的字典）
+    """
+    update = dict(update)
+    update['$inc'] = dict(update.get('$inc', {}), **{VERSION_FIELD: 1})
+    return update
+
+def _version_query(user_id, version):
+    """按版本号匹配用户文档（版本为0时匹配没有version字段的旧文档）"""
+    if version:
+        return {'_id': ObjectId(user_id), VERSION_FIELD: version}
+    return {'_id': ObjectId(user_id), VERSION_FIELD: {'$exists': False}}
+
+def _project(doc, fields):
+    """按字段列表取出快照中的字段，返回副本"""
+    if fields is None:
+        return dict(doc)
+    return {key: doc[key] for key in ('_id', *fields) if key in doc}
+
+
+class UserCache:
+    """每个worker的用户快照缓存"""
+
+    def __init__(self):
+        self.enabled = True
+        self.ttl = 2.0
+        self.max_age = 300.0
+        self.maxsize = 4096
+        self._data = OrderedDict()  # user_id -> [快照, 版本, 复核时间, 读取时间]
+        self._invalidated = {}  # user_id -> 最近一次失效的时间
+        self._lock = threading.Lock()
+        self.counters = {'request_hits': 0, 'hits': 0, 'revalidated': 0, 'misses': 0}
+
+    def configure(self, enabled=True, size=4096, ttl=2.0, max_age=300.0):
+        """更新开关、容量、免复核时间和快照最长保留时间"""
+        self.enabled = enabled
+        self.maxsize = size
+        self.ttl = ttl
+        self.max_age = max_age
+        with self._lock:
+            self._data.clear()
+            self._invalidated.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, db, user_id, fields=None):
+        """
+        读取用户快照
+
+        Args:
+            fields: 需要的字段列表，None表示快照中的全部字段
+
+        Returns:
+            dict: 用户文档（副本），用户不存在时为None
+        """
+        user_id = str(user_id)
+        local = g.setdefault('user_snapshots', {}) if has_request_context() else {}
+        if user_id in local:
+            self._count('request_hits')
+            doc = local[user_id]
+            return _project(doc, fields) if doc is not None else None
+
+        doc = self._load(db, user_id) if self.enabled else db.userdata.find_one(
+            {'_id': ObjectId(user_id)}, SNAPSHOT_EXCLUDED
+        )
+        local[user_id] = doc
+        return _project(doc, fields) if doc is not None else None
+
+    def _load(self, db, user_id):
+        """依次使用快照、按版本复核、重新读取"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is not None and now - entry[3] > self.max_age:
+                del self._data[user_id]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(user_id)
+                if now - entry[2] <= self.ttl:
+                    self.counters['hits'] += 1
+                    return entry[0]
+
+        started = time.monotonic()
+        if entry is not None:
+            # 只取_id复核版本，版本未变时继续使用快照
+            if db.userdata.find_one(_version_query(user_id, entry[1]), {'_id': 1}):
+                self._count('revalidated')
+                with self._lock:
+                    if self._data.get(user_id) is entry:
+                        entry[2] = started
+                return entry[0]
+
+        self._count('misses')
+        doc = db.userdata.find_one({'_id': ObjectId(user_id)}, SNAPSHOT_EXCLUDED)
+        if doc is not None:
+            self._store(user_id, doc, started)
+        return doc
+
+    def _store(self, user_id, doc, started):
+        """保存快照；读取开始后本worker又有写入，或已有更新版本的快照时不保存"""
+        version = doc.get(VERSION_FIELD, 0)
+        with self._lock:
+            if self._invalidated.get(user_id, 0) >= started:
+                return
+            current = self._data.get(user_id)
+            if current is not None and current[1] > version:
+                return
+            self._data[user_id] = [doc, version, started, started]
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """写入后失效本worker和当前请求中的快照（其他worker在复核版本时发现变化）"""
+        user_id = str(user_id)
+        with self._lock:
+            self._data.pop(user_id, None)
+            self._invalidated[user_id] = time.monotonic()
+            # 失效记录只需保留到进行中的读取结束
+            if len(self._invalidated) > self.maxsize:
+                cutoff = time.monotonic() - 60
+                self._invalidated = {k: v for k, v in self._invalidated.items() if v > cutoff}
+        if has_request_context():
+            g.setdefault('user_snapshots', {}).pop(user_id, None)
+
+    def stats(self):
+        """本worker的快照计数"""
+        with self._lock:
+            return {**self.counters, 'cached_users': len(self._data)}
+
+
+# 全局用户缓存实例
+user_cache = UserCache()
+
+
+#初始化用户文档缓存
+def init_user_cache(app):
+    """读取用户快照缓存开关、容量、免复核时间和最长保留时间"""
+    user_cache.configure(
+        enabled=app.config.get('USER_CACHE_ENABLED', True),
+        size=app.config.get('USER_CACHE_SIZE', 4096),
+        ttl=app.config.get('USER_CACHE_TTL', 2.0),
+        max_age=app.config.get('USER_CACHE_MAX_AGE', 300.0)
+    )
@@ -9,37 +9,25 @@ Date: 2025-09-02
 from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime
 from bson import ObjectId
-import jwt
+from pymongo import ReturnDocument
 from functools import wraps
+from .ai_usage import USAGE_HISTORY_EXCLUDED
+from .auth_middleware import current_principal
+from .user_cache import user_cache, versioned, SNAPSHOT_EXCLUDED
+from .password_hash import PasswordHashBusy, hash_password, check_password
 
 user_bp = Blueprint('user', __name__)
 
-# 验证JWT token
-def verify_token(token):
-    """验证JWT token"""
-    try:
-        payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-        return {'success': True, 'data': payload}
-    except jwt.ExpiredSignatureError:
-        return {'success': False, 'message': 'Token已过期'}
-    except jwt.InvalidTokenError:
-        return {'success': False, 'message': 'Token无效'}
-
 # 登录验证装饰器（支持JWT token和hwt）
 def login_required(f):
     """登录验证装饰器（支持JWT token和hwt）"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # 优先检查JWT token
-        token = request.headers.get('Authorization')
-        if token:
-            if token.startswith('Bearer '):
-                token = token[7:]
-            
-            result = verify_token(token)
-            if result['success']:
-                request.current_user = result['data']
-                return f(*args, **kwargs)
+        # 优先使用统一认证层已验证的JWT用户
+        principal = current_principal()
+        if principal:
+            request.current_user = principal
+            return f(*args, **kwargs)
         # 回退到hwt验证
         hwt = getattr(request, 'hwt', {})
         if not hwt.get('logged_in'):
@@ -74,8 +62,7 @@ def get_profile():
                 'message': '无法获取用户信息'
             }), 401
             
-        users_collection = current_app.mongo.db.userdata
-        user = users_collection.find_one({'_id': ObjectId(user_id)})
+        user = user_cache.get(current_app.mongo.db, user_id)
         if not user:
             return jsonify({
                 'success': False,
@@ -144,24 +131,22 @@ def add_coins():
 
         users_collection = current_app.mongo.db.userdata
         query = {'邮箱': email} if email else {'用户名': username}
-        user = users_collection.find_one(query)
-        if not user:
+        # 一次原子更新完成加币并取回更新后的文档
+        updated = users_collection.find_one_and_update(
+            query,
+            versioned({'$inc': {'萌芽币': amount_int}}),
+            projection=SNAPSHOT_EXCLUDED,
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated:
             return jsonify({
                 'success': False,
                 'message': '用户不存在'
             }), 404
+        user_cache.invalidate(updated['_id'])
 
-        before_coins = user.get('萌芽币', 0)
-        update_result = users_collection.update_one(query, {'$inc': {'萌芽币': amount_int}})
-
-        if update_result.modified_count == 0:
-            return jsonify({
-                'success': False,
-                'message': '更新失败，请稍后重试'
-            }), 500
-
-        updated = users_collection.find_one({'_id': user['_id']})
-        new_coins = updated.get('萌芽币', before_coins)
+        new_coins = updated.get('萌芽币', 0)
+        before_coins = new_coins - amount_int
 
         return jsonify({
             'success': True,
@@ -195,10 +180,10 @@ def add_coins():
 @user_bp.route('/list', methods=['GET'])
 @login_required
 def list_users():
-    """列出所有用户（不返回密码）"""
+    """列出所有用户（不返回密码，也不读取使用记录和预扣记录）"""
     try:
         users_collection = current_app.mongo.db.userdata
-        cursor = users_collection.find({}, {'密码': 0})
+        cursor = users_collection.find({}, SNAPSHOT_EXCLUDED)
         users = []
         for u in cursor:
             users.append({
@@ -247,28 +232,32 @@ def change_password():
                 'message': '新密码长度必须在6-20位之间'
             }), 400
         
-        hwt = getattr(request, 'hwt', {})
-        user_id = hwt.get('user_id')
+        # 优先从JWT token获取用户ID
+        if hasattr(request, 'current_user'):
+            user_id = request.current_user['user_id']
+        else:
+            hwt = getattr(request, 'hwt', {})
+            user_id = hwt.get('user_id')
         users_collection = current_app.mongo.db.userdata
-        user = users_collection.find_one({'_id': ObjectId(user_id)})
+        user = users_collection.find_one({'_id': ObjectId(user_id)}, USAGE_HISTORY_EXCLUDED)
         if not user:
             return jsonify({
                 'success': False,
                 'message': '用户不存在'
             }), 404
-        from werkzeug.security import check_password_hash, generate_password_hash
         # 验证旧密码
-        if not check_password_hash(user['密码'], old_password):
+        if not check_password(user['密码'], old_password):
             return jsonify({
                 'success': False,
                 'message': '原密码错误'
             }), 401
         # 更新密码
-        new_password_hash = generate_password_hash(new_password)
+        new_password_hash = hash_password(new_password)
         result = users_collection.update_one(
             {'_id': ObjectId(user_id)},
-            {'$set': {'密码': new_password_hash}}
+            versioned({'$set': {'密码': new_password_hash}})
         )
+        user_cache.invalidate(user_id)
         if result.modified_count > 0:
             return jsonify({
                 'success': True,
@@ -279,6 +268,11 @@ def change_password():
                 'success': False,
                 'message': '密码修改失败'
             }), 500
+    except PasswordHashBusy:
+        return jsonify({
+            'success': False,
+            'message': '服务繁忙，请稍后重试'
+        }), 503
     except Exception as e:
         return jsonify({
             'success': False,
@@ -324,9 +318,7 @@ def get_user_game_data():
             hwt = getattr(request, 'hwt', {})
             user_id = hwt.get('user_id')
             
-        users_collection = current_app.mongo.db.userdata
-        
-        user = users_collection.find_one({'_id': ObjectId(user_id)})
+        user = user_cache.get(current_app.mongo.db, user_id, ['等级', '经验', '萌芽币', '签到系统'])
         
         if not user:
             return jsonify({
@@ -372,7 +364,7 @@ def daily_checkin():
             
         users_collection = current_app.mongo.db.userdata
         
-        user = users_collection.find_one({'_id': ObjectId(user_id)})
+        user = users_collection.find_one({'_id': ObjectId(user_id)}, USAGE_HISTORY_EXCLUDED)
         
         if not user:
             return jsonify({
@@ -458,8 +450,9 @@ def daily_checkin():
         
         result = users_collection.update_one(
             {'_id': ObjectId(user_id)},
-            {'$set': update_data}
+            versioned({'$set': update_data})
         )
+        user_cache.invalidate(user_id)
         
         if result.modified_count > 0:
             level_up = new_level > current_level
@@ -503,11 +496,15 @@ def delete_account():
                 'message': '请输入密码确认删除'
             }), 400
         
-        hwt = getattr(request, 'hwt', {})
-        user_id = hwt.get('user_id')
+        # 优先从JWT token获取用户ID
+        if hasattr(request, 'current_user'):
+            user_id = request.current_user['user_id']
+        else:
+            hwt = getattr(request, 'hwt', {})
+            user_id = hwt.get('user_id')
         users_collection = current_app.mongo.db.userdata
         
-        user = users_collection.find_one({'_id': ObjectId(user_id)})
+        user = users_collection.find_one({'_id': ObjectId(user_id)}, USAGE_HISTORY_EXCLUDED)
         
         if not user:
             return jsonify({
@@ -515,10 +512,8 @@ def delete_account():
                 'message': '用户不存在'
             }), 404
         
-        from werkzeug.security import check_password_hash
-        
         # 验证密码
-        if not check_password_hash(user['密码'], password):
+        if not check_password(user['密码'], password):
             return jsonify({
                 'success': False,
                 'message': '密码错误'
@@ -526,6 +521,7 @@ def delete_account():
         
         # 删除用户
         result = users_collection.delete_one({'_id': ObjectId(user_id)})
+        user_cache.invalidate(user_id)
         
         if result.deleted_count > 0:
             # 清除会话
@@ -542,6 +538,11 @@ def delete_account():
                 'message': '删除失败'
             }), 500
         
+    except PasswordHashBusy:
+        return jsonify({
+            'success': False,
+            'message': '服务繁忙，请稍后重试'
+        }), 503
     except Exception as e:
         return jsonify({
             'success': False,
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+密码哈希吞吐量测试
+在1个进程和全部CPU核心上分别连续计算哈希，输出每秒哈希数和每核每秒哈希数，
+用于选择PASSWORD_HASH_METHOD的成本参数和PASSWORD_HASH_WORKERS
+
+用法（在后端根目录执行）：
+    python test/bench_password_hash.py
+    python test/bench_password_hash.py --method scrypt:32768:8:1 --seconds 5
+    python test/bench_password_hash.py --method pbkdf2:sha256:600000 --method pbkdf2:sha256:1000000
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from modules.password_hash import benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(description='密码哈希吞吐量测试')
+    parser.add_argument('--method', action='append', help='哈希算法及成本，可重复指定（默认PASSWORD_HASH_METHOD）')
+    parser.add_argument('--seconds', type=float, default=3.0, help='每轮测量时长（秒）')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='多进程测量的进程数')
+    parser.add_argument('--json', help='把结果另存为JSON文件')
+    args = parser.parse_args()
+
+    results = []
+    for method in args.method or [Config.PASSWORD_HASH_METHOD]:
+        for processes in sorted({1, args.processes}):
+            result = benchmark(method, args.seconds, processes)
+            results.append(result)
+            print(f"{result['method']:<28} 进程数 {result['processes']:>3}  "
+                  f"{result['hashes_per_second']:>9.2f} 次/秒  "
+                  f"每核 {result['hashes_per_second_per_core']:>8.2f} 次/秒  "
+                  f"单次 {result['ms_per_hash']} ms")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI接口压测脚本
+把ai_config.json中各提供商的api_base指向本地模拟服务商（test/mock_llm_server.py），
+以指定并发压测/api/aimodelapp/*各接口，输出吞吐量、p50/p95/p99延迟、状态码分布，
+以及压测期间上游并发调用数（各worker同时在等AI响应的请求数）相对准入上限的饱和度
+
+用法（后端已启动，在后端根目录执行）：
+    python test/load_test.py --start-mock --token <JWT> --concurrency 16 --requests 200
+    python test/load_test.py --mock-url http://127.0.0.1:18080 --email a@qq.com --password xxx \\
+        --endpoints variable-naming,expression-maker --duration 60
+
+说明：ai_config.json会在压测前备份为ai_config.json.loadtest.bak，结束后自动恢复；
+后端按文件修改时间自动重新加载配置，无需重启。测试账号需要有足够的萌芽币
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# 加入后端根目录到路径
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer
+
+# 各接口的压测请求体
+ENDPOINT_PAYLOADS = {
+    'chat': {'messages': [{'role': 'user', 'content': '用一句话介绍一下你自己'}]},
+    'name-analysis': {'name': '张三'},
+    'variable-naming': {'description': '用户登录次数', 'language': 'python'},
+    'poetry': {'theme': '春天', 'style': '五言绝句'},
+    'translation': {'source_text': '今天天气很好', 'target_language': 'en'},
+    'classical_conversion': {'modern_text': '我今天很高兴', 'style': '古雅'},
+    'expression-maker': {'text': '今天升职加薪了', 'style': 'mixed'},
+    'linux-command': {'task_description': '查看当前目录下占用空间最大的文件', 'difficulty_level': 'beginner'},
+    'markdown_formatting': {'article_text': '标题 第一段内容 第二段内容', 'emoji_style': 'balanced'},
+    'kinship-calculator': {'relation_chain': '妈妈的哥哥的老婆的妹妹的儿子', 'dialects': ['粤语']}
+}
+
+DEFAULT_ENDPOINTS = 'chat,variable-naming,expression-maker,kinship-calculator,linux-command'
+
+
+#把ai_config.json指向模拟服务商
+def point_ai_config(config_path, mock_url):
+    """
+    备份ai_config.json并把各提供商的api_base改为mock_url（kimi的接口路径带/v1前缀，由客户端拼接）
+
+    Returns:
+        str: 备份文件路径
+    """
+    backup_path = config_path + '.loadtest.bak'
+    shutil.copyfile(config_path, backup_path)
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    for provider_config in config.values():
+        if isinstance(provider_config, dict) and 'api_base' in provider_config:
+            provider_config['api_base'] = mock_url
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+    return backup_path
+
+def restore_ai_config(config_path, backup_path):
+    """恢复压测前的ai_config.json"""
+    shutil.move(backup_path, config_path)
+
+
+def percentile(values, q):
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class InFlightSampler:
+    """定期读取模拟服务商的并发调用数"""
+
+    def __init__(self, mock_url, interval=0.1):
+        self.mock_url = mock_url
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stats = requests.get(f'{self.mock_url}/__mock/stats', timeout=2).json()
+                self.samples.append(stats['in_flight'])
+            except Exception:
+                pass
+
+
+def run_endpoint(base_url, endpoint, headers, concurrency, total_requests, duration, mock_url, capacity):
+    """以固定并发压测单个接口，返回统计结果"""
+    url = f'{base_url}/api/aimodelapp/{endpoint}'
+    payload = ENDPOINT_PAYLOADS[endpoint]
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    remaining = [total_requests]
+    deadline = time.monotonic() + duration if duration else None
+
+    def next_request():
+        with lock:
+            if deadline is not None:
+                return time.monotonic() < deadline
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker():
+        session = requests.Session()
+        while next_request():
+            started = time.monotonic()
+            try:
+                response = session.post(url, json=payload, headers=headers, timeout=300)
+                status = response.status_code
+            except requests.exceptions.RequestException:
+                status = 'error'
+            elapsed = time.monotonic() - started
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.monotonic()
+    with InFlightSampler(mock_url) as sampler:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+    wall = time.monotonic() - started
+
+    samples = sampler.samples or [0]
+    avg_in_flight = sum(samples) / len(samples)
+    return {
+        'endpoint': endpoint,
+        'requests': sum(statuses.values()),
+        'ok': statuses.get(200, 0),
+        'statuses': {str(k): v for k, v in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        'throughput': round(statuses.get(200, 0) / wall, 2) if wall else 0,
+        'p50_ms': _ms(percentile(latencies, 0.5)),
+        'p95_ms': _ms(percentile(latencies, 0.95)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+        'upstream_in_flight_avg': round(avg_in_flight, 2),
+        'upstream_in_flight_max': max(samples),
+        'saturation': round(avg_in_flight / capacity, 3) if capacity else None,
+        'rejected': statuses.get(429, 0) + statuses.get(503, 0)
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def login(base_url, email, password):
+    """登录测试账号获取JWT"""
+    response = requests.post(f'{base_url}/api/auth/login', json={'email': email, 'password': password}, timeout=30)
+    data = response.json()
+    if not data.get('success'):
+        raise SystemExit(f'❌ 登录失败: {data.get("message")}')
+    return data['token']
+
+
+def print_report(results):
+    """打印各接口的压测结果表"""
+    header = f"{'接口':<22}{'请求':>6}{'成功':>6}{'吞吐/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'上游并发':>10}{'饱和度':>8}{'拒绝':>6}"
+    print(header)
+    print('-' * len(header))
+    for item in results:
+        saturation = f"{item['saturation'] * 100:.0f}%" if item['saturation'] is not None else '-'
+        print(f"{item['endpoint']:<22}{item['requests']:>6}{item['ok']:>6}{item['throughput']:>9}"
+              f"{str(item['p50_ms']):>9}{str(item['p95_ms']):>9}{str(item['p99_ms']):>9}"
+              f"{item['upstream_in_flight_avg']:>6}/{item['upstream_in_flight_max']:<3}{saturation:>8}{item['rejected']:>6}")
+        print(f"{'':<22}状态码: {item['statuses']}")
+
+
+def build_parser():
+    from config import Config
+    parser = argparse.ArgumentParser(description='AI接口压测')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5002', help='后端地址')
+    parser.add_argument('--endpoints', default=DEFAULT_ENDPOINTS,
+                        help=f'逗号分隔的接口名，可选: {", ".join(ENDPOINT_PAYLOADS)}')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help='每个接口的请求数')
+    parser.add_argument('--duration', type=float, default=0, help='每个接口的压测时长（秒），设置后忽略--requests')
+    parser.add_argument('--token', help='测试账号的JWT')
+    parser.add_argument('--email', help='测试账号邮箱（未提供--token时登录获取）')
+    parser.add_argument('--password', help='测试账号密码')
+    parser.add_argument('--ai-config', default=Config.AI_CONFIG_PATH or os.path.join(BACKEND_DIR, 'ai_config.json'))
+    parser.add_argument('--mock-url', default='http://127.0.0.1:18080', help='已启动的模拟服务商地址')
+    parser.add_argument('--start-mock', action='store_true', help='在本进程内启动模拟服务商')
+    parser.add_argument('--mock-latency', default='lognormal:-0.7,0.5', help='--start-mock时的延迟分布')
+    parser.add_argument('--mock-error-rate', type=float, default=0.0)
+    parser.add_argument('--capacity', type=int, default=Config.AI_ADMISSION_GLOBAL,
+                        help='计算饱和度的并发上限（默认为全站AI准入上限）')
+    parser.add_argument('--json', help='把结果另存为JSON文件')
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINT_PAYLOADS]
+    if unknown:
+        raise SystemExit(f'❌ 未知接口: {", ".join(unknown)}')
+
+    token = args.token or login(args.base_url, args.email, args.password)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    mock = None
+    mock_url = args.mock_url
+    if args.start_mock:
+        port = int(mock_url.rsplit(':', 1)[-1])
+        mock = MockLLMServer(port=port, latency=args.mock_latency, error_rate=args.mock_error_rate).start()
+        mock_url = mock.url
+
+    backup_path = point_ai_config(args.ai_config, mock_url)
+    print(f'🔧 ai_config.json已指向模拟服务商 {mock_url}，等待后端重新加载配置...')
+    time.sleep(3)
+    results = []
+    try:
+        for endpoint in endpoints:
+            print(f'🔧 压测 {endpoint}（并发{args.concurrency}）...')
+            results.append(run_endpoint(
+                args.base_url, endpoint, headers, args.concurrency, args.requests,
+                args.duration, mock_url, args.capacity
+            ))
+    finally:
+        restore_ai_config(args.ai_config, backup_path)
+        if mock:
+            mock.stop()
+
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    print('✅ 压测完成！')
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地模拟AI服务商（OpenAI兼容的/chat/completions接口）
+用于压测和联调/api/aimodelapp/*，不消耗真实额度：
+- 延迟按指定分布采样，流式输出按token间隔逐段返回
+- 可按比例注入500错误、429限额和超时（挂起不响应）
+- 按提示词识别变量命名、表情制作、亲戚称呼、Linux命令等接口，返回能被对应解析逻辑解析的JSON
+
+用法（在后端根目录执行）：
+    python test/mock_llm_server.py --port 18080 --latency lognormal:0.0,0.5 --error-rate 0.02
+运行中可以POST /__mock/config修改配置，GET /__mock/stats查看请求计数和并发数
+Created by: 万象口袋
+Date: 2026-10-18
+"""
+
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 各接口的固定返回内容（按提示词中的关键字匹配）
+CANNED_RESPONSES = [
+    ('变量命名助手', {
+        'suggestions': {
+            'camelCase': [
+                {'name': 'userLoginCount', 'description': '用户登录次数'},
+                {'name': 'loginTimes', 'description': '登录的次数'},
+                {'name': 'userSignInTotal', 'description': '用户签到总数'}
+            ],
+            'PascalCase': [
+                {'name': 'UserLoginCount', 'description': '用户登录次数'},
+                {'name': 'LoginTimes', 'description': '登录的次数'},
+                {'name': 'UserSignInTotal', 'description': '用户签到总数'}
+            ],
+            'snake_case': [
+                {'name': 'user_login_count', 'description': '用户登录次数'},
+                {'name': 'login_times', 'description': '登录的次数'},
+                {'name': 'user_sign_in_total', 'description': '用户签到总数'}
+            ],
+            'kebab-case': [
+                {'name': 'user-login-count', 'description': '用户登录次数'},
+                {'name': 'login-times', 'description': '登录的次数'},
+                {'name': 'user-sign-in-total', 'description': '用户签到总数'}
+            ],
+            'CONSTANT_CASE': [
+                {'name': 'USER_LOGIN_COUNT', 'description': '用户登录次数'},
+                {'name': 'LOGIN_TIMES', 'description': '登录的次数'},
+                {'name': 'USER_SIGN_IN_TOTAL', 'description': '用户签到总数'}
+            ]
+        }
+    }),
+    ('表情符号专家', {
+        'expressions': {
+            'emoji': [{'symbol': '😊', 'description': '开心', 'intensity': '中等', 'usage': '日常聊天'}],
+            'kaomoji': [{'symbol': '(^_^)', 'description': '微笑', 'intensity': '轻微', 'usage': '礼貌回复'}],
+            'combination': [{'symbol': '🎉✨', 'description': '庆祝', 'intensity': '强烈', 'usage': '节日祝福'}]
+        },
+        'summary': {
+            'emotion_analysis': '积极愉快',
+            'recommended_usage': '朋友间聊天',
+            'style_notes': '轻松可爱'
+        }
+    }),
+    ('亲属称呼专家', {
+        'mandarin_title': '表哥',
+        'dialect_titles': {
+            '粤语': {'title': '表哥', 'romanization': 'biu2 go1', 'notes': ''},
+            '闽南语': {'title': '表兄', 'romanization': 'piáu-hiann', 'notes': ''}
+        },
+        'notes': '年长于自己时称表哥，年幼时称表弟'
+    }),
+    ('Linux系统专家', {
+        'commands': [{
+            'command': 'du -sh * | sort -h',
+            'description': '按大小列出当前目录下的文件和目录',
+            'safety_level': 'safe',
+            'explanation': 'du统计占用空间，sort -h按可读单位排序',
+            'example_output': '4.0K\tREADME.md',
+            'alternatives': ['ncdu']
+        }],
+        'safety_warnings': ['不要在根目录下执行耗时统计'],
+        'prerequisites': ['coreutils'],
+        'related_concepts': ['磁盘空间']
+    })
+]
+
+DEFAULT_TEXT = '这是模拟AI服务商返回的内容，用于压测和联调。' * 8
+
+
+#按分布描述采样延迟
+def sample_latency(spec, rng=random):
+    """
+    支持 fixed:秒、uniform:最小,最大、normal:均值,标准差、lognormal:mu,sigma、exp:均值
+
+    Returns:
+        float: 非负的延迟秒数
+    """
+    kind, _, args = (spec or 'fixed:0').partition(':')
+    values = [float(v) for v in args.split(',') if v.strip()] or [0.0]
+    if kind == 'uniform':
+        delay = rng.uniform(values[0], values[1])
+    elif kind == 'normal':
+        delay = rng.gauss(values[0], values[1])
+    elif kind == 'lognormal':
+        delay = rng.lognormvariate(values[0], values[1])
+    elif kind == 'exp':
+        delay = rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    else:
+        delay = values[0]
+    return max(0.0, delay)
+
+
+def canned_content(messages, response_format=None):
+    """按最后一条用户消息匹配固定返回内容"""
+    prompt = ''
+    for message in messages or []:
+        if message.get('role') == 'user':
+            prompt = message.get('content') or ''
+    for keyword, body in CANNED_RESPONSES:
+        if keyword in prompt:
+            return json.dumps(body, ensure_ascii=False)
+    if (response_format or {}).get('type') == 'json_object':
+        return json.dumps({'result': DEFAULT_TEXT}, ensure_ascii=False)
+    return DEFAULT_TEXT
+
+
+class MockLLMServer:
+    """模拟服务商的配置、计数和HTTP服务"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency='fixed:0.2', token_interval=0.01,
+                 error_rate=0.0, rate_limit_rate=0.0, timeout_rate=0.0, hang_seconds=120, seed=None):
+        self.config = {
+            'latency': latency,
+            'token_interval': token_interval,
+            'error_rate': error_rate,
+            'rate_limit_rate': rate_limit_rate,
+            'timeout_rate': timeout_rate,
+            'hang_seconds': hang_seconds
+        }
+        self.rng = random.Random(seed)
+        self.stats = {'requests': 0, 'streams': 0, 'errors': 0, 'rate_limited': 0, 'timeouts': 0,
+                      'in_flight': 0, 'max_in_flight': 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-llm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self.stats[key] += delta
+            if key == 'in_flight':
+                self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+
+    def _choose_fault(self):
+        """按配置的比例决定本次请求是否注入故障"""
+        with self._lock:
+            roll = self.rng.random()
+            delay = sample_latency(self.config['latency'], self.rng)
+        for fault in ('timeout', 'rate_limit', 'error'):
+            rate = self.config[f'{fault}_rate']
+            if roll < rate:
+                return fault, delay
+            roll -= rate
+        return None, delay
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_HEAD(self):
+                # 连接预热
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path == '/__mock/stats':
+                    with server._lock:
+                        self._send_json(200, dict(server.stats, config=server.config))
+                    return
+                self._send_json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self._send_json(400, {'error': {'message': 'invalid json'}})
+                    return
+
+                if self.path == '/__mock/config':
+                    with server._lock:
+                        server.config.update({k: v for k, v in body.items() if k in server.config})
+                        if body.get('reset_stats'):
+                            server.stats.update({k: 0 for k in server.stats if k != 'in_flight'})
+                        self._send_json(200, server.config)
+                    return
+                if not self.path.endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': 'not found'}})
+                    return
+
+                server._count('requests')
+                server._count('in_flight')
+                try:
+                    self._complete(body)
+                finally:
+                    server._count('in_flight', -1)
+
+            def _complete(self, body):
+                fault, delay = server._choose_fault()
+                if fault == 'timeout':
+                    server._count('timeouts')
+                    time.sleep(server.config['hang_seconds'])
+                    self.close_connection = True
+                    return
+                time.sleep(delay)
+                if fault == 'rate_limit':
+                    server._count('rate_limited')
+                    self._send_json(429, {'error': {'message': 'Rate limit reached'}}, {
+                        'Retry-After': '1',
+                        'x-ratelimit-remaining-requests': '0',
+                        'x-ratelimit-reset-requests': '1s'
+                    })
+                    return
+                if fault == 'error':
+                    server._count('errors')
+                    self._send_json(500, {'error': {'message': 'mock internal error'}})
+                    return
+
+                content = canned_content(body.get('messages'), body.get('response_format'))
+                prompt_tokens = sum(len(m.get('content') or '') for m in body.get('messages') or []) // 2
+                usage = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': math.ceil(len(content) / 2),
+                    'total_tokens': prompt_tokens + math.ceil(len(content) / 2)
+                }
+                model = body.get('model', 'mock-model')
+                if body.get('stream'):
+                    server._count('streams')
+                    self._stream(content, usage, model)
+                    return
+                self._send_json(200, {
+                    'id': 'mock-completion',
+                    'object': 'chat.completion',
+                    'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                    'usage': usage
+                })
+
+            def _stream(self, content, usage, model):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                interval = server.config['token_interval']
+                try:
+                    for start in range(0, len(content), 4):
+                        chunk = {'model': model, 'choices': [{'index': 0, 'delta': {'content': content[start:start + 4]}}]}
+                        self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                        self.wfile.flush()
+                        if interval:
+                            time.sleep(interval)
+                    final = {'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+                    self.wfile.write(f'data: {json.dumps(final)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+        return Handler
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='本地模拟AI服务商')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', default='fixed:0.2',
+                        help='延迟分布：fixed:秒 / uniform:a,b / normal:均值,标准差 / lognormal:mu,sigma / exp:均值')
+    parser.add_argument('--token-interval', type=float, default=0.01, help='流式输出每段间隔（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的比例')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回429的比例')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='挂起不响应的比例')
+    parser.add_argument('--hang-seconds', type=float, default=120, help='超时注入时挂起的秒数')
+    parser.add_argument('--seed', type=int, default=None)
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    server = MockLLMServer(
+        host=args.host, port=args.port, latency=args.latency, token_interval=args.token_interval,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds, seed=args.seed
+    )
+    print(f'🔧 模拟AI服务商已启动: {server.url}（Ctrl+C退出）')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+        print('✅ 已停止')
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI请求准入控制（达到用户/全站并发上限、异常时释放名额、429与Retry-After响应）
+"""
+
+import os
+import sys
+import threading
+from datetime import datetime
+from flask import Flask, g, jsonify
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo.errors import DuplicateKeyError
+from modules.ai_admission import AdmissionController, ai_admission, GLOBAL_KEY
+
+
+class FakeUpdateResult:
+    def __init__(self, modified_count, upserted_id=None):
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class FakeAdmissionCollection:
+    """ai_admission集合中准入控制用到的操作"""
+
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def _pull(self, doc, condition):
+        holders = doc.get('holders', [])
+        if 'token' in condition:
+            kept = [h for h in holders if h['token'] != condition['token']]
+        else:
+            kept = [h for h in holders if not h['expires_at'] < condition['expires_at']['$lt']]
+        doc['holders'] = kept
+        return len(kept) != len(holders)
+
+    def update_one(self, query, update, upsert=False):
+        with self.lock:
+            key = query['_id']
+            doc = self.docs.get(key)
+            if '$push' in update:
+                index = int(next(field for field in query if field.startswith('holders.')).split('.')[1])
+                if doc is None:
+                    self.docs[key] = {'_id': key, 'holders': [update['$push']['holders']]}
+                    return FakeUpdateResult(0, key)
+                if len(doc['holders']) > index:
+                    raise DuplicateKeyError('duplicate key')
+                doc['holders'].append(update['$push']['holders'])
+                return FakeUpdateResult(1)
+            if doc is None:
+                return FakeUpdateResult(0)
+            return FakeUpdateResult(1 if self._pull(doc, update['$pull']['holders']) else 0)
+
+    def update_many(self, query, update):
+        with self.lock:
+            for key in query['_id']['$in']:
+                if key in self.docs:
+                    self._pull(self.docs[key], update['$pull']['holders'])
+
+    def find_one(self, query, projection=None):
+        doc = self.docs.get(query['_id'])
+        return dict(doc) if doc else None
+
+    def holders(self, key):
+        return len(self.docs.get(key, {}).get('holders', []))
+
+
+class FakeDB:
+    def __init__(self):
+        self.ai_admission = FakeAdmissionCollection()
+
+
+def _controller(per_user=2, global_limit=3):
+    controller = AdmissionController()
+    controller.configure(per_user=per_user, global_limit=global_limit, max_wait=0, queue_size=0)
+    return controller
+
+
+def test_limits():
+    """每个用户最多per_user个并发，全站最多global_limit个；被拒绝时给出重试秒数"""
+    db = FakeDB()
+    controller = _controller()
+    first, _ = controller.acquire(db, 'u1')
+    second, _ = controller.acquire(db, 'u1')
+    assert first and second
+    ticket, retry_after = controller.acquire(db, 'u1')
+    assert ticket is None and retry_after >= 1
+
+    # 用户名额未满，全站名额已满：退回已占用的用户名额
+    third, _ = controller.acquire(db, 'u2')
+    assert third
+    ticket, retry_after = controller.acquire(db, 'u3')
+    assert ticket is None and retry_after >= 1
+    assert db.ai_admission.holders('user:u3') == 0
+    assert db.ai_admission.holders(GLOBAL_KEY) == 3
+
+    controller.release(db, first)
+    assert controller.acquire(db, 'u1')[0]
+    print('✅ 并发上限测试通过')
+
+
+def test_expired_holders_pruned():
+    """worker退出后遗留的过期占用者在名额已满时被清理"""
+    db = FakeDB()
+    controller = _controller(per_user=1)
+    controller.acquire(db, 'u1')
+    db.ai_admission.docs['user:u1']['holders'][0]['expires_at'] = datetime(2000, 1, 1)
+    ticket, _ = controller.acquire(db, 'u1')
+    assert ticket and db.ai_admission.holders('user:u1') == 1
+    print('✅ 过期名额清理测试通过')
+
+
+def _admission_app(db):
+    """挂载verify_user_coins的测试应用（跳过认证）"""
+    from modules.aimodelapp import verify_user_coins
+
+    app = Flask(__name__)
+    app.mongo = type('Mongo', (), {'db': db})()
+
+    @app.before_request
+    def login():
+        g.principal = {'user_id': 'u1'}
+        g.auth_error = None
+
+    @app.route('/ai/chat', methods=['POST'])
+    @verify_user_coins
+    def chat():
+        return jsonify({'ok': True})
+
+    @app.route('/ai/raise', methods=['POST'])
+    @verify_user_coins
+    def raising():
+        raise RuntimeError('上游连接中断')
+
+    return app
+
+
+def test_admission_response_and_release():
+    """名额已满时在扣费前返回429和Retry-After；预扣或接口抛出异常时名额被释放"""
+    from modules import aimodelapp
+
+    db = FakeDB()
+    app = _admission_app(db)
+    client = app.test_client()
+    ai_admission.configure(per_user=1, global_limit=16, max_wait=0, queue_size=0)
+    original = aimodelapp.reserve_coins, aimodelapp.settle_reservation
+    try:
+        # 预扣时数据库异常：返回500且释放名额，下一次请求仍能进入
+        def broken(*args, **kwargs):
+            raise RuntimeError('数据库不可用')
+        aimodelapp.reserve_coins = broken
+        for _ in range(2):
+            assert client.post('/ai/chat', json={}).status_code == 500
+            assert db.ai_admission.holders('user:u1') == 0
+            assert db.ai_admission.holders(GLOBAL_KEY) == 0
+
+        # 接口抛出异常：结算（退回）后释放名额
+        settled = []
+        aimodelapp.reserve_coins = lambda *args, **kwargs: ({'用户名': 'u', '邮箱': 'u@qq.com'}, {'id': 'r1'})
+        aimodelapp.settle_reservation = lambda db, reservation, status: settled.append(status)
+        assert client.post('/ai/raise', json={}).status_code == 500
+        assert settled == [500] and db.ai_admission.holders('user:u1') == 0
+
+        # 已有一个进行中的请求占用名额：第二个请求被拒绝且不扣费
+        held, _ = ai_admission.acquire(db, 'u1')
+        reserved = []
+        aimodelapp.reserve_coins = lambda *args, **kwargs: reserved.append(1) or (None, None)
+        resp = client.post('/ai/chat', json={})
+        assert resp.status_code == 429
+        assert int(resp.headers['Retry-After']) >= 1
+        body = resp.get_json()
+        assert body['error_code'] == 'too_many_requests' and body['retry_after'] == int(resp.headers['Retry-After'])
+        assert reserved == []
+        ai_admission.release(db, held)
+        assert db.ai_admission.holders('user:u1') == 0
+    finally:
+        aimodelapp.reserve_coins, aimodelapp.settle_reservation = original
+        ai_admission.configure()
+    print('✅ 准入拒绝与名额释放测试通过')
+
+
+if __name__ == '__main__':
+    test_limits()
+    test_expired_holders_pruned()
+    test_admission_response_and_release()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI响应缓存（LRU淘汰、TTL过期、输入规范化、TTL配置）
+"""
+
+import os
+import sys
+import time
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai_cache import LRUTTLCache, ResponseCache, normalize_input
+
+
+def test_lru_ttl_cache():
+    """超出容量淘汰最久未使用条目，过期条目不再返回"""
+    cache = LRUTTLCache(maxsize=2)
+    cache.set('a', 1, 60)
+    cache.set('b', 2, 60)
+    assert cache.get('a') == 1  # a变为最近使用
+    cache.set('c', 3, 60)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    cache.set('d', 4, 0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
+    print('✅ LRU缓存测试通过')
+
+
+def test_cache_key_normalization():
+    """空白差异和字典键顺序不影响缓存键，模型和提示词版本参与缓存键"""
+    assert normalize_input('  查看   端口占用 ') == '查看 端口占用'
+
+    cache = ResponseCache()
+    key1 = cache.make_key('linux-command', {'task_description': ' 查看  端口占用', 'difficulty_level': 'beginner'}, 'deepseek-chat', 1)
+    key2 = cache.make_key('linux-command', {'difficulty_level': 'beginner', 'task_description': '查看 端口占用'}, 'deepseek-chat', 1)
+    assert key1 == key2
+    assert key1 != cache.make_key('linux-command', {'task_description': '查看 端口占用', 'difficulty_level': 'beginner'}, 'deepseek-chat', 2)
+    assert key1 != cache.make_key('linux-command', {'task_description': '查看 端口占用', 'difficulty_level': 'beginner'}, 'deepseek-reasoner', 1)
+
+    cache.configure(ttls={'linux-command': 0})
+    assert cache.ttl_for('linux-command') == 0
+    assert cache.ttl_for('poetry') == 0
+    print('✅ 缓存键规范化测试通过')
+
+
+def test_ttls_from_config():
+    """各接口TTL只在Config.AI_CACHE_TTLS中配置，初始化前不缓存"""
+    from flask import Flask
+    from config import Config
+    from modules.ai_cache import ai_response_cache, init_ai_cache
+
+    assert ResponseCache().ttl_for('linux-command') == 0
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    init_ai_cache(app)
+    assert ai_response_cache.ttls == Config.AI_CACHE_TTLS
+    assert ai_response_cache.ttl_for('kinship-calculator') == Config.AI_CACHE_TTLS['kinship-calculator']
+    print('✅ 缓存时间配置测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试AI响应缓存...')
+    test_lru_ttl_cache()
+    test_cache_key_normalization()
+    test_ttls_from_config()
+    print('✅ 测试完成！')
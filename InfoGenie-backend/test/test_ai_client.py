@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI服务连接池（按提供商复用会话、fork后重建、预热开关、预热后复用连接）
+"""
+
+import os
+import sys
+from flask import Flask
+
+# 加入后端根目录和测试目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer
+from modules import ai_client
+from modules.ai_client import init_ai_client, get_session, warmup_sessions, chat_completion
+from modules.rate_limit import rate_limiter, MemoryBucketStore
+from modules.ai_metrics import ai_metrics
+
+
+def _client_app(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    return app
+
+
+def _connections(session, url):
+    """会话中到url所在主机新建过的连接数"""
+    return session.get_adapter(url).poolmanager.connection_from_url(url).num_connections
+
+
+def test_session_per_provider():
+    """同一进程内每个提供商复用一个会话，连接池大小取自配置；pid变化（fork）后重建"""
+    init_ai_client(_client_app(AI_POOL_CONNECTIONS=2, AI_POOL_MAXSIZE=3))
+    ai_client._sessions_pid = None
+    deepseek = get_session('deepseek')
+    assert get_session('deepseek') is deepseek
+    assert get_session('kimi') is not deepseek
+    adapter = deepseek.get_adapter('https://api.deepseek.com')
+    assert adapter._pool_connections == 2 and adapter._pool_maxsize == 3
+
+    # 模拟gunicorn fork出的worker：父进程的会话不再使用
+    ai_client._sessions_pid = -1
+    assert get_session('deepseek') is not deepseek
+    print('✅ 按提供商复用会话测试通过')
+
+
+def test_warmup_gating():
+    """只有开启AI_POOL_WARMUP且不在测试中时才预热；测试和命令行默认不预热"""
+    from config import Config, TestingConfig
+
+    calls = []
+    original = ai_client.warmup_sessions
+    ai_client.warmup_sessions = calls.append
+    providers = {'deepseek': {'api_base': 'https://api.deepseek.com'}}
+    try:
+        init_ai_client(_client_app(), providers)
+        init_ai_client(_client_app(AI_POOL_WARMUP=False), providers)
+        init_ai_client(_client_app(AI_POOL_WARMUP=True, TESTING=True), providers)
+        assert calls == []
+        init_ai_client(_client_app(AI_POOL_WARMUP=True), providers)
+        assert calls == [providers]
+    finally:
+        ai_client.warmup_sessions = original
+
+    if 'AI_POOL_WARMUP' not in os.environ:
+        assert Config.AI_POOL_WARMUP is False
+    assert TestingConfig.AI_POOL_WARMUP is False
+    print('✅ 预热开关测试通过')
+
+
+def test_warmup_connection_reused():
+    """预热建立的keep-alive连接被后续补全请求复用"""
+    rate_limiter.configure(store=MemoryBucketStore())
+    ai_metrics.configure(enabled=False)
+    server = MockLLMServer(latency='fixed:0', token_interval=0).start()
+    try:
+        init_ai_client(_client_app())
+        config = {'api_key': 'test', 'api_base': server.url}
+        warmup_sessions({'deepseek': config, 'kimi': {}}).join(5)
+        session = get_session('deepseek')
+        assert _connections(session, server.url) == 1
+
+        messages = [{'role': 'user', 'content': '你好'}]
+        for _ in range(2):
+            _, error = chat_completion('deepseek', config, messages, 'deepseek-chat', max_retries=1)
+            assert error is None
+        assert _connections(session, server.url) == 1
+        assert server.stats['requests'] == 2
+    finally:
+        server.stop()
+    print('✅ 预热连接复用测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试AI服务连接池...')
+    test_session_per_provider()
+    test_warmup_gating()
+    test_warmup_connection_reused()
+    print('✅ 测试完成！')
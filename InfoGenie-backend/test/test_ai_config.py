@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI配置缓存（mtime热加载、配置校验、/models接口ETag）
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai_config import AIConfigCache, validate_ai_config
+
+
+def _write_config(path, config, mtime):
+    """写入配置文件并设置固定mtime"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+    os.utime(path, (mtime, mtime))
+
+
+def test_ai_config_cache_reload():
+    """配置文件修改后重新加载，非法配置保留旧配置"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ai_config.json')
+        _write_config(path, {
+            'deepseek': {'api_key': 'k1', 'api_base': 'https://a', 'model': ['deepseek-chat']}
+        }, 1000)
+
+        cache = AIConfigCache(path, check_interval=0)
+        assert cache.get()['deepseek']['api_key'] == 'k1'
+        payload, etag1 = cache.models_response()
+        assert payload['models'] == {'deepseek': ['deepseek-chat']}
+
+        # 密钥轮换：mtime变化后自动生效
+        _write_config(path, {
+            'deepseek': {'api_key': 'k2', 'api_base': 'https://a', 'model': ['deepseek-chat', 'deepseek-reasoner']}
+        }, 2000)
+        assert cache.get()['deepseek']['api_key'] == 'k2'
+        _, etag2 = cache.models_response()
+        assert etag1 != etag2
+
+        # 非法配置：保留上一份有效配置
+        _write_config(path, {'deepseek': {'api_base': 'https://a'}}, 3000)
+        assert cache.get()['deepseek']['api_key'] == 'k2'
+        ok, error = cache.reload()
+        assert not ok and 'api_key' in error
+        print('✅ AI配置热加载测试通过')
+
+
+def test_invalid_config_cached_by_mtime():
+    """非法配置按mtime记录失败，文件未再修改时不重复解析"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ai_config.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{not json')
+        os.utime(path, (1000, 1000))
+
+        cache = AIConfigCache(path, check_interval=0)
+        loads = []
+        original = cache._load
+        cache._load = lambda mtime: loads.append(mtime) or original(mtime)
+        assert cache.get() is None
+        assert cache.get() is None
+        assert loads == [1000]
+
+        # 修复文件后mtime变化，重新加载
+        _write_config(path, {'kimi': {'api_key': 'k', 'api_base': 'https://b'}}, 2000)
+        assert cache.get()['kimi']['api_key'] == 'k'
+        assert loads == [1000, 2000]
+
+        # 改坏后同样只解析一次，期间继续使用旧配置
+        _write_config(path, {'kimi': {'api_base': 'https://b'}}, 3000)
+        assert cache.get()['kimi']['api_key'] == 'k'
+        assert cache.get()['kimi']['api_key'] == 'k'
+        assert loads == [1000, 2000, 3000]
+        print('✅ 非法配置失败缓存测试通过')
+
+
+def test_validate_ai_config():
+    """配置结构校验"""
+    assert validate_ai_config({'kimi': {'api_key': 'k', 'api_base': 'https://b', 'model': 'kimi'}}) == []
+    assert validate_ai_config({}) != []
+    assert validate_ai_config({'kimi': {'api_key': 'k', 'api_base': 'https://b', 'model': [1]}}) != []
+
+
+def test_models_etag():
+    """/models接口返回ETag，If-None-Match命中时返回304"""
+    from app import create_app
+
+    app = create_app()
+    client = app.test_client()
+
+    resp = client.get('/api/aimodelapp/models')
+    print('首次请求 状态码:', resp.status_code)
+    assert resp.status_code == 200
+    etag = resp.headers.get('ETag')
+    assert etag
+
+    resp2 = client.get('/api/aimodelapp/models', headers={'If-None-Match': etag})
+    print('条件请求 状态码:', resp2.status_code)
+    assert resp2.status_code == 304
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试AI配置缓存...')
+    test_ai_config_cache_reload()
+    test_invalid_config_cached_by_mtime()
+    test_validate_ai_config()
+    test_models_etag()
+    print('✅ 测试完成！')
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI异步任务的生命周期（提交、轮询、执行超时、失败时退回萌芽币）以及内部维护任务使用单独的线程池
+"""
+
+import os
+import sys
+import time
+import threading
+from datetime import datetime, timedelta
+from flask import Flask, g, jsonify
+
+# 加入后端根目录和测试目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from test_coins import FakeDB as CoinsFakeDB, _no_sweep
+from modules import ai_jobs
+from modules.ai_jobs import get_job, run_in_background
+from modules.ai_admission import ai_admission
+
+
+class FakeJobs:
+    """ai_jobs集合中任务用到的操作"""
+
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def _match(self, doc, query):
+        return all(doc.get(field) == value for field, value in query.items())
+
+    def insert_one(self, doc):
+        with self.lock:
+            self.docs[doc['_id']] = dict(doc)
+
+    def update_one(self, query, update):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            if doc and self._match(doc, query):
+                doc.update(update['$set'])
+
+    def find_one(self, query):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            return dict(doc) if doc and self._match(doc, query) else None
+
+
+class FakeDB(CoinsFakeDB):
+    def __init__(self):
+        super().__init__()
+        self.ai_jobs = FakeJobs()
+
+
+def _job_app(db, user_id):
+    """挂载verify_user_coins的测试应用（跳过认证），/ai/ok成功，/ai/fail上游失败"""
+    from modules.aimodelapp import verify_user_coins
+
+    app = Flask(__name__)
+    app.mongo = type('Mongo', (), {'db': db})()
+
+    @app.before_request
+    def login():
+        g.principal = {'user_id': user_id}
+        g.auth_error = None
+
+    @app.route('/ai/ok', methods=['POST'])
+    @verify_user_coins
+    def ok():
+        return jsonify({'success': True, 'content': '完成'})
+
+    @app.route('/ai/fail', methods=['POST'])
+    @verify_user_coins
+    def fail():
+        return jsonify({'error': 'AI服务暂不可用'}), 502
+
+    return app
+
+
+def _wait_finished(db, job_id, user_id, timeout=5):
+    """轮询直到任务结束"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_job(db, job_id, user_id)
+        if job['status'] in ('succeeded', 'failed'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'任务{job_id}未在{timeout}秒内结束')
+
+
+def test_job_lifecycle():
+    """提交后立即返回202，轮询得到结果；成功时扣费，失败时退回"""
+    _no_sweep()
+    ai_admission.configure(enabled=False)
+    db = FakeDB()
+    user_id = db.add_user(1000)
+    client = _job_app(db, user_id).test_client()
+    try:
+        resp = client.post('/ai/ok', json={'async': True})
+        assert resp.status_code == 202
+        job_id = resp.get_json()['job_id']
+        assert resp.headers['Location'].endswith(job_id)
+        assert get_job(db, job_id, 'someone-else') is None
+
+        job = _wait_finished(db, job_id, user_id)
+        assert job['status'] == 'succeeded' and job['http_status'] == 200
+        assert job['result'] == {'success': True, 'content': '完成'}
+        assert job['expires_at'] > datetime.utcnow() + timedelta(seconds=ai_jobs._job_settings['result_ttl'] - 60)
+        assert db.balance(user_id) == 900 and db.reservations(user_id) == []
+
+        resp = client.post('/ai/fail', json={'async': True})
+        job = _wait_finished(db, resp.get_json()['job_id'], user_id)
+        assert job['status'] == 'failed' and job['http_status'] == 502
+        assert db.balance(user_id) == 900 and db.reservations(user_id) == []
+    finally:
+        ai_admission.configure()
+    print('✅ 异步任务生命周期测试通过')
+
+
+def test_stale_job_expires():
+    """超过AI_JOB_TIMEOUT仍未结束的任务（如worker重启）在轮询时标记为失败"""
+    db = FakeDB()
+    stale = (datetime.now() - timedelta(seconds=ai_jobs._job_settings['timeout'] + 1)).isoformat()
+    db.ai_jobs.insert_one({
+        '_id': 'j1', 'user_id': 'u1', 'endpoint': 'chat', 'status': 'running',
+        'http_status': None, 'result': None, 'created_at': stale, 'updated_at': stale
+    })
+    job = get_job(db, 'j1', 'u1')
+    assert job['status'] == 'failed' and job['http_status'] == 504
+    print('✅ 任务执行超时测试通过')
+
+
+def test_background_tasks_use_own_executor():
+    """用户任务占满线程池时，内部维护任务仍能立即执行"""
+    release = threading.Event()
+    executor = ai_jobs._get_executor()
+    busy = [executor.submit(release.wait, 5) for _ in range(ai_jobs._job_settings['workers'])]
+    try:
+        names = []
+        future = run_in_background(lambda: names.append(threading.current_thread().name))
+        future.result(timeout=2)
+        assert names and names[0].startswith('ai-background')
+    finally:
+        release.set()
+        for future in busy:
+            future.result(timeout=5)
+    print('✅ 内部维护任务线程池测试通过')
+
+
+if __name__ == '__main__':
+    test_job_lifecycle()
+    test_stale_job_expires()
+    test_background_tasks_use_own_executor()
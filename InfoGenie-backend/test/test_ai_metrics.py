@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI调用指标（直方图分位数估算、按标签累加）
+"""
+
+import os
+import sys
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai_metrics import MetricsRecorder, histogram_quantile, LATENCY_BUCKETS
+
+
+def test_histogram_quantile():
+    """桶内线性插值，落在+Inf桶时取最大有限上界"""
+    bounds = (1, 2, 4)
+    assert histogram_quantile(0.5, bounds, [0, 0, 0, 0]) is None
+    assert histogram_quantile(0.5, bounds, [0, 10, 0, 0]) == 1.5
+    assert histogram_quantile(0.99, bounds, [90, 0, 0, 10]) == 4
+    assert histogram_quantile(0.9, bounds, [90, 10, 0, 0]) == 1
+    print('✅ 分位数估算测试通过')
+
+
+def test_observe_call_accumulates():
+    """同一标签组合的调用在进程内累加，排队时间只计入请求的第一次调用"""
+    recorder = MetricsRecorder()
+    recorder.begin_request('aimodelapp.ai_chat', queue_wait=0.3)
+    usage = {'prompt_tokens': 10, 'completion_tokens': 40}
+    recorder.observe_call('deepseek', 'deepseek-chat', 1, 200, connect=0.0, ttfb=1.5, total=2.0, usage=usage)
+    recorder.observe_call('deepseek', 'deepseek-chat', 1, 200, connect=0.0, ttfb=1.5, total=2.0, usage=usage)
+    recorder.observe_call('deepseek', 'deepseek-chat', 2, 'timeout', total=90.0)
+
+    entries = {entry['labels']['attempt']: entry for entry in recorder._pending.values()}
+    assert len(entries) == 2
+    incs = entries[1]['incs']
+    assert entries[1]['labels']['endpoint'] == 'aimodelapp.ai_chat'
+    assert incs['calls'] == 2 and incs['prompt_tokens'] == 20 and incs['completion_tokens'] == 80
+    assert incs['h.queue_wait.count'] == 2 and abs(incs['h.queue_wait.sum'] - 0.3) < 1e-9
+    assert incs['h.total.b.%d' % LATENCY_BUCKETS.index(2)] == 2
+    assert incs['h.tokens_per_second.sum'] == 40
+    assert 'h.ttft.count' not in incs
+    assert entries[2]['labels']['status'] == 'timeout'
+    assert entries[2]['incs']['h.total.b.%d' % LATENCY_BUCKETS.index(120)] == 1
+    print('✅ 指标累加测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试AI调用指标...')
+    test_histogram_quantile()
+    test_observe_call_accumulates()
+    print('✅ 测试完成！')
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试提供商路由（熔断状态切换、半开探测未得出结果时重新熔断、对冲请求先成功者胜出、
+落后一方的HTTP请求被中断、对冲线程占满时不再对冲）
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 加入后端根目录和测试目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer
+from modules import ai_router as router_module
+from modules.ai_router import ProviderHealth, ProviderRouter
+from modules.ai_client import chat_completion
+from modules.deadline import CancelEvent
+from modules.rate_limit import RATE_LIMIT_ERROR, rate_limiter, MemoryBucketStore
+from modules.ai_metrics import ai_metrics
+
+CONFIG = {
+    'deepseek': {'api_key': 'k1', 'api_base': 'https://a', 'model': ['deepseek-chat']},
+    'kimi': {'api_key': 'k2', 'api_base': 'https://b', 'model': ['kimi-k2']}
+}
+
+
+def _open_breaker(health, cooldown=0.0):
+    """连续失败打开熔断，并让冷却期立即结束"""
+    for _ in range(5):
+        health.record(1.0, False, 0.5, 5)
+    assert health.state == 'open'
+    health.opened_at = time.monotonic() - cooldown
+
+
+def _warm_health(health, latency=0.05):
+    """写入足够的成功样本，使p95延迟可用"""
+    for _ in range(5):
+        health.record(latency, True, 0.5, 5)
+
+
+def test_breaker_abort():
+    """冷却结束后进入半开探测；探测被取消时回到熔断状态并重新冷却"""
+    health = ProviderHealth()
+    _open_breaker(health, cooldown=30)
+    assert health.available(30)
+    health.begin(30)
+    assert health.state == 'half_open' and health.probe_in_flight
+    assert not health.available(30)
+
+    health.abort()
+    assert health.state == 'open' and not health.probe_in_flight
+    assert not health.available(30)  # 重新开始冷却
+    assert health.available(0)
+
+    # 探测成功后关闭熔断；熔断关闭时abort不改变状态
+    health.begin(0)
+    health.record(1.0, True, 0.5, 5)
+    assert health.state == 'closed'
+    health.abort()
+    assert health.state == 'closed'
+    print('✅ 熔断器半开探测测试通过')
+
+
+def _with_fake_completion(fake):
+    """替换路由模块中的上游调用，返回恢复函数"""
+    original = router_module.chat_completion
+    router_module.chat_completion = fake
+
+    def restore():
+        router_module.chat_completion = original
+    return restore
+
+
+def test_router_probe_not_stuck():
+    """半开探测因限额未发出或抛出异常时，熔断器不会停在半开状态"""
+    router = ProviderRouter()
+    router.configure(cooldown=0)
+    health = router.get_health('deepseek')
+    _open_breaker(health)
+
+    restore = _with_fake_completion(lambda *args, **kwargs: (None, RATE_LIMIT_ERROR))
+    try:
+        result, error, provider, _ = router.chat({'deepseek': CONFIG['deepseek']}, [], 'deepseek')
+        assert error == RATE_LIMIT_ERROR and provider == 'deepseek'
+        assert health.state == 'open' and not health.probe_in_flight
+        assert health.available(0)
+    finally:
+        restore()
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('连接池异常')
+
+    restore = _with_fake_completion(broken)
+    try:
+        try:
+            router.chat({'deepseek': CONFIG['deepseek']}, [], 'deepseek')
+            assert False, '异常应向上抛出'
+        except RuntimeError:
+            pass
+        assert health.state == 'open' and not health.probe_in_flight
+    finally:
+        restore()
+
+    # 限额错误不计入统计，熔断关闭时也不改变状态
+    closed = router.get_health('kimi')
+    restore = _with_fake_completion(lambda *args, **kwargs: (None, RATE_LIMIT_ERROR))
+    try:
+        router.chat({'kimi': CONFIG['kimi']}, [], 'kimi')
+        assert closed.state == 'closed' and closed.snapshot()['samples'] == 0
+    finally:
+        restore()
+    print('✅ 路由半开探测恢复测试通过')
+
+
+def test_hedge_cancels_slow_probe():
+    """主提供商（半开探测）超过对冲延迟未响应：备用提供商胜出，主提供商被取消后重新熔断"""
+    router = ProviderRouter()
+    router.configure(cooldown=0, hedge_min_delay=0.05)
+    primary = router.get_health('deepseek')
+    _open_breaker(primary)
+    _warm_health(primary)
+    primary_done = threading.Event()
+
+    def fake(provider, provider_config, messages, model, max_retries=3, cancel_event=None, **kwargs):
+        if provider == 'deepseek':
+            try:
+                if cancel_event.wait(2):
+                    return None, "请求已取消"
+                return {'content': 'slow'}, None
+            finally:
+                primary_done.set()
+        return {'content': 'fast'}, None
+
+    restore = _with_fake_completion(fake)
+    try:
+        result, error, provider, model = router.chat(CONFIG, [], 'deepseek')
+        assert error is None and provider == 'kimi' and result['content'] == 'fast'
+        assert model == 'kimi-k2'
+        assert primary_done.wait(2)
+        router._executor.shutdown(wait=True)
+        assert primary.state == 'open' and not primary.probe_in_flight
+        assert router.get_health('kimi').snapshot()['samples'] == 1
+    finally:
+        restore()
+    print('✅ 对冲请求测试通过')
+
+
+
+def test_cold_provider_not_hedged():
+    """主提供商还没有足够的延迟样本时不对冲，只在失败时切换"""
+    router = ProviderRouter()
+    router.configure(hedge_min_delay=0.01)
+    calls = []
+
+    def fake(provider, provider_config, messages, model, max_retries=3, cancel_event=None, **kwargs):
+        calls.append(provider)
+        if provider == 'deepseek':
+            time.sleep(0.2)
+        return {'content': provider}, None
+
+    restore = _with_fake_completion(fake)
+    try:
+        assert router.hedge_delay('deepseek') is None
+        result, error, provider, _ = router.chat(CONFIG, [], 'deepseek')
+        assert error is None and provider == 'deepseek' and calls == ['deepseek']
+
+        # 有了p95后超过对冲延迟即向备用提供商发起请求
+        router = ProviderRouter()
+        router.configure(hedge_min_delay=0.01)
+        _warm_health(router.get_health('deepseek'), 0.01)
+        calls.clear()
+        result, error, provider, _ = router.chat(CONFIG, [], 'deepseek')
+        assert error is None and provider == 'kimi' and calls == ['deepseek', 'kimi']
+    finally:
+        restore()
+    print('✅ 冷启动不对冲测试通过')
+
+
+def test_cancel_aborts_inflight_request():
+    """取消事件置位时立即中断正在等待响应的HTTP请求，不等到单次超时，连接池随后仍可使用"""
+    rate_limiter.configure(store=MemoryBucketStore())
+    ai_metrics.configure(enabled=False)
+    server = MockLLMServer(latency='fixed:5', token_interval=0).start()
+    try:
+        config = {'api_key': 'test', 'api_base': server.url}
+        messages = [{'role': 'user', 'content': '你好'}]
+        cancel = CancelEvent()
+        threading.Timer(0.2, cancel.set).start()
+        started = time.monotonic()
+        result, error = chat_completion('deepseek', config, messages, 'deepseek-chat', max_retries=1,
+                                        timeout=10, cancel_event=cancel)
+        assert result is None and error == "请求已取消"
+        assert time.monotonic() - started < 2
+
+        # 已取消的事件：请求不会发出
+        _, error = chat_completion('deepseek', config, messages, 'deepseek-chat', max_retries=1, cancel_event=cancel)
+        assert error == "请求已取消" and server.stats['requests'] == 1
+
+        server.config['latency'] = 'fixed:0'
+        _, error = chat_completion('deepseek', config, messages, 'deepseek-chat', max_retries=1,
+                                   cancel_event=CancelEvent())
+        assert error is None
+    finally:
+        server.stop()
+    print('✅ 中断进行中请求测试通过')
+
+
+def test_hedge_pool_saturated():
+    """对冲线程全部占用时不再对冲：主提供商在当前线程调用并保留重试"""
+    router = ProviderRouter()
+    router.configure(hedge_workers=1, hedge_min_delay=0.01)
+    _warm_health(router.get_health('deepseek'), 0.01)
+    calls = []
+
+    def fake(provider, provider_config, messages, model, max_retries=3, cancel_event=None, **kwargs):
+        calls.append((provider, max_retries))
+        if provider == 'deepseek':
+            time.sleep(0.2)
+        return {'content': provider}, None
+
+    restore = _with_fake_completion(fake)
+    try:
+        # 主提供商占用唯一的线程，超过对冲延迟后也不再向备用提供商发起请求
+        result, error, provider, _ = router.chat(CONFIG, [], 'deepseek')
+        assert error is None and provider == 'deepseek' and calls == [('deepseek', 1)]
+
+        # 线程已被占满：主提供商在当前线程按普通方式调用
+        calls.clear()
+        _, slots = router._get_executor()
+        slots.acquire()
+        try:
+            result, error, provider, _ = router.chat(CONFIG, [], 'deepseek', max_retries=3)
+            assert error is None and provider == 'deepseek' and calls == [('deepseek', 3)]
+        finally:
+            slots.release()
+    finally:
+        restore()
+    print('✅ 对冲线程占满测试通过')
+
+
+def test_primary_retries_configurable():
+    """有备用提供商时主提供商的尝试次数由hedge_primary_retries配置"""
+    router = ProviderRouter()
+    calls = []
+
+    def fake(provider, provider_config, messages, model, max_retries=3, cancel_event=None, **kwargs):
+        calls.append((provider, max_retries))
+        return {'content': provider}, None
+
+    restore = _with_fake_completion(fake)
+    try:
+        router.chat(CONFIG, [], 'deepseek')
+        router.configure(hedge_primary_retries=2)
+        router.chat(CONFIG, [], 'deepseek')
+        assert calls == [('deepseek', 1), ('deepseek', 2)]
+    finally:
+        restore()
+    print('✅ 主提供商重试次数配置测试通过')
+
+
+if __name__ == '__main__':
+    test_breaker_abort()
+    test_router_probe_not_stuck()
+    test_hedge_cancels_slow_probe()
+    test_cold_provider_not_hedged()
+    test_cancel_aborts_inflight_request()
+    test_hedge_pool_saturated()
+    test_primary_retries_configurable()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试请求合并（成功结果共享、失败结果不缓存并释放租约、同worker内失败结果不共享）
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo.errors import DuplicateKeyError
+from modules.ai_singleflight import SingleFlight
+
+
+class FakeInflightCollection:
+    """ai_inflight集合中用到的操作"""
+
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def insert_one(self, doc):
+        with self.lock:
+            if doc['_id'] in self.docs:
+                raise DuplicateKeyError('duplicate key')
+            self.docs[doc['_id']] = dict(doc)
+
+    def find_one(self, query):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            return dict(doc) if doc else None
+
+    def find_one_and_update(self, query, update):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            if doc is None or doc['expires_at'] > query['expires_at']['$lte']:
+                return None
+            doc.update(update['$set'])
+            return dict(doc)
+
+    def update_one(self, query, update):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            if doc and doc['owner'] == query['owner']:
+                doc.update(update['$set'])
+
+    def delete_one(self, query):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            if doc and doc['owner'] == query['owner']:
+                del self.docs[query['_id']]
+
+
+class FakeDB:
+    def __init__(self):
+        self.ai_inflight = FakeInflightCollection()
+
+
+def _worker():
+    """模拟一个worker的请求合并实例（轮询间隔缩短）"""
+    flight = SingleFlight()
+    flight.poll_interval = 0.02
+    return flight
+
+
+def test_success_shared_across_workers():
+    """成功结果写入租约文档，其他worker在保留期内直接使用"""
+    db = FakeDB()
+    calls = []
+    assert _worker().do(db, 'k', lambda: calls.append(1) or ('答案', None)) == ('答案', None)
+    assert db.ai_inflight.docs['k']['status'] == 'done'
+    assert _worker().do(db, 'k', lambda: calls.append(2) or ('新答案', None)) == ('答案', None)
+    assert calls == [1]
+    print('✅ 成功结果共享测试通过')
+
+
+def test_error_not_cached():
+    """调用失败或抛出异常时删除租约，之后的请求重新调用"""
+    db = FakeDB()
+    assert _worker().do(db, 'k', lambda: (None, '上游超时')) == (None, '上游超时')
+    assert 'k' not in db.ai_inflight.docs
+
+    def broken():
+        raise RuntimeError('连接中断')
+
+    try:
+        _worker().do(db, 'k', broken)
+        assert False, '异常应向上抛出'
+    except RuntimeError:
+        pass
+    assert 'k' not in db.ai_inflight.docs
+
+    assert _worker().do(db, 'k', lambda: ('答案', None)) == ('答案', None)
+    print('✅ 失败结果不缓存测试通过')
+
+
+def test_follower_takes_over_after_error():
+    """等待中的worker在执行者失败后接管租约自行调用，而不是拿到失败结果"""
+    db = FakeDB()
+    started = threading.Event()
+    results = {}
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        return None, '上游超时'
+
+    leader = threading.Thread(target=lambda: results.update(leader=_worker().do(db, 'k', failing)))
+    leader.start()
+    assert started.wait(2)
+    follower_calls = []
+    results['follower'] = _worker().do(db, 'k', lambda: follower_calls.append(1) or ('答案', None))
+    leader.join()
+
+    assert results['leader'] == (None, '上游超时')
+    assert results['follower'] == ('答案', None) and follower_calls == [1]
+    assert db.ai_inflight.docs['k']['status'] == 'done'
+    print('✅ 失败后接管租约测试通过')
+
+
+def test_in_worker_followers_retry_after_error():
+    """同一worker内的等待者不共享执行者的失败结果，重新合并调用，只有一个接管执行"""
+    db = FakeDB()
+    flight = _worker()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    results = {}
+
+    def failing():
+        started.set()
+        release.wait(2)
+        return None, '上游超时'
+
+    def succeeding():
+        calls.append(1)
+        time.sleep(0.1)
+        return '答案', None
+
+    leader = threading.Thread(target=lambda: results.update(leader=flight.do(db, 'k', failing)))
+    leader.start()
+    assert started.wait(2)
+    followers = [
+        threading.Thread(target=lambda i=i: results.update({i: flight.do(db, 'k', succeeding)}))
+        for i in range(3)
+    ]
+    for follower in followers:
+        follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join()
+    for follower in followers:
+        follower.join()
+
+    assert results['leader'] == (None, '上游超时')
+    assert [results[i] for i in range(3)] == [('答案', None)] * 3
+    assert calls == [1]
+    print('✅ 同worker失败后重新合并测试通过')
+
+
+if __name__ == '__main__':
+    test_success_shared_across_workers()
+    test_error_not_cached()
+    test_follower_takes_over_after_error()
+    test_in_worker_followers_retry_after_error()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试旧版ai_usage_history数组迁移（数组转入ai_usage集合，null等非数组旧值直接删除且不会反复处理）
+"""
+
+import os
+import sys
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ai_usage import UsageLedger
+
+
+def _matches(doc, query):
+    """支持迁移用到的查询：_id、整个数组相等、$type array、$exists + $not $type array"""
+    for field, condition in query.items():
+        if isinstance(condition, dict):
+            present = field in doc
+            is_array = isinstance(doc.get(field), list)
+            if condition.get('$type') == 'array' and not is_array:
+                return False
+            if '$exists' in condition and present != condition['$exists']:
+                return False
+            if condition.get('$not') == {'$type': 'array'} and is_array:
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+
+class FakeCursor(list):
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+class FakeUpdateResult:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class FakeUserdata:
+    def __init__(self, docs):
+        self.docs = docs
+        self.finds = 0
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        assert self.finds < 20, 'migrate_history没有结束'
+        return FakeCursor(dict(doc) for doc in self.docs if _matches(doc, query))
+
+    def _unset(self, query, update, many):
+        modified = 0
+        for doc in self.docs:
+            if _matches(doc, query):
+                for field in update['$unset']:
+                    doc.pop(field, None)
+                modified += 1
+                if not many:
+                    break
+        return FakeUpdateResult(modified)
+
+    def update_one(self, query, update):
+        return self._unset(query, update, many=False)
+
+    def update_many(self, query, update):
+        return self._unset(query, update, many=True)
+
+
+class FakeUsage:
+    def __init__(self):
+        self.docs = {}
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.docs[doc['_id']] = doc
+
+
+class FakeDB:
+    def __init__(self, users):
+        self.userdata = FakeUserdata(users)
+        self.ai_usage = FakeUsage()
+
+
+def test_migrate_history_with_legacy_values():
+    """null、字符串等非数组值被删除，数组正常迁移，重复执行不重复写入"""
+    users = [
+        {'_id': 'u1', 'ai_usage_history': [
+            {'api_type': 'chat', 'timestamp': '2026-01-01T00:00:00', 'cost': 100},
+            {'api_type': 'poetry', 'timestamp': '2026-01-02T00:00:00', 'cost': 100}
+        ]},
+        {'_id': 'u2', 'ai_usage_history': None},
+        {'_id': 'u3', 'ai_usage_history': 'legacy'},
+        {'_id': 'u4', 'ai_usage_history': []},
+        {'_id': 'u5', '用户名': '没有使用记录'}
+    ]
+    db = FakeDB(users)
+    ledger = UsageLedger()
+    assert ledger.migrate_history(db, batch=2) == (2, 2)
+    assert all('ai_usage_history' not in user for user in users)
+    assert sorted(doc['api_type'] for doc in db.ai_usage.docs.values()) == ['chat', 'poetry']
+
+    assert ledger.migrate_history(db) == (0, 0)
+    assert len(db.ai_usage.docs) == 2
+    print('✅ 使用记录迁移测试通过')
+
+
+if __name__ == '__main__':
+    test_migrate_history_with_legacy_values()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试统一认证层的token验证缓存（命中计数、按exp过期、LRU容量、注销）
+"""
+
+import os
+import sys
+import time
+import jwt
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.auth_middleware import TokenAuth, token_digest, bearer_token
+
+SECRET = 'test-secret'
+
+
+def make_token(user_id, expires_in=3600):
+    return jwt.encode({'user_id': user_id, 'exp': int(time.time()) + expires_in}, SECRET, algorithm='HS256')
+
+
+def test_verify_cache():
+    """第二次验证命中缓存，签名错误和已过期的token不进入缓存"""
+    auth = TokenAuth()
+    token = make_token('u1')
+    assert auth.verify(token, SECRET)[0]['user_id'] == 'u1'
+    assert auth.verify(token, SECRET)[0]['user_id'] == 'u1'
+    assert auth.verify(token, 'wrong-secret')[0]['user_id'] == 'u1'  # 命中缓存，同一摘要
+    assert auth.verify(make_token('u2'), 'wrong-secret') == (None, 'invalid')
+    assert auth.verify(make_token('u3', -10), SECRET) == (None, 'expired')
+    stats = auth.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 3 and stats['cached_tokens'] == 1
+    assert stats['invalid'] == 1 and stats['expired'] == 1
+    print('✅ token验证缓存测试通过')
+
+
+def test_expiry_and_capacity():
+    """缓存条目到token的exp失效，超出容量时淘汰最久未用的token"""
+    auth = TokenAuth()
+    auth.configure(cache_size=2)
+    token = make_token('u1', 1)
+    auth.verify(token, SECRET)
+    time.sleep(1.5)
+    assert auth.verify(token, SECRET) == (None, 'expired')
+    assert token_digest(token) not in auth._cache
+
+    tokens = [make_token(f'u{index}') for index in range(3)]
+    for token in tokens:
+        auth.verify(token, SECRET)
+    assert auth.stats()['cached_tokens'] == 2 and token_digest(tokens[0]) not in auth._cache
+    print('✅ 缓存过期与容量测试通过')
+
+
+def test_revoke():
+    """注销后即使缓存中有该token也拒绝"""
+    class FakeCollection:
+        def __init__(self):
+            self.docs = {}
+
+        def create_index(self, *args, **kwargs):
+            pass
+
+        def update_one(self, query, update, upsert=False):
+            self.docs[query['_id']] = update['$set']
+
+    class FakeDB:
+        revoked_tokens = FakeCollection()
+
+    auth = TokenAuth()
+    token = make_token('u1')
+    claims, _ = auth.verify(token, SECRET)
+    auth.revoke(FakeDB, token, claims)
+    assert auth.verify(token, SECRET) == (None, 'revoked')
+    assert token_digest(token) in FakeDB.revoked_tokens.docs and token not in str(FakeDB.revoked_tokens.docs)
+    assert bearer_token({'Authorization': f'Bearer {token}'}) == token and bearer_token({}) is None
+    print('✅ token注销测试通过')
+
+
+if __name__ == '__main__':
+    test_verify_cache()
+    test_expiry_and_capacity()
+    test_revoke()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI对话会话（提示词组装、摘要触发条件）
+"""
+
+import os
+import sys
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.chat_sessions import ChatSessionStore
+
+
+def test_build_messages():
+    """依次为system提示词、滚动摘要、历史消息和本轮用户消息"""
+    store = ChatSessionStore()
+    session = {
+        'system_prompt': '你是助手',
+        'summary': '用户叫小明',
+        'messages': [
+            {'role': 'user', 'content': '你好', 'timestamp': '2026-10-18T10:00:00'},
+            {'role': 'assistant', 'content': '你好！', 'timestamp': '2026-10-18T10:00:01'}
+        ]
+    }
+    messages = store.build_messages(session, '我叫什么？')
+    assert [m['role'] for m in messages] == ['system', 'system', 'user', 'assistant', 'user']
+    assert '用户叫小明' in messages[1]['content']
+    assert messages[-1] == {'role': 'user', 'content': '我叫什么？'}
+    assert 'timestamp' not in messages[2]
+
+    # 新会话只有本轮消息
+    assert store.build_messages({'messages': []}, '你好') == [{'role': 'user', 'content': '你好'}]
+    print('✅ 会话提示词组装测试通过')
+
+
+def test_needs_summary():
+    """未摘要消息达到阈值且开启摘要时才触发"""
+    store = ChatSessionStore()
+    store.configure(summary_trigger=6)
+    assert not store.needs_summary(None)
+    assert not store.needs_summary({'unsummarized': 4})
+    assert store.needs_summary({'unsummarized': 6})
+    store.configure(summary_enabled=False, summary_trigger=6)
+    assert not store.needs_summary({'unsummarized': 10})
+    print('✅ 摘要触发条件测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试AI对话会话...')
+    test_build_messages()
+    test_needs_summary()
+    print('✅ 测试完成！')
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试萌芽币预扣（余额不足、只确认一次、退回幂等、超时预扣清理）以及
+verify_user_coins按响应状态结算（成功扣费，4xx/5xx、异常和客户端断开时退回）
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import Flask, g, jsonify
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import coins
+from modules.coins import reserve_coins, commit_reservation, refund_reservation, sweep_stale_reservations
+from modules.ai_admission import ai_admission
+from modules.ai_usage import usage_ledger
+from modules.deadline import current_deadline, init_deadline
+
+
+class FakeUpdateResult:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class FakeCursor(list):
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+class FakeUserdata:
+    """userdata集合中预扣用到的操作"""
+
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def _apply(self, doc, update):
+        for field, value in update.get('$inc', {}).items():
+            doc[field] = doc.get(field, 0) + value
+        for field, value in update.get('$push', {}).items():
+            doc.setdefault(field, []).append(value)
+        for field, condition in update.get('$pull', {}).items():
+            doc[field] = [item for item in doc.get(field, []) if item['id'] != condition['id']]
+
+    def _project(self, doc, projection):
+        if not projection:
+            return dict(doc)
+        return {key: doc[key] for key in ('_id', *projection) if key in doc}
+
+    def find_one(self, query, projection=None):
+        doc = self.docs.get(query['_id'])
+        return self._project(doc, projection) if doc else None
+
+    def find_one_and_update(self, query, update, projection=None, return_document=None):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            if doc is None or doc.get('萌芽币', 0) < query['萌芽币']['$gte']:
+                return None
+            self._apply(doc, update)
+            return self._project(doc, projection)
+
+    def update_one(self, query, update):
+        with self.lock:
+            doc = self.docs.get(query['_id'])
+            reservation_id = query.get('coin_reservations.id')
+            if doc is None or not any(r['id'] == reservation_id for r in doc.get('coin_reservations', [])):
+                return FakeUpdateResult(0)
+            self._apply(doc, update)
+            return FakeUpdateResult(1)
+
+    def find(self, query, projection=None):
+        cutoff = query['coin_reservations.created_at']['$lt']
+        return FakeCursor(
+            self._project(doc, projection) for doc in self.docs.values()
+            if any(r['created_at'] < cutoff for r in doc.get('coin_reservations', []))
+        )
+
+
+class FakeUsage:
+    def __init__(self):
+        self.docs = []
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+
+
+class FakeDB:
+    def __init__(self):
+        self.userdata = FakeUserdata()
+        self.ai_usage = FakeUsage()
+
+    def add_user(self, coins_balance):
+        user_id = ObjectId()
+        self.userdata.docs[user_id] = {'_id': user_id, '用户名': 'u', '邮箱': 'u@qq.com', '萌芽币': coins_balance}
+        return str(user_id)
+
+    def balance(self, user_id):
+        return self.userdata.docs[ObjectId(user_id)]['萌芽币']
+
+    def reservations(self, user_id):
+        return self.userdata.docs[ObjectId(user_id)].get('coin_reservations', [])
+
+
+def _no_sweep():
+    """避免预扣时在后台触发清理"""
+    coins._last_sweep = time.monotonic()
+    coins._coin_settings['sweep_interval'] = 3600
+
+
+def test_reserve_insufficient():
+    """余额不足时不扣费也不记录预扣"""
+    _no_sweep()
+    db = FakeDB()
+    user_id = db.add_user(50)
+    assert reserve_coins(db, user_id, 'chat', 100) == (None, None)
+    assert db.balance(user_id) == 50 and db.reservations(user_id) == []
+    print('✅ 余额不足测试通过')
+
+
+def test_commit_once():
+    """确认扣费只生效一次，已确认的预扣不能再退回"""
+    _no_sweep()
+    db = FakeDB()
+    user_id = db.add_user(300)
+    user, reservation = reserve_coins(db, user_id, 'chat', 100)
+    assert user['萌芽币'] == 200 and len(db.reservations(user_id)) == 1
+
+    assert commit_reservation(db, reservation)
+    assert not commit_reservation(db, reservation)
+    assert not refund_reservation(db, reservation)
+    assert db.balance(user_id) == 200 and db.reservations(user_id) == []
+
+    usage_ledger.flush()
+    assert [(doc['user_id'], doc['cost']) for doc in db.ai_usage.docs] == [(user_id, 100)]
+    print('✅ 确认扣费测试通过')
+
+
+def test_refund_idempotent():
+    """重复退回只退一次"""
+    _no_sweep()
+    db = FakeDB()
+    user_id = db.add_user(100)
+    _, reservation = reserve_coins(db, user_id, 'chat', 100)
+    assert db.balance(user_id) == 0
+    assert refund_reservation(db, reservation)
+    assert not refund_reservation(db, reservation)
+    assert not commit_reservation(db, reservation)
+    assert db.balance(user_id) == 100 and db.reservations(user_id) == []
+    print('✅ 退回幂等测试通过')
+
+
+def test_sweep_stale_reservations():
+    """超过预扣超时仍未结算的预扣被退回，未超时的保留"""
+    _no_sweep()
+    db = FakeDB()
+    user_id = db.add_user(300)
+    _, stale = reserve_coins(db, user_id, 'chat', 100)
+    _, fresh = reserve_coins(db, user_id, 'poetry', 100)
+    db.reservations(user_id)[0]['created_at'] = datetime.utcnow() - timedelta(
+        seconds=coins._coin_settings['reservation_timeout'] + 60
+    )
+    assert sweep_stale_reservations(db) == 1
+    assert db.balance(user_id) == 200
+    assert [r['id'] for r in db.reservations(user_id)] == [fresh['id']]
+    assert sweep_stale_reservations(db) == 0
+    print('✅ 超时预扣清理测试通过')
+
+
+def _settlement_app(db, user_id):
+    """挂载verify_user_coins的测试应用，跳过认证和准入控制"""
+    from modules.aimodelapp import verify_user_coins
+
+    app = Flask(__name__)
+    app.mongo = type('Mongo', (), {'db': db})()
+    init_deadline(app)
+
+    @app.before_request
+    def login():
+        g.principal = {'user_id': user_id}
+        g.auth_error = None
+
+    def view(status):
+        def handler():
+            if status == 'raise':
+                raise RuntimeError('上游连接中断')
+            if status == 'disconnect':
+                # 客户端断开时断开检测线程取消截止时间，AI调用返回"请求已取消"
+                if current_deadline().cancelled.wait(5):
+                    return jsonify({'error': '请求已取消'}), 500
+                return jsonify({'result': 'ok'})
+            return jsonify({'status': status}), status
+        handler.__name__ = f'view_{status}'
+        return verify_user_coins(handler)
+
+    for status in (200, 400, 502, 'raise', 'disconnect'):
+        app.add_url_rule(f'/ai/{status}', view_func=view(status), methods=['POST'])
+    return app
+
+
+def test_verify_user_coins_settlement():
+    """成功时扣费；4xx、5xx、异常和客户端断开时退回"""
+    _no_sweep()
+    ai_admission.configure(enabled=False)
+    db = FakeDB()
+    user_id = db.add_user(1000)
+    client = _settlement_app(db, user_id).test_client()
+    try:
+        assert client.post('/ai/200', json={}).status_code == 200
+        assert db.balance(user_id) == 900
+        for status, expected in (('400', 400), ('502', 502), ('raise', 500)):
+            assert client.post(f'/ai/{status}', json={}).status_code == expected
+            assert db.balance(user_id) == 900, status
+
+        server, peer = socket.socketpair()
+        threading.Timer(0.2, peer.close).start()
+        resp = client.post('/ai/disconnect', json={}, environ_overrides={'werkzeug.socket': server})
+        server.close()
+        assert resp.status_code == 504  # 截止时间已取消，500改为504
+        assert db.balance(user_id) == 900 and db.reservations(user_id) == []
+
+        # 余额不足时返回402，不调用接口
+        db.userdata.docs[ObjectId(user_id)]['萌芽币'] = 50
+        resp = client.post('/ai/200', json={})
+        assert resp.status_code == 402 and resp.get_json()['error_code'] == 'insufficient_coins'
+        assert db.balance(user_id) == 50
+    finally:
+        ai_admission.configure()
+    print('✅ 按响应状态结算测试通过')
+
+
+if __name__ == '__main__':
+    test_reserve_insufficient()
+    test_commit_once()
+    test_refund_idempotent()
+    test_sweep_stale_reservations()
+    test_verify_user_coins_settlement()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试对话上下文预算（token估算、历史裁剪、超长消息拒绝、预算配置）
+"""
+
+import os
+import sys
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.context_budget import ContextBudgeter, estimate_tokens, estimate_message_tokens
+
+
+def test_estimate_tokens():
+    """中文按字计数，英文按字符折算"""
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('你好世界') == 3  # 4 * 0.6 向上取整
+    assert estimate_tokens('hello world') == 4  # 11 * 0.3 向上取整
+    assert estimate_tokens('中' * 1000) > estimate_tokens('a' * 1000)
+    print('✅ token估算测试通过')
+
+
+def test_fit_keeps_system_and_recent_turns():
+    """超出预算时保留system提示词和最近对话，最早的对话被折叠"""
+    budgeter = ContextBudgeter()
+    budgeter.configure(budgets={'test-model': 300})
+    messages = [{'role': 'system', 'content': '你是一个助手'}]
+    for i in range(20):
+        messages.append({'role': 'user', 'content': f'第{i}个问题' + '内容' * 20})
+        messages.append({'role': 'assistant', 'content': f'第{i}个回答' + '内容' * 20})
+
+    assert budgeter.check(messages, 'test-model') is None
+    fitted, report = budgeter.fit(messages, 'test-model')
+    assert fitted[0] == messages[0]
+    assert fitted[-1] == messages[-1]
+    assert report['trimmed'] and report['dropped_messages'] > 0
+    assert report['sent_tokens_estimate'] <= 300
+    assert sum(estimate_message_tokens(m) for m in fitted) == report['sent_tokens_estimate']
+    if report['collapsed']:
+        assert fitted[1]['role'] == 'system' and '已省略' in fitted[1]['content']
+
+    # 未超出预算时原样发送
+    short = messages[:3]
+    fitted, report = budgeter.fit(short, 'test-model')
+    assert fitted == short and not report['trimmed']
+    print('✅ 历史裁剪测试通过')
+
+
+def test_check_rejects_oversized_message():
+    """单条消息超出预算时无法裁剪，直接拒绝"""
+    budgeter = ContextBudgeter()
+    budgeter.configure(budgets={'test-model': 100})
+    messages = [{'role': 'user', 'content': '长' * 500}]
+    assert '过长' in budgeter.check(messages, 'test-model')
+    assert budgeter.check([{'role': 'user', 'content': '短消息'}], 'test-model') is None
+    print('✅ 超长消息拒绝测试通过')
+
+
+def test_budgets_from_config():
+    """各模型预算只在Config.AI_CONTEXT_BUDGETS中配置，初始化前使用默认预算"""
+    from flask import Flask
+    from config import Config
+    from modules.context_budget import context_budgeter, init_context_budget
+
+    assert ContextBudgeter().budget_for('deepseek-chat') == 16000
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    init_context_budget(app)
+    assert context_budgeter.budgets == Config.AI_CONTEXT_BUDGETS
+    assert context_budgeter.budget_for('unknown-model') == Config.AI_CONTEXT_DEFAULT_BUDGET
+    print('✅ 预算配置测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试对话上下文预算...')
+    test_estimate_tokens()
+    test_fit_keeps_system_and_recent_turns()
+    test_check_rejects_oversized_message()
+    test_budgets_from_config()
+    print('✅ 测试完成！')
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI请求截止时间（请求头解析、按p99推算默认值、剩余时间约束重试）
+"""
+
+import os
+import sys
+import time
+import threading
+import contextvars
+
+# 加入后端根目录和测试目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer
+from modules import deadline as deadline_module
+from modules.deadline import (
+    Deadline, requested_timeout, default_timeout, start_deadline, end_deadline, current_deadline,
+    init_deadline, DEADLINE_ERROR
+)
+from modules.ai_client import chat_completion
+from modules.rate_limit import rate_limiter, MemoryBucketStore
+from modules.ai_metrics import ai_metrics
+
+
+def test_requested_timeout_and_default():
+    """相对超时、秒/毫秒时间戳都能解析；样本足够时默认值按p99推算"""
+    assert requested_timeout({'X-Request-Timeout': '30'}) == 30.0
+    assert 59 < requested_timeout({'X-Request-Deadline': str(time.time() + 60)}) <= 60
+    assert 59 < requested_timeout({'X-Request-Deadline': str(int((time.time() + 60) * 1000))}) <= 60
+    assert requested_timeout({'X-Request-Timeout': 'abc'}) is None
+    assert requested_timeout({}) is None
+
+    assert default_timeout('test.unknown') == deadline_module._deadline_settings['default']
+    for i in range(100):
+        deadline_module.endpoint_latency.record('test.endpoint', 5.0 if i < 98 else 20.0)
+    assert default_timeout('test.endpoint') == 40.0
+    print('✅ 截止时间解析测试通过')
+
+
+def test_deadline_cancel_and_can_start():
+    """取消时关联事件一并置位；剩余时间不足时不再允许发起尝试"""
+    deadline = Deadline(10)
+    event = threading.Event()
+    deadline.link(event)
+    assert deadline.can_start(5) and not deadline.can_start(5, delay=6)
+    deadline.cancel()
+    assert event.is_set() and deadline.expired() and not deadline.can_start()
+    print('✅ 取消与剩余时间测试通过')
+
+
+def test_retries_respect_deadline():
+    """上游持续失败时，剩余时间不够完成下一次尝试就不再重试；超时不超过截止时间"""
+    rate_limiter.configure(store=MemoryBucketStore())
+    ai_metrics.configure(enabled=False)
+    server = MockLLMServer(latency='fixed:0', error_rate=1.0).start()
+    config = {'api_key': 'test', 'api_base': server.url}
+    messages = [{'role': 'user', 'content': '你好'}]
+
+    def call_with_deadline(seconds):
+        start_deadline(seconds)
+        return chat_completion('deepseek', config, messages, 'deepseek-chat', max_retries=3)
+
+    try:
+        started = time.monotonic()
+        _, error = contextvars.copy_context().run(call_with_deadline, 4)
+        assert '500' in error
+        assert server.stats['requests'] == 1  # 退避1秒后剩余时间不足3秒，不再重试
+        assert time.monotonic() - started < 1
+
+        server.config.update({'error_rate': 0.0, 'latency': 'fixed:3'})
+        started = time.monotonic()
+        _, error = contextvars.copy_context().run(call_with_deadline, 1)
+        assert error == DEADLINE_ERROR
+        assert time.monotonic() - started < 2
+    finally:
+        server.stop()
+    print('✅ 截止时间约束重试测试通过')
+
+
+def test_end_deadline_restores_previous():
+    """结束截止时间时恢复之前的值；请求结束时由teardown恢复，线程复用时不会带到后续请求"""
+    from flask import Flask, g
+
+    def nested():
+        previous = current_deadline()
+        outer = start_deadline(30)
+        inner = start_deadline(5)
+        assert current_deadline() is inner
+        end_deadline(inner)
+        assert current_deadline() is outer
+        end_deadline(outer)
+        end_deadline(outer)  # 重复结束不报错
+        assert current_deadline() is previous
+
+        # 在其他线程中结束时忽略
+        other = start_deadline(5)
+        thread = threading.Thread(target=end_deadline, args=(other,))
+        thread.start()
+        thread.join()
+        assert current_deadline() is other
+    contextvars.copy_context().run(nested)
+
+    app = Flask(__name__)
+    init_deadline(app)
+    seen = []
+
+    @app.route('/ai')
+    def ai_view():
+        g.ai_deadline = start_deadline(10)
+        seen.append(current_deadline())
+        return 'ok'
+
+    def request_twice():
+        previous = current_deadline()
+        client = app.test_client()
+        assert client.get('/ai').status_code == 200
+        assert current_deadline() is previous
+        assert client.get('/ai').status_code == 200
+        assert current_deadline() is previous
+    contextvars.copy_context().run(request_twice)
+    assert len(seen) == 2 and seen[0] is not seen[1]
+    print('✅ 截止时间恢复测试通过')
+
+
+def test_upstream_marked():
+    """只有实际向上游发出请求的调用会标记upstream_called（用于只统计这类请求的耗时）"""
+    rate_limiter.configure(store=MemoryBucketStore())
+    ai_metrics.configure(enabled=False)
+    server = MockLLMServer(latency='fixed:0').start()
+    config = {'api_key': 'test', 'api_base': server.url}
+
+    def call(send):
+        deadline = start_deadline(10)
+        if send:
+            _, error = chat_completion('deepseek', config, [{'role': 'user', 'content': '你好'}], 'deepseek-chat')
+            assert error is None
+        return deadline.upstream_called
+
+    try:
+        assert contextvars.copy_context().run(call, True)
+        assert not contextvars.copy_context().run(call, False)
+    finally:
+        server.stop()
+    print('✅ 上游调用标记测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试AI请求截止时间...')
+    test_requested_timeout_and_default()
+    test_deadline_cancel_and_can_start()
+    test_retries_respect_deadline()
+    test_end_deadline_restores_previous()
+    test_upstream_marked()
+    print('✅ 测试完成！')
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI输出JSON提取（推理块和代码围栏、逐段输入、schema校验、JSON模式）
+"""
+
+import os
+import sys
+import json
+
+# 加入后端根目录和测试目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer
+from modules.json_extract import (
+    JSON_SCHEMAS, IncrementalJSONExtractor, extract_json, repair_messages
+)
+from modules.ai_client import chat_completion
+from modules.rate_limit import rate_limiter, MemoryBucketStore
+from modules.ai_metrics import ai_metrics
+
+OUTPUT = """<think>先想一想{不是JSON}，再输出</think>
+好的，结果如下：
+```json
+{"mandarin_title": "表哥", "notes": "含有括号}和\\"引号{的字符串", "dialect_titles": {"粤语": {"title": "表哥"}}}
+```
+以上。"""
+
+
+def test_extract_json():
+    """跳过推理块和围栏，字符串内的括号和转义引号不影响配对；不符合schema时给出原因"""
+    schema = JSON_SCHEMAS['kinship-calculator']
+    obj, error = extract_json(OUTPUT, schema)
+    assert error is None
+    assert obj['mandarin_title'] == '表哥' and obj['notes'] == '含有括号}和"引号{的字符串'
+
+    # 第一个候选对象无法解析时继续向后扫描
+    obj, error = extract_json('示例{称呼}，答案：{"mandarin_title": "舅妈"}', schema)
+    assert obj == {'mandarin_title': '舅妈'}
+
+    assert extract_json('{"notes": "无称呼"}', schema) == (None, '缺少字段mandarin_title')
+    assert extract_json('{"suggestions": ["userCount"]}', JSON_SCHEMAS['variable-naming']) == (None, '字段suggestions应为对象')
+    assert extract_json('{"mandarin_title": "表', schema)[1] == 'JSON对象不完整（输出可能被截断）'
+    assert extract_json('<think>{"mandarin_title": "错"}', schema) == (None, '未找到JSON对象')
+
+    prompt = repair_messages('<think>推理</think>{"notes": 1}', '缺少字段mandarin_title', schema)[0]['content']
+    assert '推理' not in prompt and 'mandarin_title' in prompt
+    print('✅ JSON提取测试通过')
+
+
+def test_incremental_feed():
+    """逐字符输入时结果与一次性提取相同，对象闭合后立即返回"""
+    extractor = IncrementalJSONExtractor(JSON_SCHEMAS['kinship-calculator'])
+    closed_at = OUTPUT.index('}}}') + 3
+    for index, char in enumerate(OUTPUT):
+        result = extractor.feed(char)
+        assert (result is not None) == (index + 1 >= closed_at)
+    assert result == extract_json(OUTPUT)[0]
+    assert extractor.finish() is None
+    print('✅ 逐段JSON提取测试通过')
+
+
+def test_json_mode_request():
+    """json_mode时向支持的提供商发送response_format"""
+    rate_limiter.configure(store=MemoryBucketStore())
+    ai_metrics.configure(enabled=False)
+    server = MockLLMServer(latency='fixed:0').start()
+    try:
+        config = {'api_key': 'test', 'api_base': server.url}
+        messages = [{'role': 'user', 'content': '随便说点什么，用JSON返回'}]
+        result, error = chat_completion('deepseek', config, messages, 'deepseek-chat', json_mode=True)
+        assert error is None
+        assert 'result' in json.loads(result['content'])
+        result, error = chat_completion('deepseek', config, messages, 'deepseek-chat')
+        assert error is None and not result['content'].startswith('{')
+    finally:
+        server.stop()
+    print('✅ JSON模式请求测试通过')
+
+
+if __name__ == '__main__':
+    test_extract_json()
+    test_incremental_feed()
+    test_json_mode_request()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试亲属称呼本地解析引擎
+"""
+
+import os
+import sys
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.kinship import resolve_kinship, parse_relation_chain, reduce_relations, MANDARIN_TITLES
+
+
+def test_resolve_common_chains():
+    """常见关系链直接解析出普通话称呼和六种默认方言称呼"""
+    cases = {
+        '妈妈的爸爸': '外公',
+        '爸爸的爸爸': '爷爷',
+        '爸爸的哥哥': '伯父',
+        '我的妈妈的妹妹': '小姨',  # 方言对照表未收录，方言称呼交由AI
+        '哥哥的爸爸的妈妈': '奶奶',
+        '爸爸的妻子': '妈妈',
+        '姐姐的哥哥': '哥哥',
+    }
+    for chain, expected in cases.items():
+        result = resolve_kinship(chain)
+        title = result['mandarin_title'] if result else None
+        print(f'{chain} -> {title}')
+        assert title == expected, chain
+
+    result = resolve_kinship('妈妈的爸爸', ['粤语'])
+    assert result['dialect_titles'] == {'粤语': {'title': '公公', 'romanization': 'gung4 gung1', 'notes': ''}}
+    assert result['missing_dialects'] == []
+
+
+def test_missing_dialects():
+    """对照表未收录的称呼或方言列在missing_dialects中，已收录的方言照常返回"""
+    result = resolve_kinship('妈妈的妹妹')
+    assert result['mandarin_title'] == '小姨' and result['dialect_titles'] == {}
+    assert result['missing_dialects'] == ['粤语', '闽南语', '上海话', '四川话', '东北话', '客家话']
+    assert result['notes'] == '母亲的妹妹'
+
+    result = resolve_kinship('妈妈的爸爸', ['粤语', '温州话'])
+    assert list(result['dialect_titles']) == ['粤语'] and result['missing_dialects'] == ['温州话']
+
+
+def _call_endpoint(relation_chain, dialects=None):
+    """跳过扣费直接调用接口，记录发给AI的方言"""
+    from flask import Flask
+    from modules import aimodelapp
+
+    sent = []
+
+    def fake_cached(endpoint, cache_input, messages, **kwargs):
+        sent.append(cache_input['dialects'])
+        titles = {d: {'title': f'{d}称呼', 'romanization': '', 'notes': ''} for d in cache_input['dialects']}
+        return {'mandarin_title': 'AI称呼', 'dialect_titles': titles, 'notes': 'AI说明'}, None, None
+
+    original = aimodelapp.call_deepseek_cached
+    aimodelapp.call_deepseek_cached = fake_cached
+    try:
+        app = Flask(__name__)
+        body = {'relation_chain': relation_chain}
+        if dialects:
+            body['dialects'] = dialects
+        with app.test_request_context(json=body, method='POST'):
+            resp = aimodelapp.kinship_calculator.__wrapped__()
+        return resp.get_json(), sent
+    finally:
+        aimodelapp.call_deepseek_cached = original
+
+
+def test_endpoint_merges_ai_dialects():
+    """接口只就未收录的方言调用AI，与本地结果合并，响应结构不变"""
+    body, sent = _call_endpoint('妈妈的爸爸', ['粤语', '温州话'])
+    assert sent == [['温州话']]
+    assert body['mandarin_title'] == '外公'
+    assert set(body['dialect_titles']) == {'粤语', '温州话'}
+    assert body['dialect_titles']['粤语']['title'] == '公公'
+    assert body['dialect_titles']['温州话']['title'] == '温州话称呼'
+    assert 'missing_dialects' not in body
+
+    body, sent = _call_endpoint('妈妈的爸爸')
+    assert sent == [] and len(body['dialect_titles']) == 6
+
+    body, sent = _call_endpoint('爸爸的儿子')
+    assert len(sent[0]) == 6 and body['mandarin_title'] == 'AI称呼'
+
+
+def test_unresolvable_chains():
+    """涉及自身性别、长幼或未知关系词的链交由AI处理"""
+    assert resolve_kinship('爸爸的儿子') is None  # 可能是自己，也可能是兄弟
+    assert resolve_kinship('哥哥的弟弟') is None  # 可能是自己
+    assert resolve_kinship('爸爸的表哥') is None  # 未收录的关系词
+    assert resolve_kinship('') is None
+
+
+def test_reduce_relations():
+    """化简规则与关系表一致"""
+    assert reduce_relations(parse_relation_chain('丈夫的妻子')) == ()
+    assert reduce_relations(parse_relation_chain('妹妹的妈妈的哥哥')) == ('m', 'ob')
+    assert MANDARIN_TITLES[reduce_relations(parse_relation_chain('妹妹的妈妈的哥哥'))][0] == '舅舅'
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试亲属称呼解析引擎...')
+    test_resolve_common_chains()
+    test_missing_dialects()
+    test_endpoint_merges_ai_dialects()
+    test_unresolvable_chains()
+    test_reduce_relations()
+    print('✅ 测试完成！')
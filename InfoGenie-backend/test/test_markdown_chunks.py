@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试长文排版分块（按标题和段落切块、代码块不拆开、有界并发、拼接与目录）
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.context_budget import estimate_tokens
+from modules.markdown_chunks import split_markdown, is_heading, stitch, map_bounded
+
+ARTICLE = '\n\n'.join(
+    f'第{index}章 标题{index}\n' + '这是一段很长的正文内容。' * 30 for index in range(1, 6)
+) + '\n\n```python\nprint("a")\n\nprint("b")\n```\n'
+
+
+def test_split_markdown():
+    """分块不超过预算且从标题开始，代码块不被拆开，拼接后与原文一致"""
+    chunks = split_markdown(ARTICLE, 400)
+    assert ''.join(chunks) == ARTICLE
+    assert len(chunks) == 5
+    assert all(estimate_tokens(chunk) <= 400 for chunk in chunks)
+    assert all(is_heading(chunk.splitlines()[0]) for chunk in chunks)
+    assert sum('```python' in chunk for chunk in chunks) == 1 and chunks[-1].endswith('```\n')
+
+    # 超长段落按句切分
+    paragraph = '很长的一句话。' * 400
+    pieces = split_markdown(paragraph, 300)
+    assert len(pieces) > 1 and ''.join(pieces) == paragraph
+    assert all(piece.endswith('。') for piece in pieces)
+    print('✅ 长文分块测试通过')
+
+
+def test_stitch():
+    """去掉最外层围栏，标题不少于3个时在文章标题后生成目录"""
+    body = stitch(['# 文章\n\n## 一\n内容', '```markdown\n## 二\n### 二点一\n内容\n```'])
+    assert body.startswith('# 文章\n\n## 📑 目录\n\n- 一\n- 二\n  - 二点一\n\n## 一')
+    assert '```' not in body
+    assert stitch(['## 一\n内容', '## 二\n内容']) == '## 一\n内容\n\n## 二\n内容'
+    print('✅ 分块拼接测试通过')
+
+
+def test_map_bounded():
+    """按原顺序产出结果，同时执行的任务数不超过并发上限"""
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def work(value):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.05 * (5 - value))
+        with lock:
+            running[0] -= 1
+        return value * 2
+
+    started = time.monotonic()
+    assert list(map_bounded(work, range(5), parallelism=3)) == [0, 2, 4, 6, 8]
+    assert running[1] == 3
+    assert time.monotonic() - started < 0.05 * 15
+    print('✅ 有界并发测试通过')
+
+
+if __name__ == '__main__':
+    test_split_markdown()
+    test_stitch()
+    test_map_bounded()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试数据库迁移（执行记录与幂等、失败时停止）以及热点查询的explain()计划均使用索引
+explain检查需要可连接的MongoDB（MONGO_TEST_URI，默认本机），在临时数据库中执行后删除
+"""
+
+import os
+import sys
+import pytest
+from datetime import datetime
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.migrations import run_migrations, migration_status, migration_health, init_migrations, MigrationError
+
+# 热点查询：(集合, 查询条件, 排序)
+HOT_QUERIES = [
+    ('userdata', {'邮箱': 'a@qq.com'}, None),
+    ('userdata', {'用户名': 'a'}, None),
+    ('userdata', {'_id': ObjectId()}, None),
+    ('userdata', {'coin_reservations.created_at': {'$lt': datetime.utcnow()}}, None),
+    ('ai_usage', {'user_id': 'u1'}, [('timestamp', -1)]),
+    ('ai_jobs', {'user_id': 'u1'}, [('created_at', -1)]),
+    ('chat_sessions', {'user_id': 'u1'}, [('updated_at', -1)]),
+    ('ai_metrics', {'hour': '2026-10-18T10'}, None),
+    ('ai_response_cache', {'expires_at': {'$lt': datetime.utcnow()}}, None)
+]
+
+
+class FakeMigrationCollection:
+    def __init__(self):
+        self.docs = {}
+
+    def find(self, query=None, projection=None):
+        return [dict(doc, _id=key) for key, doc in self.docs.items()]
+
+    def update_one(self, query, update, upsert=False):
+        self.docs.setdefault(query['_id'], update['$setOnInsert'])
+
+
+class FakeDB:
+    def __init__(self, reachable=True):
+        self.schema_migrations = FakeMigrationCollection()
+        self.reachable = reachable
+
+    def command(self, name):
+        if not self.reachable:
+            raise PyMongoError('connection refused')
+        return {'ok': 1}
+
+
+class FakeLogger:
+    def __init__(self):
+        self.errors = []
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+class FakeApp:
+    def __init__(self, db, **config):
+        self.mongo = type('Mongo', (), {'db': db})()
+        self.config = config
+        self.logger = FakeLogger()
+
+
+def test_run_migrations():
+    """按顺序执行并记录，已执行的迁移不再执行；某个迁移失败时停止且不记录"""
+    calls = []
+
+    def failing(db):
+        raise MigrationError('重复数据')
+
+    migrations = [
+        ('0001_a', 'A', lambda db: calls.append('a')),
+        ('0002_b', 'B', failing),
+        ('0003_c', 'C', lambda db: calls.append('c'))
+    ]
+    db = FakeDB()
+    assert run_migrations(db, migrations) == (['0001_a'], '0002_b: 重复数据')
+    migrations[1] = ('0002_b', 'B', lambda db: calls.append('b'))
+    assert run_migrations(db, migrations) == (['0002_b', '0003_c'], None)
+    assert run_migrations(db, migrations) == ([], None)
+    assert calls == ['a', 'b', 'c']
+    assert all(applied_at for _, _, applied_at in migration_status(db, migrations))
+    print('✅ 迁移执行记录测试通过')
+
+
+def test_startup_failure_reported():
+    """启动迁移失败时记录错误日志并在健康检查中显示；MIGRATIONS_REQUIRED开启时启动失败"""
+    app = FakeApp(FakeDB(reachable=False))
+    init_migrations(app)
+    health = migration_health()
+    assert health['status'] == 'error' and '数据库不可用' in health['error']
+    assert len(app.logger.errors) == 1
+
+    # FakeDB没有userdata集合，第一个迁移失败
+    app = FakeApp(FakeDB(), MIGRATIONS_REQUIRED=True)
+    try:
+        init_migrations(app)
+        assert False, '迁移失败时应终止启动'
+    except MigrationError as e:
+        assert str(e).startswith('0001_')
+    assert migration_health()['status'] == 'error' and app.logger.errors
+
+    init_migrations(FakeApp(FakeDB(), MIGRATIONS_ON_STARTUP=False))
+    assert migration_health()['status'] == 'disabled'
+    print('✅ 启动迁移失败报告测试通过')
+
+
+def _plan_stages(plan):
+    """递归收集执行计划中的所有stage"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+def test_hot_queries_use_indexes():
+    """迁移后每个热点查询的执行计划都走索引而不是全集合扫描"""
+    uri = os.environ.get('MONGO_TEST_URI', 'mongodb://localhost:27017')
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        pytest.skip(f'无法连接MongoDB（{uri}），跳过explain检查')
+
+    db = client[f'InfoGenie_migration_test_{os.getpid()}']
+    try:
+        db.userdata.insert_many([
+            {'邮箱': f'user{index}@qq.com', '用户名': f'user{index}', '萌芽币': index} for index in range(20)
+        ] + [{'账号': 'legacy1'}, {'账号': 'legacy2'}])
+        done, error = run_migrations(db)
+        assert error is None, error
+        assert len(done) == len(migration_status(db))
+
+        for collection, query, sort in HOT_QUERIES:
+            cursor = db[collection].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            stages = _plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+            assert 'COLLSCAN' not in stages, f'{collection} {query} 全集合扫描: {stages}'
+            assert any('IXSCAN' in stage or stage == 'IDHACK' for stage in stages), stages
+
+        # 唯一索引生效；重复执行不会重复建索引或记录
+        try:
+            db.userdata.insert_one({'邮箱': 'user1@qq.com', '用户名': 'other'})
+            assert False, '邮箱应唯一'
+        except PyMongoError:
+            pass
+        assert run_migrations(db) == ([], None)
+        print('✅ 热点查询索引测试通过')
+    finally:
+        client.drop_database(db.name)
+
+
+if __name__ == '__main__':
+    test_run_migrations()
+    test_startup_failure_reported()
+    test_hot_queries_use_indexes()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试本地模拟AI服务商（固定返回内容、普通和流式补全、故障注入）
+"""
+
+import os
+import sys
+import json
+
+# 加入后端根目录和测试目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer, canned_content, sample_latency
+from modules.ai_client import chat_completion, open_chat_stream
+from modules.rate_limit import rate_limiter, MemoryBucketStore
+from modules.ai_metrics import ai_metrics
+
+
+def test_canned_content_matches_parsers():
+    """各接口提示词对应的返回内容是含有解析所需字段的JSON"""
+    expected = {
+        '你是一个专业的变量命名助手': 'suggestions',
+        '你是一个专业的表情符号专家': 'expressions',
+        '你是一位中国亲属称呼专家': 'mandarin_title',
+        '你是一位Linux系统专家': 'commands'
+    }
+    for prompt, field in expected.items():
+        body = json.loads(canned_content([{'role': 'user', 'content': prompt}]))
+        assert field in body
+    assert sample_latency('uniform:0.1,0.2') <= 0.2
+    assert sample_latency('normal:-5,0.1') == 0.0
+    print('✅ 固定返回内容测试通过')
+
+
+def test_completion_and_stream():
+    """普通补全返回usage，流式补全逐段返回同样的内容，500按比例注入"""
+    # 其他测试创建过应用时，限额和指标可能指向真实数据库，这里改用进程内存储
+    rate_limiter.configure(store=MemoryBucketStore())
+    ai_metrics.configure(enabled=False)
+    server = MockLLMServer(latency='fixed:0', token_interval=0).start()
+    try:
+        config = {'api_key': 'test', 'api_base': server.url}
+        messages = [{'role': 'user', 'content': '你是一位中国亲属称呼专家'}]
+        result, error = chat_completion('deepseek', config, messages, 'deepseek-chat', max_retries=1)
+        assert error is None
+        assert json.loads(result['content'])['mandarin_title'] == '表哥'
+        assert result['usage']['completion_tokens'] > 0
+
+        stream, error = open_chat_stream('kimi', config, messages, 'kimi-k2-0905-preview', max_retries=1)
+        assert error is None
+        assert ''.join(stream) == result['content']
+        assert stream.finish_reason == 'stop' and stream.usage
+
+        server.config['error_rate'] = 1.0
+        _, error = chat_completion('deepseek', config, messages, 'deepseek-chat', max_retries=1)
+        assert '500' in error
+        assert server.stats['requests'] == 3 and server.stats['errors'] == 1
+    finally:
+        server.stop()
+    print('✅ 模拟补全测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试模拟AI服务商...')
+    test_canned_content_matches_parsers()
+    test_completion_and_stream()
+    print('✅ 测试完成！')
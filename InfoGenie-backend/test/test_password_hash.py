@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试密码哈希进程池（校验、旧参数识别、排队上限）
+"""
+
+import os
+import sys
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from modules import password_hash
+from modules.password_hash import PasswordHashBusy, hash_password, check_password, needs_rehash
+
+
+def test_hash_in_pool():
+    """在进程池中生成和校验哈希，成本参数变化后旧哈希需要升级"""
+    password_hash._hash_settings.update(method='pbkdf2:sha256:1000', workers=1, max_pending=4)
+    stored = hash_password('secret123')
+    assert stored.startswith('pbkdf2:sha256:1000$')
+    assert check_password(stored, 'secret123') and not check_password(stored, 'wrong')
+    assert not check_password(None, 'secret123')
+    assert not needs_rehash(stored)
+    assert needs_rehash(generate_password_hash('secret123', 'pbkdf2:sha256:2000'))
+    print('✅ 进程池哈希测试通过')
+
+
+def test_queue_limit():
+    """排队的哈希达到上限时立即拒绝"""
+    password_hash._hash_settings.update(method='pbkdf2:sha256:1000', workers=1, max_pending=1)
+    password_hash._executor = None
+    password_hash._get_executor()
+    password_hash._slots.acquire()
+    try:
+        try:
+            hash_password('secret123')
+            assert False, '排队已满时应拒绝'
+        except PasswordHashBusy:
+            pass
+    finally:
+        password_hash._slots.release()
+    assert check_password(hash_password('secret123'), 'secret123')
+    print('✅ 排队上限测试通过')
+
+
+def test_method_prefix():
+    """前缀按werkzeug的规则补全省略的参数，与实际生成的哈希一致；判断是否需要升级时不使用进程池"""
+    for method in ('pbkdf2', 'pbkdf2:sha512', 'pbkdf2:sha256:1000', 'scrypt', 'scrypt:16384:8:1'):
+        expected = generate_password_hash('secret123', method).split('$', 1)[0]
+        assert password_hash._method_prefix(method) == expected, method
+
+    password_hash._hash_settings.update(method='pbkdf2', workers=1)
+    password_hash._executor = None
+    assert not needs_rehash(generate_password_hash('secret123', 'pbkdf2'))
+    assert needs_rehash(generate_password_hash('secret123', 'scrypt'))
+    assert password_hash._executor is None
+    print('✅ 算法前缀测试通过')
+
+
+def test_inline():
+    """workers为0时在当前线程计算"""
+    password_hash._hash_settings.update(method='pbkdf2:sha256:1000', workers=0)
+    assert check_password(hash_password('secret123'), 'secret123')
+    print('✅ 当前线程哈希测试通过')
+
+
+if __name__ == '__main__':
+    test_hash_in_pool()
+    test_queue_limit()
+    test_method_prefix()
+    test_inline()
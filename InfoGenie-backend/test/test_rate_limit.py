@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试AI服务商限额令牌桶（取令牌、按usage修正、按响应头校准）
+"""
+
+import os
+import sys
+import threading
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.rate_limit import RateLimiter, MemoryBucketStore, parse_reset_seconds, init_rate_limiter
+
+
+def _limiter(rpm, tpm):
+    limiter = RateLimiter()
+    limiter.configure(limits={'test': {'rpm': rpm, 'tpm': tpm}}, max_wait=0, store=MemoryBucketStore())
+    return limiter
+
+
+def test_parse_reset_seconds():
+    """支持纯秒数和"6m0s"、"200ms"等时长格式"""
+    assert parse_reset_seconds('2') == 2.0
+    assert parse_reset_seconds('6m0s') == 360.0
+    assert abs(parse_reset_seconds('1s200ms') - 1.2) < 1e-9
+    assert parse_reset_seconds(None) is None
+    assert parse_reset_seconds('soon') is None
+    print('✅ 重置时间解析测试通过')
+
+
+def test_request_and_token_buckets():
+    """请求数或token数用尽后不再放行，usage修正会影响后续调用"""
+    limiter = _limiter(rpm=3, tpm=1000)
+    assert limiter.acquire('test', 'm', 100)
+    assert limiter.acquire('test', 'm', 100)
+    assert limiter.acquire('test', 'm', 100)
+    assert not limiter.acquire('test', 'm', 100)
+
+    limiter = _limiter(rpm=100, tpm=1000)
+    assert limiter.acquire('test', 'm', 400)
+    # 实际用量比估算多出500，桶内只剩约100
+    limiter.record_usage('test', 'm', 400, {'total_tokens': 900})
+    assert not limiter.acquire('test', 'm', 400)
+
+    # 未配置限额的提供商不限流
+    assert limiter.acquire('other', 'm', 10 ** 9)
+    print('✅ 令牌桶测试通过')
+
+
+def test_refund_on_token_bucket_failure():
+    """token桶超时或被取消时退回已取出的请求令牌"""
+    limiter = _limiter(rpm=3, tpm=1000)
+    assert limiter.acquire('test', 'm', 900)
+    assert not limiter.acquire('test', 'm', 900)  # token不足，请求令牌退回
+    assert limiter.acquire('test', 'm', 10)
+    assert limiter.acquire('test', 'm', 10)
+    assert not limiter.acquire('test', 'm', 10)  # 3个请求令牌用完
+
+    limiter = _limiter(rpm=2, tpm=1000)
+    limiter.max_wait = 60
+    cancelled = threading.Event()
+    cancelled.set()
+    assert limiter.acquire('test', 'm', 900)
+    assert not limiter.acquire('test', 'm', 900, cancel_event=cancelled)
+    limiter.max_wait = 0
+    assert limiter.acquire('test', 'm', 10)
+    print('✅ 令牌退回测试通过')
+
+
+def test_limits_from_config():
+    """限额只在Config.AI_RATE_LIMITS中配置，初始化前不限流"""
+    from flask import Flask
+    from config import Config
+
+    assert RateLimiter().limits == {}
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['AI_RATE_LIMIT_STORE'] = 'memory'
+    init_rate_limiter(app)
+    from modules.rate_limit import rate_limiter
+    assert rate_limiter.limits == Config.AI_RATE_LIMITS
+    print('✅ 限额配置测试通过')
+
+
+def test_resync_from_headers():
+    """以提供商返回的剩余额度为准，额度为0时给出重置等待时间"""
+    limiter = _limiter(rpm=100, tpm=100000)
+    reset = limiter.resync('test', 'm', {
+        'x-ratelimit-remaining-requests': '0',
+        'x-ratelimit-reset-requests': '1.5s'
+    })
+    assert reset == 1.5
+    assert not limiter.acquire('test', 'm', 10)
+    assert limiter.resync('test', 'm', {'Retry-After': '3'}) == 3.0
+    print('✅ 响应头校准测试通过')
+
+
+if __name__ == '__main__':
+    print('🔧 开始测试AI服务商限额...')
+    test_parse_reset_seconds()
+    test_request_and_token_buckets()
+    test_resync_from_headers()
+    test_refund_on_token_bucket_failure()
+    test_limits_from_config()
+    print('✅ 测试完成！')
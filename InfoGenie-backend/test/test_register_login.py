@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试注册时重复键错误到提示信息的映射，以及唯一索引建立前的查重回退
+"""
+
+import os
+import sys
+from flask import Flask
+from pymongo.errors import DuplicateKeyError
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import auth as auth_module
+from modules import migrations
+from modules.auth import auth_bp, duplicate_key_field
+
+
+class FakeUserCollection:
+    """userdata集合：indexes为index_information()的结果，有唯一索引时插入重复邮箱报错"""
+
+    def __init__(self, indexes):
+        self.docs = []
+        self.indexes = indexes
+        self.lookups = 0
+
+    def index_information(self):
+        return self.indexes
+
+    def find_one(self, query, projection=None):
+        self.lookups += 1
+        return next((doc for doc in self.docs if all(doc.get(k) == v for k, v in query.items())), None)
+
+    def insert_one(self, doc):
+        if '邮箱_unique' in self.indexes and any(d['邮箱'] == doc['邮箱'] for d in self.docs):
+            raise DuplicateKeyError('E11000', 11000, {'keyPattern': {'邮箱': 1}})
+        self.docs.append(doc)
+        return type('Result', (), {'inserted_id': len(self.docs)})()
+
+
+def test_duplicate_key_field():
+    """优先使用keyPattern/keyValue，其次按错误信息中的索引名判断"""
+    error = DuplicateKeyError('E11000 duplicate key error', 11000, {'keyPattern': {'用户名': 1}, 'keyValue': {'用户名': 'a'}})
+    assert duplicate_key_field(error) == '用户名'
+    error = DuplicateKeyError('E11000', 11000, {'keyValue': {'邮箱': 'a@qq.com'}})
+    assert duplicate_key_field(error) == '邮箱'
+    error = DuplicateKeyError('E11000', 11000, {'errmsg': 'E11000 duplicate key error collection: InfoGenie.userdata index: 邮箱_unique dup key'})
+    assert duplicate_key_field(error) == '邮箱'
+    assert duplicate_key_field(DuplicateKeyError('E11000 Duplicate Key Error')) is None
+    print('✅ 重复键字段测试通过')
+
+
+def _register(client, email, username):
+    return client.post('/api/auth/register', json={
+        'email': email, 'username': username, 'password': 'secret123', 'code': '123456'
+    })
+
+
+def test_register_precheck_until_unique_indexes():
+    """唯一索引未建立时先查重；index_information()显示两个唯一索引后只靠插入查重"""
+    original = auth_module.verify_code, auth_module.hash_password
+    auth_module.verify_code = lambda email, code: {'success': True, 'type': 'register'}
+    auth_module.hash_password = lambda password: 'hash'
+    app = Flask(__name__)
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    client = app.test_client()
+    try:
+        # 迁移0001未完成：没有唯一索引，重复邮箱、用户名由查询拦截
+        migrations._unique_index_check.update(ready=False, checked_at=None)
+        users = FakeUserCollection({'_id_': {'key': [('_id', 1)]}})
+        app.mongo = type('Mongo', (), {'db': type('DB', (), {'userdata': users})()})()
+        assert _register(client, '10001@qq.com', 'a').status_code == 201
+        resp = _register(client, '10001@qq.com', 'b')
+        assert resp.status_code == 409 and resp.get_json()['message'] == '该邮箱已被注册'
+        resp = _register(client, '10002@qq.com', 'a')
+        assert resp.status_code == 409 and resp.get_json()['message'] == '该用户名已被使用'
+        assert len(users.docs) == 1
+
+        # 唯一索引已建立：不再查询，重复键错误映射为原有提示
+        migrations._unique_index_check.update(ready=False, checked_at=None)
+        users.indexes = {
+            '邮箱_unique': {'key': [('邮箱', 1)], 'unique': True},
+            '用户名_unique': {'key': [('用户名', 1)], 'unique': True}
+        }
+        users.lookups = 0
+        resp = _register(client, '10001@qq.com', 'c')
+        assert resp.status_code == 409 and resp.get_json()['message'] == '该邮箱已被注册'
+        assert _register(client, '10003@qq.com', 'd').status_code == 201
+        assert users.lookups == 0
+    finally:
+        auth_module.verify_code, auth_module.hash_password = original
+        migrations._unique_index_check.update(ready=False, checked_at=None)
+    print('✅ 唯一索引建立前查重回退测试通过')
+
+
+if __name__ == '__main__':
+    test_duplicate_key_field()
+    test_register_precheck_until_unique_indexes()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试翻译记忆（中英文分句、译文拼接、本地语言检测、记忆键）
+"""
+
+import os
+import sys
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.translation_memory import (
+    TranslationMemory, split_segments, join_segments, needs_translation, detect_language, language_matches
+)
+
+
+def test_split_segments():
+    """中文标点后直接分句，英文句点需后跟空白且不是缩写；分隔符原样保留"""
+    cases = {
+        '今天天气很好。我们去公园吧！「真的吗？」他问。': ['今天天气很好。', '我们去公园吧！', '「真的吗？」', '他问。'],
+        'Hello Mr. Smith. Version 3.14 is out... Great!': ['Hello Mr. Smith.', 'Version 3.14 is out...', 'Great!'],
+        '第一段\n\n第二段。  \n第三段': ['第一段', '第二段。', '第三段']
+    }
+    for text, expected in cases.items():
+        segments = split_segments(text)
+        assert [segment for segment, _ in segments] == expected
+        assert ''.join(segment + separator for segment, separator in segments) == text
+    assert not needs_translation('123。') and needs_translation('OK.')
+    print('✅ 分句测试通过')
+
+
+def test_join_segments():
+    """译成中文时去掉行内空格，译成英文时在紧挨的句段间补空格，换行保留"""
+    pieces = [('你好。', ' '), ('再见。', '\n\n'), ('谢谢。', '')]
+    assert join_segments(pieces, 'zh-CN') == '你好。再见。\n\n谢谢。'
+    pieces = [('Hello.', ''), ('Bye.', '\n'), ('Thanks.', '')]
+    assert join_segments(pieces, 'en') == 'Hello. Bye.\nThanks.'
+    print('✅ 译文拼接测试通过')
+
+
+def test_detect_language():
+    """按书写系统和高频虚词检测语言，无法确定时不短路"""
+    assert detect_language('我们去公园吧') == 'zh-CN'
+    assert detect_language('這個問題很難') == 'zh-TW'
+    assert detect_language('你好') == 'zh'
+    assert detect_language('こんにちは、元気ですか') == 'ja'
+    assert detect_language('안녕하세요') == 'ko'
+    assert detect_language('The cat is on the mat and it is happy') == 'en'
+    assert detect_language('Le chat est sur la table et je suis content') == 'fr'
+    assert detect_language('Python是什么') is None
+    assert detect_language('hello') is None
+
+    assert language_matches('zh', 'zh-TW') and language_matches('en', 'en')
+    assert not language_matches('zh-CN', 'zh-TW') and not language_matches(None, 'en')
+    print('✅ 语言检测测试通过')
+
+
+def test_memory_key():
+    """记忆键区分目标语言和模型，忽略空白差异和源语言的简繁检测结果"""
+    memory = TranslationMemory()
+    key = memory.make_key('zh-CN', 'en', 'deepseek-chat', '你好。')
+    assert key == memory.make_key('zh', 'en', 'deepseek-chat', ' 你好。 ')
+    assert key != memory.make_key('zh-CN', 'ja', 'deepseek-chat', '你好。')
+    assert key != memory.make_key('zh-CN', 'en', 'kimi-k2-0905-preview', '你好。')
+    print('✅ 记忆键测试通过')
+
+
+if __name__ == '__main__':
+    test_split_segments()
+    test_join_segments()
+    test_detect_language()
+    test_memory_key()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试用户文档缓存（请求内复用、按版本复核、写入后失效、字段投影）
+"""
+
+import os
+import sys
+from bson import ObjectId
+from flask import Flask
+
+# 加入后端根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.user_cache import UserCache, versioned
+
+
+class FakeCollection:
+    """记录查询次数的userdata集合"""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.queries = []
+
+    def find_one(self, query, projection=None):
+        self.queries.append(projection)
+        version = query.get('version')
+        if isinstance(version, dict):
+            if 'version' in self.doc:
+                return None
+        elif version is not None and self.doc.get('version') != version:
+            return None
+        return {key: value for key, value in self.doc.items() if not projection or projection.get(key, 1)}
+
+
+class FakeDB:
+    def __init__(self, doc):
+        self.userdata = FakeCollection(doc)
+
+
+def test_versioned():
+    """在原有$inc之外加入版本递增，不修改传入的更新语句"""
+    update = {'$inc': {'萌芽币': 5}, '$set': {'a': 1}}
+    assert versioned(update) == {'$inc': {'萌芽币': 5, 'version': 1}, '$set': {'a': 1}}
+    assert update == {'$inc': {'萌芽币': 5}, '$set': {'a': 1}}
+    print('✅ 版本递增测试通过')
+
+
+def test_request_and_worker_cache():
+    """同一请求只查一次；免复核期内跨请求直接使用快照；过期后只复核版本"""
+    user_id = str(ObjectId())
+    db = FakeDB({'_id': ObjectId(user_id), '用户名': 'u', '萌芽币': 10, '密码': 'x'})
+    cache = UserCache()
+    cache.configure(ttl=60)
+    app = Flask(__name__)
+
+    with app.test_request_context():
+        assert cache.get(db, user_id, ['萌芽币']) == {'_id': ObjectId(user_id), '萌芽币': 10}
+        assert '密码' not in cache.get(db, user_id)
+    with app.test_request_context():
+        assert cache.get(db, user_id)['用户名'] == 'u'
+    assert len(db.userdata.queries) == 1
+    assert cache.stats()['request_hits'] == 1 and cache.stats()['hits'] == 1
+
+    cache.ttl = 0
+    with app.test_request_context():
+        assert cache.get(db, user_id)['萌芽币'] == 10
+    assert db.userdata.queries[-1] == {'_id': 1} and cache.stats()['revalidated'] == 1
+
+    # 其他worker写入后版本变化，复核失败时重新读取
+    db.userdata.doc.update({'萌芽币': 20, 'version': 1})
+    with app.test_request_context():
+        assert cache.get(db, user_id)['萌芽币'] == 20
+    assert cache.stats()['misses'] == 2
+    print('✅ 请求内与worker缓存测试通过')
+
+
+def test_invalidate():
+    """本worker写入后立即失效，请求内的快照也一并清除"""
+    user_id = str(ObjectId())
+    db = FakeDB({'_id': ObjectId(user_id), '萌芽币': 10, 'version': 3})
+    cache = UserCache()
+    cache.configure(ttl=60)
+    app = Flask(__name__)
+
+    with app.test_request_context():
+        assert cache.get(db, user_id)['萌芽币'] == 10
+        db.userdata.doc.update({'萌芽币': 5, 'version': 4})
+        cache.invalidate(user_id)
+        assert cache.get(db, user_id)['萌芽币'] == 5
+    assert len(db.userdata.queries) == 2
+    print('✅ 写入失效测试通过')
+
+
+if __name__ == '__main__':
+    test_versioned()
+    test_request_and_worker_cache()
+    test_invalidate()
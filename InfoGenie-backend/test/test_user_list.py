@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-测试列出所有用户的HTTP接口 (/api/user/list)
+测试列出所有用户的HTTP接口 (/api/user/list)，以及查询时不读取密码、使用记录和预扣记录
 """
 
 import os
@@ -12,11 +12,51 @@ from datetime import datetime
 # 将后端根目录加入路径，便于导入app
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from flask import Flask, g
 from app import create_app
 from modules.auth import generate_token
+from modules.user_management import user_bp
 from werkzeug.security import generate_password_hash
 
 
+class FakeUserdata:
+    """记录find使用的投影"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.projections = []
+
+    def find(self, query, projection=None):
+        self.projections.append(projection)
+        return [
+            {k: v for k, v in doc.items() if not projection or k not in projection}
+            for doc in self.docs
+        ]
+
+
+def test_list_projection():
+    """列表查询用投影排除密码、ai_usage_history和coin_reservations，不把大数组读出数据库"""
+    userdata = FakeUserdata([{
+        '_id': 'u1', '邮箱': 'u1@qq.com', '用户名': 'u1', '密码': 'hash',
+        'ai_usage_history': [{'api_type': 'chat'}] * 100, 'coin_reservations': [{'id': 'r1'}]
+    }])
+    app = Flask(__name__)
+    app.mongo = type('Mongo', (), {'db': type('DB', (), {'userdata': userdata})()})()
+    app.register_blueprint(user_bp, url_prefix='/api/user')
+
+    @app.before_request
+    def login():
+        g.principal = {'user_id': 'u1'}
+        g.auth_error = None
+
+    resp = app.test_client().get('/api/user/list')
+    assert resp.status_code == 200 and resp.get_json()['count'] == 1
+    projection = userdata.projections[0]
+    for field in ('密码', 'ai_usage_history', 'coin_reservations'):
+        assert projection.get(field) == 0, field
+    print('✅ 用户列表投影测试通过')
+
+
 def run_test():
     """运行用户列表接口测试，输出真实数据"""
     # 使用.env中的真实Mongo配置，不造假
@@ -77,5 +117,6 @@ def run_test():
 
 if __name__ == '__main__':
     print('🔎 开始测试 /api/user/list 接口...')
+    test_list_projection()
     run_test()
     print('✅ 测试完成！')
\ No newline at end of file